@@ -0,0 +1,216 @@
+"""Benchmarks of the database layer.
+
+Run with ``python -m benchmarks.bench_core``. A temporary database is used,
+so the real history is never touched.
+"""
+
+import sqlite3
+import tempfile
+import timeit
+from datetime import date, timedelta
+from pathlib import Path
+
+from lens_db.core import DBConnection, Lens, pool
+from lens_db.migrations import DEFAULT_USER_ID, migrate
+from lens_db.settings import Settings, set_settings
+from lens_db.simulator import simulate
+from lens_db.utils import from_ordinal, to_ordinal
+
+CALLS = 2000
+
+
+def report(name, seconds, calls=CALLS):
+    print("%-30s %8.1f us/call" % (name, seconds / calls * 1e6))
+
+
+def connect_per_call(path):
+    """Previous behaviour: connect, check the schema, commit and close."""
+    connection = sqlite3.connect(path)
+    cursor = connection.cursor()
+    cursor.execute(
+        "CREATE TABLE IF NOT EXISTS 'lens' ("
+        "id INTEGER PRIMARY KEY AUTOINCREMENT, timestamp TEXT NOT NULL UNIQUE)"
+    )
+    cursor.execute("SELECT timestamp FROM lens ORDER BY timestamp")
+    cursor.fetchall()
+    connection.commit()
+    cursor.close()
+    connection.close()
+
+
+def bench_connections(path):
+    seconds = timeit.timeit(lambda: connect_per_call(path), number=CALLS)
+    report("connect per call", seconds)
+    report("pooled Lens.list", timeit.timeit(Lens.list, number=CALLS))
+
+
+def date_strings(rows):
+    """Returns rows consecutive time strings."""
+    start = date(1000, 1, 1)
+    return [(start + timedelta(days=i)).strftime("%Y-%m-%d") for i in range(rows)]
+
+
+def fill(rows):
+    """Fills the database with rows consecutive days."""
+    days = [(DEFAULT_USER_ID, to_ordinal(x)) for x in date_strings(rows)]
+
+    with DBConnection() as connection:
+        connection.cursor.execute("DELETE FROM schedule")
+        connection.cursor.execute("DELETE FROM lens")
+        connection.cursor.executemany(
+            "INSERT INTO lens (user_id, day) VALUES (?, ?)", days
+        )
+        connection.update_schedule()
+
+
+def materialised_get_last(connection):
+    """Previous behaviour: fetch, sort and index the whole table."""
+    connection.cursor.execute("SELECT day FROM lens ORDER BY day")
+    return from_ordinal(sorted([x[0] for x in connection.cursor.fetchall()])[-1])
+
+
+def bench_get_last():
+    for rows in (10**5, 10**6):
+        fill(rows)
+        with DBConnection() as connection:
+            calls = 3
+            seconds = timeit.timeit(
+                lambda: materialised_get_last(connection), number=calls
+            )
+            report("materialised get_last (%.0e)" % rows, seconds, calls)
+            seconds = timeit.timeit(connection.get_last, number=CALLS)
+            report("indexed get_last (%.0e)" % rows, seconds)
+
+        seconds = timeit.timeit(lambda: next(Lens.iter(reverse=True)), number=CALLS)
+        report("first row of Lens.iter (%.0e)" % rows, seconds)
+
+
+def bench_add_many(rows=10**4):
+    days = date_strings(rows)
+
+    fill(0)
+    report(
+        "Lens.add_custom",
+        timeit.timeit(lambda: [Lens.add_custom(x) for x in days], number=1),
+        rows,
+    )
+    fill(0)
+    report("Lens.add_many", timeit.timeit(lambda: Lens.add_many(days), number=1), rows)
+
+
+def bench_storage(folder, rows=10**5):
+    """Compares the old text timestamp layout with day ordinals."""
+    legacy = Path(folder) / "legacy.db"
+    connection = sqlite3.connect(legacy.as_posix())
+    connection.execute(
+        "CREATE TABLE lens (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+        "timestamp TEXT NOT NULL UNIQUE)"
+    )
+    seconds = timeit.timeit(
+        lambda: connection.executemany(
+            "INSERT INTO lens VALUES (NULL, ?)", [(x,) for x in date_strings(rows)]
+        ),
+        number=1,
+    )
+    connection.commit()
+    report("insert timestamps (%.0e)" % rows, seconds, rows)
+    print("%-30s %8d KiB" % ("timestamps file", legacy.stat().st_size // 1024))
+
+    seconds = timeit.timeit(lambda: migrate(connection), number=1)
+    report("migrate to ordinals (%.0e)" % rows, seconds, rows)
+    connection.close()
+    print("%-30s %8d KiB" % ("ordinals file", legacy.stat().st_size // 1024))
+
+    fill(0)
+    seconds = timeit.timeit(lambda: fill(rows), number=1)
+    report("insert ordinals (%.0e)" % rows, seconds, rows)
+
+
+def grouped_get_due(connection, today, margin):
+    """Previous behaviour: group the whole history by user."""
+    connection.cursor.execute(
+        """SELECT users.id, email, durability, enabled, MAX(lens.day) AS last_day
+        FROM users JOIN lens ON lens.user_id = users.id
+        WHERE enabled
+        GROUP BY users.id
+        HAVING ? - last_day >= durability - ?""",
+        [today.toordinal(), margin],
+    )
+    return connection.cursor.fetchall()
+
+
+def bench_get_due(users=10**4, entries=20):
+    """Scans every user, grouping the history or reading the schedule."""
+    fill(0)
+    today = date(2020, 1, 1)
+    with DBConnection() as connection:
+        connection.cursor.execute("DELETE FROM schedule")
+        connection.cursor.execute("DELETE FROM users")
+        connection.cursor.executemany(
+            "INSERT INTO users (id, email, durability) VALUES (?, ?, 15)",
+            [(x, "user%d@example.com" % x) for x in range(1, users + 1)],
+        )
+        connection.cursor.executemany(
+            "INSERT INTO lens (user_id, day) VALUES (?, ?)",
+            [
+                (x, today.toordinal() - 16 * y - x % 16)
+                for x in range(1, users + 1)
+                for y in range(entries)
+            ],
+        )
+        connection.cursor.execute(
+            "INSERT INTO schedule SELECT user_id, 1, MAX(day), MAX(day) + 16 "
+            "FROM lens GROUP BY user_id"
+        )
+
+        seconds = timeit.timeit(
+            lambda: grouped_get_due(connection, today, 1), number=10
+        )
+        report("grouped get_due (%d users)" % users, seconds, 10)
+
+    seconds = timeit.timeit(lambda: Lens.get_due(today, margin=1), number=10)
+    report("Lens.get_due (%d users)" % users, seconds, 10)
+
+
+def bench_simulate(users=10**3, years=3):
+    """Simulates the scans of every day of several years."""
+    fill(0)
+    start = date(2020, 1, 1)
+    with DBConnection() as connection:
+        connection.cursor.execute("DELETE FROM schedule")
+        connection.cursor.execute("DELETE FROM users")
+        connection.cursor.executemany(
+            "INSERT INTO users (id, email, durability) VALUES (?, ?, 15)",
+            [(x, "user%d@example.com" % x) for x in range(1, users + 1)],
+        )
+        connection.cursor.executemany(
+            "INSERT INTO lens (user_id, day) VALUES (?, ?)",
+            [
+                (x, start.toordinal() + x % 7 + 17 * y)
+                for x in range(1, users + 1)
+                for y in range(years * 365 // 17)
+            ],
+        )
+
+    end = start + timedelta(days=365 * years)
+    events = []
+    seconds = timeit.timeit(lambda: events.extend(simulate(start, end)), number=1)
+    report("simulate (%d users, %d years)" % (users, years), seconds, 1)
+    print("%-30s %8d" % ("simulated emails", len(events)))
+
+
+def main():
+    with tempfile.TemporaryDirectory() as folder:
+        path = Path(folder) / "lens.db"
+        set_settings(Settings(database_path=path))
+        bench_connections(path.as_posix())
+        bench_get_last()
+        bench_add_many()
+        bench_storage(folder)
+        bench_get_due()
+        bench_simulate()
+        pool.clear()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+"""Benchmarks of the delivery of emails.
+
+Run with ``python -m benchmarks.bench_email``. Emails are sent to a stand-in
+SMTP server listening on localhost, which accepts every message and drops it,
+and to the local transports. A temporary database is used for the scans.
+"""
+
+import socketserver
+import tempfile
+import threading
+import time
+import timeit
+from collections import namedtuple
+from datetime import date
+from pathlib import Path
+from unittest import mock
+
+from lens_db.core import DBConnection, pool
+from lens_db.email import SharedTokenBucket, TokenBucket, send_email
+from lens_db.scanner import scan_users
+from lens_db.settings import Settings, set_settings
+from lens_db.transports import TRANSPORTS, MemoryTransport, SMTPTransport
+from lens_db.worker import deliver
+
+EMAILS = 500
+
+Credentials = namedtuple("Credentials", ["username", "password"])
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    """Minimal SMTP dialogue: accepts any login and any message."""
+
+    def reply(self, line):
+        self.wfile.write(line.encode() + b"\r\n")
+
+    def handle(self):
+        # Stands for the network round trips of a remote server
+        time.sleep(self.server.latency)
+        self.reply("220 localhost ESMTP")
+
+        for line in self.rfile:
+            command = line[:4].upper()
+            if command in (b"EHLO", b"HELO"):
+                self.reply("250-localhost")
+                self.reply("250 AUTH PLAIN LOGIN")
+            elif command == b"AUTH":
+                time.sleep(self.server.latency)
+                self.reply("235 Authentication successful")
+            elif command == b"DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                for data in self.rfile:
+                    if data == b".\r\n":
+                        break
+                self.reply("250 OK")
+            elif command == b"QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("250 OK")
+
+
+class SMTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, latency=0.0):
+        super().__init__(("127.0.0.1", 0), SMTPHandler)
+        self.latency = latency
+
+
+def send_per_email(port, emails):
+    """Previous behaviour: connect and login for every email."""
+    for i in range(emails):
+        with SMTPTransport("127.0.0.1", port, security="none") as transport:
+            send_email(
+                "user%d@example.com" % i, "subject", "message", transport=transport
+            )
+
+
+def send_shared(port, emails):
+    """Send every email through the same transport."""
+    with SMTPTransport("127.0.0.1", port, security="none") as transport:
+        for i in range(emails):
+            send_email(
+                "user%d@example.com" % i, "subject", "message", transport=transport
+            )
+
+
+def report(name, seconds, emails):
+    print("%-35s %8.0f emails/s" % (name, emails / seconds))
+
+
+def bench_sessions(latency, emails=EMAILS):
+    server = SMTPServer(latency)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    port = server.server_address[1]
+
+    try:
+        for name, func in (("per email", send_per_email), ("shared", send_shared)):
+            seconds = timeit.timeit(lambda: func(port, emails), number=1)
+            report("%s (%d ms latency)" % (name, latency * 1000), seconds, emails)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def bench_transports(folder, emails=EMAILS * 4):
+    """Sends emails through each local transport."""
+    for name in ("memory", "jsonl", "maildir"):
+        path = Path(folder) / name
+        with TRANSPORTS[name](path) if name != "memory" else MemoryTransport() as t:
+            seconds = timeit.timeit(
+                lambda: [
+                    send_email("user@example.com", "subject", "message", transport=t)
+                    for _ in range(emails)
+                ],
+                number=1,
+            )
+        report("%s transport" % name, seconds, emails)
+    MemoryTransport.clear()
+
+
+def bench_scan_deliver(users=10**4):
+    """Scans users that are all due today, then delivers their emails."""
+    today = date(2020, 1, 1)
+    with DBConnection() as connection:
+        connection.cursor.executemany(
+            "INSERT INTO users (id, email, durability) VALUES (?, ?, 15)",
+            [(x, "user%d@example.com" % x) for x in range(2, users + 2)],
+        )
+        connection.cursor.executemany(
+            "INSERT INTO lens (user_id, day) VALUES (?, ?)",
+            [(x, today.toordinal() - 16) for x in range(2, users + 2)],
+        )
+        connection.cursor.execute(
+            "INSERT INTO schedule SELECT user_id, 1, day, day + 16 FROM lens"
+        )
+
+    seconds = timeit.timeit(lambda: scan_users(today), number=1)
+    report("scan (queue)", seconds, users)
+
+    with mock.patch("lens_db.worker.open_transport", MemoryTransport):
+        seconds = timeit.timeit(lambda: deliver(limit=users), number=1)
+    report("deliver (memory transport)", seconds, len(MemoryTransport.sent))
+    MemoryTransport.clear()
+
+
+def bench_rate_limit(bucket, name, threads=4, seconds=2):
+    """Takes tokens from several threads, reporting the rate achieved."""
+    sent = []
+    end = time.monotonic() + seconds
+
+    def send():
+        while time.monotonic() < end:
+            bucket.acquire()
+            sent.append(1)
+
+    workers = [threading.Thread(target=send) for _ in range(threads)]
+    start = time.monotonic()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    # The burst of the full bucket is not part of the sustained rate
+    rate = (len(sent) - bucket.capacity) / (time.monotonic() - start)
+    print("%-35s %8.0f emails/s (limit %d)" % (name, rate, bucket.rate))
+
+
+def main():
+    credentials = Credentials("lens-db@example.com", "password")
+    unlimited = TokenBucket(rate=None)
+    with mock.patch("lens_db.transports.get_credentials", return_value=credentials):
+        with mock.patch("lens_db.email.limiter", unlimited):
+            bench_sessions(0)
+            bench_sessions(0.005, emails=100)
+
+    with tempfile.TemporaryDirectory() as folder:
+        with mock.patch("lens_db.email.limiter", unlimited), mock.patch(
+            "lens_db.worker.limiter", unlimited
+        ):
+            bench_transports(folder)
+            set_settings(Settings(database_path=Path(folder) / "lens.db"))
+            bench_scan_deliver()
+
+        bench_rate_limit(TokenBucket(rate=200, capacity=10), "rate limit (4 threads)")
+        bench_rate_limit(
+            SharedTokenBucket(rate=200, capacity=10), "shared rate limit (4 threads)"
+        )
+        pool.clear()
+
+
+if __name__ == "__main__":
+    main()
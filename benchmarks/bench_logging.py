@@ -0,0 +1,91 @@
+"""Benchmarks of logging.
+
+Run with ``python -m benchmarks.bench_logging``. Records are logged to a
+temporary file, directly through a file handler (as before) and through the
+queue of lens_db.logs. The time reported is the one the callers spend, which
+is what delays a scan or the delivery of emails. On a fast local disk writing
+directly is cheaper; the queue pays off when writes are slow (a busy or
+network disk), which is emulated with a delay on every write.
+"""
+
+import logging
+import tempfile
+import time
+import timeit
+from pathlib import Path
+from unittest import mock
+
+from lens_db.logs import TEXT_FORMAT, setup_logging, stop_logging
+from lens_db.settings import Settings
+
+RECORDS = 50000
+SLOW_RECORDS = 2000
+
+logger = logging.getLogger("lens_db.bench")
+
+
+class SlowFileHandler(logging.FileHandler):
+    """File handler that waits latency seconds before each write."""
+
+    def __init__(self, path, latency):
+        super().__init__(path, encoding="utf-8")
+        self.latency = latency
+
+    def emit(self, record):
+        if self.latency:
+            time.sleep(self.latency)
+        super().emit(record)
+
+
+def log(records):
+    for i in range(records):
+        logger.info("Email %d queued for %r", i, "user@example.com")
+
+
+def report(name, seconds, records):
+    print("%-35s %8.0f records/s" % (name, records / seconds))
+
+
+def bench_direct(path, records=RECORDS, latency=0.0):
+    """Previous behaviour: each call formats the record and writes it."""
+    handler = SlowFileHandler(path, latency)
+    handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+    root = logging.getLogger("lens_db")
+    root.setLevel(logging.INFO)
+    root.addHandler(handler)
+    try:
+        seconds = timeit.timeit(lambda: log(records), number=1)
+        report("file handler%s" % describe(latency), seconds, records)
+    finally:
+        root.removeHandler(handler)
+        handler.close()
+
+
+def describe(latency):
+    return " (%.1f ms per write)" % (latency * 1000) if latency else ""
+
+
+def bench_queue(path, records=RECORDS, logging_format="text", latency=0.0):
+    """Each call only puts the record in the queue."""
+    with mock.patch(
+        "lens_db.logs.file_handler", lambda path: SlowFileHandler(path, latency)
+    ):
+        setup_logging(Settings(logging_path=path, logging_format=logging_format))
+    seconds = timeit.timeit(lambda: log(records), number=1)
+    report("queue (%s)%s" % (logging_format, describe(latency)), seconds, records)
+
+    seconds = timeit.timeit(stop_logging, number=1)
+    print("%-35s %8.3f s" % ("  flush of the queue", seconds))
+
+
+def main():
+    with tempfile.TemporaryDirectory() as folder:
+        bench_direct(Path(folder) / "direct.log")
+        bench_queue(Path(folder) / "queue.log")
+        bench_queue(Path(folder) / "queue.jsonl", logging_format="json")
+        bench_direct(Path(folder) / "slow.log", SLOW_RECORDS, latency=0.0005)
+        bench_queue(Path(folder) / "slow-queue.log", SLOW_RECORDS, latency=0.0005)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""Benchmarks of the startup of the command line.
+
+Run with ``python -m benchmarks.bench_startup``. Each command runs in a new
+interpreter, against a temporary database, and the best time of several runs
+is reported. The time of the bare interpreter is the floor of every command.
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+RUNS = 10
+
+
+def run(args, env) -> float:
+    """Returns the best wall time, in seconds, of running python with args."""
+    best = float("inf")
+    for _ in range(RUNS):
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable] + args,
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def import_times(module: str) -> list:
+    """Returns the modules imported by module, with their cumulative import
+    time in microseconds, as reported by ``python -X importtime``."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import %s" % module],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    )
+
+    times = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        times.append((int(cumulative), name.strip()))
+    return times
+
+
+def main():
+    times = import_times("lens_db.main")
+    print("%-35s %8.1f ms" % ("import lens_db.main", times[-1][0] / 1000))
+    for cumulative, name in sorted(times, reverse=True)[1:11]:
+        print("  %-33s %8.1f ms" % (name, cumulative / 1000))
+
+    with tempfile.TemporaryDirectory() as folder:
+        env = dict(
+            os.environ,
+            LENS_DB_DATABASE_PATH=str(Path(folder) / "lens.db"),
+            LENS_DB_DISABLED_PATH=str(Path(folder) / ".disabled"),
+        )
+        print("%-35s %8.1f ms" % ("python -c pass", run(["-c", "pass"], env) * 1000))
+        for command in ("--version", "status", "now", "last", "list"):
+            seconds = run(["-m", "lens_db", command], env)
+            print("%-35s %8.1f ms" % ("lens-db " + command, seconds * 1000))
+
+
+if __name__ == "__main__":
+    main()
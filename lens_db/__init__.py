@@ -1,15 +1,11 @@
-from logging import DEBUG, basicConfig
-
-from ._version import get_versions
-from .config import LOGGING_PATH
+__all__ = []
 
-__version__ = get_versions()["version"]
-del get_versions
 
-__all__ = []
+def __getattr__(name):
+    # In a source checkout versioneer runs git, so the version is only
+    # resolved when it is asked for (Python 3.7+, see PEP 562)
+    if name == "__version__":
+        from ._version import get_versions
 
-basicConfig(
-    filename=LOGGING_PATH,
-    level=DEBUG,
-    format="[%(asctime)s] %(levelname)s - %(module)s:%(lineno)s - %(message)s",
-)
+        return get_versions()["version"]
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
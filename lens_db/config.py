@@ -6,8 +6,41 @@ __all__ = [
     "LENS_DURABILITY_DELTA",
     "ADMIN_EMAIL",
     "LOGGING_PATH",
+    "LOGGING_LEVEL",
+    "LOGGING_FORMAT",
+    "LOGGING_MAX_BYTES",
+    "LOGGING_ROTATE_WHEN",
+    "LOGGING_BACKUP_COUNT",
     "DATABASE_PATH",
-    "DISABLED",
+    "DATABASE_JOURNAL_MODE",
+    "DATABASE_SYNCHRONOUS",
+    "DATABASE_TIMEOUT",
+    "DISABLED_CHECK_INTERVAL",
+    "DAEMON_POLL_INTERVAL",
+    "OUTBOX_POLL_INTERVAL",
+    "OUTBOX_RETRY_DELAY",
+    "OUTBOX_BATCH_SIZE",
+    "OUTBOX_RETRY_MAX_DELAY",
+    "DIGEST_WINDOW",
+    "EMAIL_TRANSPORT",
+    "EMAIL_SINK_PATH",
+    "SMTP_HOST",
+    "SMTP_PORT",
+    "SMTP_SECURITY",
+    "SMTP_CONNECT_TIMEOUT",
+    "SMTP_READ_TIMEOUT",
+    "SMTP_BACKOFF_BASE",
+    "SMTP_BACKOFF_MAX",
+    "SMTP_BREAKER_THRESHOLD",
+    "SMTP_BREAKER_COOLDOWN",
+    "EMAIL_RATE",
+    "EMAIL_BURST",
+    "EMAIL_RATE_SHARED",
+    "CREDENTIALS_SOURCES",
+    "CREDENTIALS_ENV",
+    "CREDENTIALS_FD_ENV",
+    "CONFIG_PATH",
+    "CONFIG_ENV",
 ]
 
 LENS_DURABILITY = 15  # In days
@@ -15,7 +48,48 @@ LENS_DURABILITY_DELTA = timedelta(days=LENS_DURABILITY)
 ADMIN_EMAIL = "sralloza@gmail.com"
 
 LOGGING_PATH = Path(__file__).parent.parent.parent / "lens-db.log"
+LOGGING_LEVEL = "INFO"  # DEBUG, INFO, WARNING, ERROR or CRITICAL
+LOGGING_FORMAT = "text"  # text or json (one object per line)
+LOGGING_MAX_BYTES = 10 * 2**20  # The log is rotated when it reaches this size
+# Rotate the log by time instead, e.g. "midnight" (see TimedRotatingFileHandler)
+LOGGING_ROTATE_WHEN = None
+LOGGING_BACKUP_COUNT = 5  # Rotated logs kept, older ones are removed
 DATABASE_PATH = Path(__file__).parent.parent.parent / "lens.db"
+DATABASE_JOURNAL_MODE = "WAL"  # Readers don't block writers
+DATABASE_SYNCHRONOUS = "NORMAL"
+DATABASE_TIMEOUT = 10  # In seconds, waiting for locks held by other processes
 DISABLED_PATH = Path(__file__).parent.parent.parent.joinpath(".disabled")
-DISABLED = DISABLED_PATH.exists()
+DISABLED_CHECK_INTERVAL = 1  # In seconds, the disabled flag is cached for this long
+DAEMON_POLL_INTERVAL = 5  # In seconds, between checks of the database and DISABLED_PATH
+OUTBOX_POLL_INTERVAL = 10  # In seconds, between checks of the outbox
+OUTBOX_RETRY_DELAY = 300  # In seconds, before trying again a failed email
+OUTBOX_BATCH_SIZE = 100  # Emails read from the outbox at once
+OUTBOX_RETRY_MAX_DELAY = 6 * 3600  # In seconds, the delay doubles on each failure
+# In seconds, emails queued for a recipient wait for others to send them together
+DIGEST_WINDOW = 0
+EMAIL_TRANSPORT = "smtp"  # smtp, maildir, jsonl or memory
+# Maildir directory or JSONL file of the local transports
+EMAIL_SINK_PATH = Path(__file__).parent.parent.parent / "lens-mail"
+SMTP_HOST = "smtp.gmail.com"
+SMTP_PORT = 587
+SMTP_SECURITY = "starttls"  # starttls, ssl or none
+SMTP_CONNECT_TIMEOUT = 10  # In seconds
+SMTP_READ_TIMEOUT = 30  # In seconds, waiting for each reply of the server
+SMTP_BACKOFF_BASE = 1  # In seconds, before the first retry of an email
+SMTP_BACKOFF_MAX = 30  # In seconds, the delay doubles on each retry
+SMTP_BREAKER_THRESHOLD = 5  # Consecutive failures that stop sending emails
+SMTP_BREAKER_COOLDOWN = 300  # In seconds, before trying to send again
+EMAIL_RATE = 1.0  # Emails per second sent on average (None: no limit)
+EMAIL_BURST = 10  # Emails that can be sent at once, after some time without any
+EMAIL_RATE_SHARED = False  # Share the limit between processes, through the database
 CREDENTIALS_PATH = Path(__file__).parent.with_name("data") / "credentials.json"
+# Sources of the credentials, the first one that has them is used
+CREDENTIALS_SOURCES = ("env", "fd", "file")
+# Environment variables with the username and the password, unencrypted
+CREDENTIALS_ENV = ("LENS_DB_USERNAME", "LENS_DB_PASSWORD")
+# Environment variable with a file descriptor to read the credentials from, as
+# a JSON object with the keys 'username' and 'password'
+CREDENTIALS_FD_ENV = "LENS_DB_CREDENTIALS_FD"
+# Optional JSON file that overrides these defaults (see lens_db.settings)
+CONFIG_PATH = Path(__file__).parent.parent.parent / "lens-db.json"
+CONFIG_ENV = "LENS_DB_CONFIG"  # Environment variable with another CONFIG_PATH
@@ -1,28 +1,139 @@
 import logging
 import sqlite3
+import threading
+import time
+from collections import namedtuple
 from datetime import datetime, timedelta, date
-from typing import Union, Optional, List
+from itertools import islice
+from typing import Iterable, Iterator, Union, Optional, List
 
-from .config import DATABASE_PATH
-from .exceptions import AlreadyAddedError, InvalidDateError
-from .utils import today_date
+from urllib.parse import quote
+
+from .config import (
+    LENS_DURABILITY,
+    DATABASE_JOURNAL_MODE,
+    DATABASE_SYNCHRONOUS,
+    DATABASE_TIMEOUT,
+    DIGEST_WINDOW,
+    OUTBOX_BATCH_SIZE,
+    OUTBOX_RETRY_DELAY,
+)
+from .exceptions import (
+    AlreadyAddedError,
+    InvalidDateError,
+    LensTypeAlreadyExistsError,
+    LensTypeNotFoundError,
+    UserAlreadyExistsError,
+    UserNotFoundError,
+)
+from .migrations import DEFAULT_TYPE_ID, DEFAULT_USER_ID, migrate
+from .rules import DEFAULT_RULE_SET, get_rules
+from .settings import get_settings
+from .utils import from_ordinal, to_ordinal, today_date
 
 logger = logging.getLogger(__name__)
 
 date_or_none = Union[date, None]
+date_or_str = Union[date, str]
+list_of_dates = List[date]
 list_of_str = List[str]
 
-__all__ = ["Lens", "DBConnection"]
+__all__ = [
+    "Lens",
+    "Users",
+    "LensTypes",
+    "Notifications",
+    "Outbox",
+    "DBConnection",
+    "ConnectionPool",
+]
+
+BATCH_SIZE = 256
+
+AddManyResult = namedtuple("AddManyResult", ["added", "duplicates"])
+User = namedtuple("User", ["id", "email", "durability", "enabled", "rules"])
+User.__new__.__defaults__ = (DEFAULT_RULE_SET,)
+LensType = namedtuple("LensType", ["id", "name", "durability", "rules"])
+DEFAULT_LENS_TYPE = LensType(DEFAULT_TYPE_ID, "default", None, None)
+Due = namedtuple("Due", ["user", "last", "due", "lens_type"])
+Due.__new__.__defaults__ = (DEFAULT_LENS_TYPE,)
+Notification = namedtuple(
+    "Notification", ["user_id", "last", "kind", "sent_at", "type_id"]
+)
+OutboxEmail = namedtuple(
+    "OutboxEmail",
+    [
+        "id",
+        "user_id",
+        "type_id",
+        "last",
+        "kind",
+        "destination",
+        "subject",
+        "message",
+        "attempts",
+        "last_error",
+    ],
+)
+
+
+def as_date_string(day: date_or_str) -> str:
+    """Returns day as a string in format YYYY-MM-DD.
+
+    Args:
+        day (date | str): date or string in format YYYY-MM-DD.
+
+    Raises:
+        InvalidDateError: if day is a string with an incorrect format.
+
+    """
+    if isinstance(day, date):
+        return day.strftime("%Y-%m-%d")
+
+    try:
+        datetime.strptime(day, "%Y-%m-%d")
+    except (TypeError, ValueError):
+        raise InvalidDateError("%r is not a valid date format (use 2019-12-31)" % day)
+    return day
+
+
+def lens_settings(user: User, lens_type: LensType) -> tuple:
+    """Returns the durability and the rules of the lens of a type worn by user.
+
+    The settings of the type, if any, override those of the user.
+    """
+    durability = (
+        user.durability if lens_type.durability is None else lens_type.durability
+    )
+    rules = user.rules if lens_type.rules is None else lens_type.rules
+    return durability, rules
+
+
+def as_date(time_str: Optional[str]) -> date_or_none:
+    """Returns the date of a time string read from the database, or None."""
+    if time_str is None:
+        return None
+    return date.fromordinal(to_ordinal(time_str))
 
 
 class Lens:
-    """Class to manage when are lens packages opened."""
+    """Class to manage when are lens packages opened.
+
+    Every method works on the history of a single user, given by user_id.
+    If it is omitted, the default user (created from ADMIN_EMAIL) is used.
+    Dates are added to the default lens type unless type_id is given, and
+    read from every type unless it is given. The database is the one of
+    settings, if given, or the one of the process (see lens_db.settings).
+    The other classes of this module take settings in the same way.
+    """
 
     def __new__(cls, *args, **kwargs):
         raise NotImplementedError("Lens shouldn't be instanciated.")
 
     @staticmethod
-    def add(delta_days=0):
+    def add(
+        delta_days=0, user_id=DEFAULT_USER_ID, type_id=DEFAULT_TYPE_ID, settings=None
+    ):
         """Adds a timestamp of delta_days days ago.
 
         Args:
@@ -36,10 +147,15 @@ class Lens:
         dt_string = dt.strftime("%Y-%m-%d")
 
         logger.debug("Adding to lens-database: %r", dt_string)
-        Lens.add_custom(dt_string)
+        Lens.add_custom(dt_string, user_id=user_id, type_id=type_id, settings=settings)
 
     @staticmethod
-    def add_custom(date_string: str):
+    def add_custom(
+        date_string: str,
+        user_id=DEFAULT_USER_ID,
+        type_id=DEFAULT_TYPE_ID,
+        settings=None,
+    ):
         """Adds a timestamp to the database from a string.
 
         Args:
@@ -48,29 +164,109 @@ class Lens:
         Raises:
             InvalidDateError: if the format of date_string is incorrect.
             AlreadyAddedError: if the timestamp is already in the database.
+            UserNotFoundError: if the user or the lens type do not exist.
 
         """
-        try:
-            datetime.strptime(date_string, "%Y-%m-%d")
-        except ValueError:
-            raise InvalidDateError(
-                "%r is not a valid date format (use 2019-12-31)" % date_string
-            )
+        as_date_string(date_string)
 
-        with DBConnection() as connection:
+        with DBConnection(settings=settings) as connection:
             try:
-                connection.add(date_string)
-            except sqlite3.IntegrityError:
+                connection.add(date_string, user_id=user_id, type_id=type_id)
+            except sqlite3.IntegrityError as exc:
+                if "FOREIGN KEY" in str(exc):
+                    raise UserNotFoundError(
+                        "User %r or lens type %r do not exist" % (user_id, type_id)
+                    )
                 raise AlreadyAddedError(
                     "Lens %r are already in the database" % date_string
                 )
 
     @staticmethod
-    def get_last() -> date_or_none:
+    def add_many(
+        dates: Iterable[date_or_str],
+        batch_size=BATCH_SIZE,
+        user_id=DEFAULT_USER_ID,
+        type_id=DEFAULT_TYPE_ID,
+        settings=None,
+    ) -> AddManyResult:
+        """Adds several timestamps to the database in a single transaction.
+
+        Dates are validated and inserted in batches. If any of them is invalid,
+        nothing is inserted. Dates already in the database (or repeated) are
+        skipped and reported instead of raising AlreadyAddedError.
+
+        Args:
+            dates (iterable): dates or strings in format YYYY-MM-DD.
+            batch_size (int): number of dates validated and inserted at once.
+
+        Raises:
+            InvalidDateError: if the format of any date is incorrect.
+            UserNotFoundError: if the user or the lens type do not exist.
+
+        Returns:
+            AddManyResult: number of timestamps added and list of duplicates.
+
+        """
+        added = 0
+        duplicates = []
+        invalid = []
+        dates = iter(dates)
+
+        with DBConnection(settings=settings) as connection:
+            while True:
+                batch = list(islice(dates, batch_size))
+                if not batch:
+                    break
+
+                date_strings = []
+                for day in batch:
+                    try:
+                        date_strings.append(as_date_string(day))
+                    except InvalidDateError:
+                        invalid.append(day)
+
+                if invalid:
+                    continue
+
+                try:
+                    batch_duplicates = connection.add_many(
+                        date_strings, user_id, type_id
+                    )
+                except sqlite3.IntegrityError:
+                    raise UserNotFoundError(
+                        "User %r or lens type %r do not exist" % (user_id, type_id)
+                    )
+                added += len(date_strings) - len(batch_duplicates)
+                duplicates += batch_duplicates
+
+            if invalid:
+                raise InvalidDateError(
+                    "%s are not valid date formats (use 2019-12-31)"
+                    % ", ".join(repr(x) for x in invalid)
+                )
+
+        logger.debug("Added %d timestamps, %d duplicates", added, len(duplicates))
+        return AddManyResult(added, duplicates)
+
+    @staticmethod
+    def get_first(user_id=DEFAULT_USER_ID, type_id=None, settings=None) -> date_or_none:
+        """Returns the first date of the database or None, if the database is empty."""
+
+        with DBConnection(readonly=True, settings=settings) as connection:
+            first = connection.get_first(user_id=user_id, type_id=type_id)
+
+            logger.debug("First from database: %r", first)
+
+            if not first:
+                return None
+            return datetime.strptime(first, "%Y-%m-%d").date()
+
+    @staticmethod
+    def get_last(user_id=DEFAULT_USER_ID, type_id=None, settings=None) -> date_or_none:
         """Returns the last date inserted in the database or None, if the database is empty."""
 
-        with DBConnection() as connection:
-            last = connection.get_last()
+        with DBConnection(readonly=True, settings=settings) as connection:
+            last = connection.get_last(user_id=user_id, type_id=type_id)
 
             logger.debug("Last from database: %r", last)
 
@@ -79,26 +275,621 @@ class Lens:
             return datetime.strptime(last, "%Y-%m-%d").date()
 
     @staticmethod
-    def list() -> list_of_str:
+    def list(user_id=DEFAULT_USER_ID, type_id=None, settings=None) -> list_of_str:
         """Returns a list of every timestamp registered in the database."""
-        with DBConnection() as connection:
-            return connection.list()
+        with DBConnection(readonly=True, settings=settings) as connection:
+            return connection.list(user_id=user_id, type_id=type_id)
+
+    @staticmethod
+    def iter(
+        since: date_or_str = None,
+        until: date_or_str = None,
+        reverse=False,
+        batch_size=BATCH_SIZE,
+        limit: int = None,
+        offset=0,
+        user_id=DEFAULT_USER_ID,
+        type_id=None,
+        settings=None,
+    ) -> Iterator[str]:
+        """Iterates over the timestamps of the database without loading them all.
+
+        Args:
+            since (date | str): first date to include (optional).
+            until (date | str): last date to include (optional).
+            reverse (bool): if True, newest timestamps are yielded first.
+            batch_size (int): number of rows fetched from the database at once.
+            limit (int): maximum number of timestamps to yield (optional).
+            offset (int): number of timestamps to skip.
+
+        Raises:
+            InvalidDateError: if since or until have an incorrect format.
+
+        """
+        if since is not None:
+            since = as_date_string(since)
+        if until is not None:
+            until = as_date_string(until)
+
+        with DBConnection(readonly=True, settings=settings) as connection:
+            yield from connection.iter(
+                since=since,
+                until=until,
+                reverse=reverse,
+                batch_size=batch_size,
+                limit=limit,
+                offset=offset,
+                user_id=user_id,
+                type_id=type_id,
+            )
+
+    @staticmethod
+    def between(
+        start: date_or_str,
+        end: date_or_str,
+        user_id=DEFAULT_USER_ID,
+        type_id=None,
+        settings=None,
+    ) -> list_of_dates:
+        """Returns the dates of the database between start and end, both included.
+
+        Raises:
+            InvalidDateError: if start or end have an incorrect format.
+
+        """
+        with DBConnection(readonly=True, settings=settings) as connection:
+            entries = connection.iter(
+                since=as_date_string(start),
+                until=as_date_string(end),
+                user_id=user_id,
+                type_id=type_id,
+            )
+            return [as_date(x) for x in entries]
+
+    @staticmethod
+    def contains(
+        day: date_or_str, user_id=DEFAULT_USER_ID, type_id=None, settings=None
+    ) -> bool:
+        """Returns True if day is in the database.
+
+        Raises:
+            InvalidDateError: if day has an incorrect format.
+
+        """
+        with DBConnection(readonly=True, settings=settings) as connection:
+            return connection.contains(
+                as_date_string(day), user_id=user_id, type_id=type_id
+            )
+
+    @staticmethod
+    def count(
+        since: date_or_str = None,
+        until: date_or_str = None,
+        user_id=DEFAULT_USER_ID,
+        type_id=None,
+        settings=None,
+    ) -> int:
+        """Returns the number of dates of the database, optionally in a range.
+
+        Args:
+            since (date | str): first date to count (optional).
+            until (date | str): last date to count (optional).
+
+        Raises:
+            InvalidDateError: if since or until have an incorrect format.
+
+        """
+        if since is not None:
+            since = as_date_string(since)
+        if until is not None:
+            until = as_date_string(until)
+
+        with DBConnection(readonly=True, settings=settings) as connection:
+            return connection.count(
+                since=since, until=until, user_id=user_id, type_id=type_id
+            )
+
+    @staticmethod
+    def before(
+        day: date_or_str, user_id=DEFAULT_USER_ID, type_id=None, settings=None
+    ) -> date_or_none:
+        """Returns the last date of the database before day, or None if there is none.
+
+        Raises:
+            InvalidDateError: if day has an incorrect format.
+
+        """
+        with DBConnection(readonly=True, settings=settings) as connection:
+            return as_date(
+                connection.before(as_date_string(day), user_id=user_id, type_id=type_id)
+            )
+
+    @staticmethod
+    def after(
+        day: date_or_str, user_id=DEFAULT_USER_ID, type_id=None, settings=None
+    ) -> date_or_none:
+        """Returns the first date of the database after day, or None if there is none.
+
+        Raises:
+            InvalidDateError: if day has an incorrect format.
+
+        """
+        with DBConnection(readonly=True, settings=settings) as connection:
+            return as_date(
+                connection.after(as_date_string(day), user_id=user_id, type_id=type_id)
+            )
+
+    @staticmethod
+    def get_due(today: date, margin=0, settings=None) -> List[Due]:
+        """Returns the lens of enabled users whose last change is close to expire.
+
+        The due dates are kept up to date when the history or the durability
+        of a user change, so only the pairs (user, lens type) due are read.
+
+        Args:
+            today (date): today's date.
+            margin (int): lens are due if their last change is at least
+                (durability - margin) days old.
+
+        Returns:
+            list: Due entries, with the user, the date of the last change, the
+                date when the lens must be changed and the lens type.
+
+        """
+        with DBConnection(readonly=True, settings=settings) as connection:
+            rows = connection.get_due(as_date_string(today), margin)
+
+        return [
+            Due(User(*x[:5]), as_date(x[5]), as_date(x[6]), LensType(*x[7:]))
+            for x in rows
+        ]
+
+    @staticmethod
+    def get_schedule(settings=None) -> List[tuple]:
+        """Returns the tuples (user id, type id, due date) of the enabled users."""
+        with DBConnection(readonly=True, settings=settings) as connection:
+            return [x[:2] + (as_date(x[2]),) for x in connection.get_schedule()]
+
+    @staticmethod
+    def get_due_date(
+        user_id=DEFAULT_USER_ID, type_id=DEFAULT_TYPE_ID, settings=None
+    ) -> date_or_none:
+        """Returns the date when the lens of the user must be changed, or None
+        if the user has no history."""
+        with DBConnection(readonly=True, settings=settings) as connection:
+            return as_date(connection.get_due_day(user_id, type_id))
+
+
+class Users:
+    """Class to manage the users whose lens are tracked."""
+
+    def __new__(cls, *args, **kwargs):
+        raise NotImplementedError("Users shouldn't be instanciated.")
+
+    @staticmethod
+    def add(
+        email: str,
+        durability=LENS_DURABILITY,
+        enabled=True,
+        rules=DEFAULT_RULE_SET,
+        settings=None,
+    ) -> User:
+        """Adds a user.
+
+        Args:
+            email (str): email of the user, where notifications are sent.
+            durability (int): days that the lens of the user last.
+            enabled (bool): if False, the user is not notified.
+            rules (str): name of the rules that decide which emails are sent.
+
+        Raises:
+            UserAlreadyExistsError: if there is already a user with that email.
+            UnknownRulesError: if there are no rules with that name.
+
+        """
+        get_rules(rules)
+        with DBConnection(settings=settings) as connection:
+            try:
+                user_id = connection.add_user(email, durability, enabled, rules)
+            except sqlite3.IntegrityError:
+                raise UserAlreadyExistsError("User %r already exists" % email)
+
+        return User(user_id, email, durability, enabled, rules)
+
+    @staticmethod
+    def get(email: str, settings=None) -> User:
+        """Returns the user with the given email.
+
+        Raises:
+            UserNotFoundError: if the user does not exist.
+
+        """
+        with DBConnection(readonly=True, settings=settings) as connection:
+            row = connection.get_user(email)
+
+        if row is None:
+            raise UserNotFoundError("User %r does not exist" % email)
+        return User(*row)
+
+    @staticmethod
+    def list(settings=None) -> List[User]:
+        """Returns every user."""
+        with DBConnection(readonly=True, settings=settings) as connection:
+            return [User(*x) for x in connection.list_users()]
+
+    @staticmethod
+    def update(
+        email: str,
+        durability: int = None,
+        enabled: bool = None,
+        rules: str = None,
+        settings=None,
+    ):
+        """Updates the durability, the enabled flag and/or the rules of a user.
+
+        Raises:
+            UserNotFoundError: if the user does not exist.
+            UnknownRulesError: if there are no rules with that name.
+
+        """
+        values = {}
+        if durability is not None:
+            values["durability"] = durability
+        if enabled is not None:
+            values["enabled"] = enabled
+        if rules is not None:
+            get_rules(rules)
+            values["rules"] = rules
+        if not values:
+            return
+
+        with DBConnection(settings=settings) as connection:
+            if not connection.update_user(email, **values):
+                raise UserNotFoundError("User %r does not exist" % email)
+
+
+class LensTypes:
+    """Class to manage the types of lens, each one with its own history."""
+
+    def __new__(cls, *args, **kwargs):
+        raise NotImplementedError("LensTypes shouldn't be instanciated.")
+
+    @staticmethod
+    def add(
+        name: str, durability: int = None, rules: str = None, settings=None
+    ) -> LensType:
+        """Adds a lens type.
+
+        Args:
+            name (str): name of the type (e.g. "monthly-left").
+            durability (int): days that the lens last. If None, the
+                durability of each user is used.
+            rules (str): name of the rules that decide which emails are sent.
+                If None, the rules of each user are used.
+
+        Raises:
+            LensTypeAlreadyExistsError: if there is already a type with that name.
+            UnknownRulesError: if there are no rules with that name.
+
+        """
+        if rules is not None:
+            get_rules(rules)
+
+        with DBConnection(settings=settings) as connection:
+            try:
+                type_id = connection.add_lens_type(name, durability, rules)
+            except sqlite3.IntegrityError:
+                raise LensTypeAlreadyExistsError("Lens type %r already exists" % name)
+
+        return LensType(type_id, name, durability, rules)
+
+    @staticmethod
+    def get(name: str, settings=None) -> LensType:
+        """Returns the lens type with the given name.
+
+        Raises:
+            LensTypeNotFoundError: if the lens type does not exist.
+
+        """
+        with DBConnection(readonly=True, settings=settings) as connection:
+            row = connection.get_lens_type(name)
+
+        if row is None:
+            raise LensTypeNotFoundError("Lens type %r does not exist" % name)
+        return LensType(*row)
+
+    @staticmethod
+    def list(settings=None) -> List[LensType]:
+        """Returns every lens type."""
+        with DBConnection(readonly=True, settings=settings) as connection:
+            return [LensType(*x) for x in connection.list_lens_types()]
+
+
+class Notifications:
+    """Ledger of the emails sent to the users.
+
+    Each kind of notification is sent at most once per change of lens, so
+    scans can be repeated as often as needed.
+    """
+
+    def __new__(cls, *args, **kwargs):
+        raise NotImplementedError("Notifications shouldn't be instanciated.")
+
+    @staticmethod
+    def claim(
+        user_id: int, last: date, kind: str, type_id=DEFAULT_TYPE_ID, settings=None
+    ) -> bool:
+        """Records a notification before sending it.
+
+        Args:
+            user_id (int): id of the user notified.
+            last (date): date of the last change of lens of the user.
+            kind (str): kind of notification.
+            type_id (int): id of the type of the lens.
+
+        Returns:
+            bool: False if the notification was already recorded, so it
+                must not be sent again.
+
+        """
+        sent_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        with DBConnection(settings=settings) as connection:
+            return connection.add_notification(
+                user_id, type_id, as_date_string(last), kind, sent_at
+            )
+
+    @staticmethod
+    def release(
+        user_id: int, last: date, kind: str, type_id=DEFAULT_TYPE_ID, settings=None
+    ):
+        """Forgets a claimed notification that could not be sent."""
+        with DBConnection(settings=settings) as connection:
+            connection.remove_notification(user_id, type_id, as_date_string(last), kind)
+
+    @staticmethod
+    def list(user_id=DEFAULT_USER_ID, settings=None) -> List[Notification]:
+        """Returns the notifications sent to a user, oldest first."""
+        with DBConnection(readonly=True, settings=settings) as connection:
+            return [
+                Notification(x[0], as_date(x[2]), x[3], x[4], x[1])
+                for x in connection.list_notifications(user_id)
+            ]
+
+
+class Outbox:
+    """Persistent queue of the emails waiting to be delivered.
+
+    Scans only add emails to the outbox, so they never wait for the mail
+    server. A worker delivers them later, trying again those that fail, and
+    removes each one once it has been sent: an email may be sent twice if the
+    worker stops right after sending it, but it is never lost.
+    """
+
+    def __new__(cls, *args, **kwargs):
+        raise NotImplementedError("Outbox shouldn't be instanciated.")
+
+    @staticmethod
+    def enqueue(
+        user_id: int,
+        last: date,
+        kind: str,
+        destination: str,
+        subject: str,
+        message: str,
+        type_id=DEFAULT_TYPE_ID,
+        settings=None,
+    ) -> bool:
+        """Records a notification and adds its email to the outbox, at once.
+
+        Args:
+            user_id (int): id of the user notified.
+            last (date): date of the last change of lens of the user.
+            kind (str): kind of notification.
+            destination (str): email address of the user.
+            subject (str): subject of the email.
+            message (str): message of the email.
+            type_id (int): id of the type of the lens.
+
+        Returns:
+            bool: False if the notification was already recorded, so the
+                email was not added again.
+
+        """
+        sent_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        now = time.time()
+        with DBConnection(settings=settings) as connection:
+            if not connection.add_notification(
+                user_id, type_id, as_date_string(last), kind, sent_at
+            ):
+                return False
+
+            # Join the emails already waiting for the same recipient
+            next_attempt = now + DIGEST_WINDOW
+            if DIGEST_WINDOW:
+                waiting = connection.get_outbox_window(destination, now, next_attempt)
+                next_attempt = next_attempt if waiting is None else waiting
+
+            connection.add_outbox_email(
+                user_id,
+                type_id,
+                as_date_string(last),
+                kind,
+                destination,
+                subject,
+                message,
+                next_attempt,
+            )
+            return True
+
+    @staticmethod
+    def take(
+        now: float = None,
+        limit=OUTBOX_BATCH_SIZE,
+        lease=OUTBOX_RETRY_DELAY,
+        settings=None,
+    ) -> List[OutboxEmail]:
+        """Returns the emails that can be delivered, oldest first.
+
+        The emails are leased: they are not returned again for lease seconds,
+        so several workers never send the same email. If a worker stops
+        before sending them, another one takes them once the lease expires.
+
+        Args:
+            now (float): current time, in seconds since the epoch (default:
+                time.time()).
+            limit (int): maximum number of emails returned.
+            lease (float): seconds before the emails can be taken again.
+
+        """
+        if now is None:
+            now = time.time()
+
+        with DBConnection(settings=settings) as connection:
+            return [
+                OutboxEmail(*x[:3], as_date(x[3]), *x[4:])
+                for x in connection.lease_outbox_emails(now, limit, now + lease)
+            ]
+
+    @staticmethod
+    def delivered(email_id: int, settings=None):
+        """Removes an email that has been sent from the outbox."""
+        with DBConnection(settings=settings) as connection:
+            connection.remove_outbox_email(email_id)
+
+    @staticmethod
+    def retry(email_id: int, delay: float, error: str = None, settings=None):
+        """Delays an email that could not be sent.
+
+        Args:
+            email_id (int): id of the email.
+            delay (float): seconds to wait before trying again.
+            error (str): description of the error (optional).
+
+        """
+        with DBConnection(settings=settings) as connection:
+            connection.retry_outbox_email(email_id, time.time() + delay, error)
+
+
+class ConnectionPool:
+    """Process-wide pool of sqlite connections.
+
+    Connections are checked out by a single user at a time, so they can be
+    safely shared between threads. The schema of each database is checked
+    only once per process, when its first connection is created.
+    """
+
+    def __init__(self, max_idle=4):
+        self.max_idle = max_idle
+        self._lock = threading.Lock()
+        self._idle = {}
+        self._ready = set()
+
+    @staticmethod
+    def connect(path: str, readonly=False) -> sqlite3.Connection:
+        """Opens a new connection to path.
+
+        Args:
+            path (str): path of the database.
+            readonly (bool): if True, the database is opened in read-only mode.
+
+        """
+        if readonly:
+            return sqlite3.connect(
+                "file:%s?mode=ro" % quote(path),
+                uri=True,
+                timeout=DATABASE_TIMEOUT,
+                check_same_thread=False,
+            )
+
+        connection = sqlite3.connect(
+            path, timeout=DATABASE_TIMEOUT, check_same_thread=False
+        )
+        connection.execute("PRAGMA foreign_keys = ON")
+        connection.execute("PRAGMA journal_mode = %s" % DATABASE_JOURNAL_MODE)
+        connection.execute("PRAGMA synchronous = %s" % DATABASE_SYNCHRONOUS)
+        return connection
+
+    def acquire(self, path: str, readonly=False) -> sqlite3.Connection:
+        """Returns an idle connection to path, or a new one if there are none.
+
+        Args:
+            path (str): path of the database.
+            readonly (bool): if True, the connection can't write to the database.
+
+        """
+        with self._lock:
+            idle = self._idle.get((path, readonly))
+            if idle:
+                return idle.pop()
+
+            if path not in self._ready:
+                # Read-only connections can't create or migrate the database
+                connection = self.connect(path)
+                logger.debug("Checking schema of %r", path)
+                try:
+                    migrate(connection)
+                except BaseException:
+                    connection.close()
+                    raise
+
+                self._ready.add(path)
+                if not readonly:
+                    return connection
+                self._idle.setdefault((path, False), []).append(connection)
+
+            return self.connect(path, readonly)
+
+    def release(self, path: str, connection: sqlite3.Connection, readonly=False):
+        """Returns a connection to the pool, closing it if the pool is full."""
+        if connection.in_transaction:
+            connection.rollback()
+
+        with self._lock:
+            idle = self._idle.setdefault((path, readonly), [])
+            if len(idle) < self.max_idle:
+                idle.append(connection)
+                return
+
+        connection.close()
+
+    def clear(self):
+        """Closes every idle connection and forgets the checked schemas."""
+        with self._lock:
+            for idle in self._idle.values():
+                for connection in idle:
+                    connection.close()
+
+            self._idle.clear()
+            self._ready.clear()
+
+
+pool = ConnectionPool()
 
 
 class DBConnection:
-    """Represents a sqlite database connection."""
+    """Represents a sqlite database connection, checked out from the pool.
 
-    def __init__(self):
-        self.connection = sqlite3.connect(DATABASE_PATH.as_posix())
-        self.cursor = self.connection.cursor()
+    Args:
+        readonly (bool): if True, the database is opened in read-only mode.
+        settings (Settings): settings with the path of the database (default:
+            those of the process).
 
-        self.ensure_table()
+    """
+
+    def __init__(self, readonly=False, settings=None):
+        self.path = (settings or get_settings()).database_path.as_posix()
+        self.readonly = readonly
+        self.connection = pool.acquire(self.path, readonly)
+        self.cursor = self.connection.cursor()
 
     def __enter__(self):
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self.commit()
+        if exc_type is None:
+            self.commit()
+        else:
+            self.connection.rollback()
         self.close()
 
     def commit(self):
@@ -106,35 +897,431 @@ class DBConnection:
         self.connection.commit()
 
     def close(self):
-        """Closes the database."""
+        """Returns the connection to the pool."""
         self.cursor.close()
-        self.connection.close()
+        pool.release(self.path, self.connection, self.readonly)
 
-    def ensure_table(self):
-        """Creates the table 'lens' if it does not exist."""
-        self.cursor.execute(
-            """CREATE TABLE IF NOT EXISTS 'lens' (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        timestamp TEXT NOT NULL UNIQUE
-                        )"""
-        )
+    @staticmethod
+    def _where(user_id, type_id=None) -> tuple:
+        """Returns the condition that selects the history of a user, and its
+        parameters. If type_id is None, every type is selected."""
+        if type_id is None:
+            return "user_id = ?", [user_id]
+        return "user_id = ? AND type_id = ?", [user_id, type_id]
 
-    def add(self, time_str):
+    def add(self, time_str, user_id=DEFAULT_USER_ID, type_id=DEFAULT_TYPE_ID):
         """Adds the time_str to the database.
 
         Args:
             time_str (str): time string to add to the database.
+            user_id (int): id of the user the time string belongs to.
+            type_id (int): id of the type of the lens.
+        """
+        self.cursor.execute(
+            "INSERT INTO lens (user_id, type_id, day) VALUES (?, ?, ?)",
+            [user_id, type_id, to_ordinal(time_str)],
+        )
+        self.update_schedule(user_id, type_id)
+
+    def add_many(
+        self, time_strs: list_of_str, user_id=DEFAULT_USER_ID, type_id=DEFAULT_TYPE_ID
+    ) -> list_of_str:
+        """Adds the time strings that are not in the database yet.
+
+        Args:
+            time_strs (list): time strings to add to the database.
+            user_id (int): id of the user the time strings belong to.
+            type_id (int): id of the type of the lens.
+
+        Returns:
+            list: time strings skipped because they were already present.
+
         """
-        self.cursor.execute("INSERT INTO lens VALUES (NULL, ?)", [time_str])
+        days = [to_ordinal(x) for x in time_strs]
+        placeholders = ", ".join("?" * len(days))
+        self.cursor.execute(
+            "SELECT day FROM lens WHERE user_id = ? AND type_id = ? AND day IN (%s)"
+            % placeholders,
+            [user_id, type_id] + days,
+        )
+        existing = {x[0] for x in self.cursor.fetchall()}
+
+        new = []
+        duplicates = []
+        for time_str, day in zip(time_strs, days):
+            if day in existing:
+                duplicates.append(time_str)
+            else:
+                existing.add(day)
+                new.append((user_id, type_id, day))
+
+        self.cursor.executemany(
+            "INSERT INTO lens (user_id, type_id, day) VALUES (?, ?, ?)", new
+        )
+        if new:
+            self.update_schedule(user_id, type_id)
+        return duplicates
+
+    def update_schedule(self, user_id=DEFAULT_USER_ID, type_id=DEFAULT_TYPE_ID):
+        """Recomputes the day the user must change lens of a type from its
+        last change."""
+        self.cursor.execute(
+            """INSERT OR REPLACE INTO schedule (user_id, type_id, last_day, due_day)
+            SELECT users.id, lens_types.id, MAX(lens.day),
+                MAX(lens.day) + COALESCE(lens_types.durability, users.durability) + 1
+            FROM lens
+            JOIN users ON users.id = lens.user_id
+            JOIN lens_types ON lens_types.id = lens.type_id
+            WHERE lens.user_id = ? AND lens.type_id = ?
+            GROUP BY users.id, lens_types.id""",
+            [user_id, type_id],
+        )
+
+    def get_schedule(self) -> List[tuple]:
+        """Returns the rows (user id, type id, due time string) of the enabled
+        users."""
+        self.cursor.execute(
+            "SELECT user_id, type_id, due_day FROM schedule "
+            "JOIN users ON users.id = schedule.user_id WHERE enabled"
+        )
+        return [x[:2] + (from_ordinal(x[2]),) for x in self.cursor.fetchall()]
+
+    def get_due_day(
+        self, user_id=DEFAULT_USER_ID, type_id=DEFAULT_TYPE_ID
+    ) -> Optional[str]:
+        """Returns the time string of the day the user must change lens."""
+        self.cursor.execute(
+            "SELECT due_day FROM schedule WHERE user_id = ? AND type_id = ?",
+            [user_id, type_id],
+        )
+        row = self.cursor.fetchone()
+        return from_ordinal(row[0]) if row else None
+
+    def get_first(self, user_id=DEFAULT_USER_ID, type_id=None) -> Optional[str]:
+        """Returns the first time string of the database."""
+        where, params = self._where(user_id, type_id)
+        self.cursor.execute("SELECT MIN(day) FROM lens WHERE " + where, params)
+        return from_ordinal(self.cursor.fetchone()[0])
 
-    def get_last(self) -> Optional[str]:
+    def get_last(self, user_id=DEFAULT_USER_ID, type_id=None) -> Optional[str]:
         """Returns the last time string of the database."""
-        try:
-            return self.list()[-1]
-        except IndexError:  # There are no entries
-            return None
+        where, params = self._where(user_id, type_id)
+        self.cursor.execute("SELECT MAX(day) FROM lens WHERE " + where, params)
+        return from_ordinal(self.cursor.fetchone()[0])
+
+    def contains(self, time_str: str, user_id=DEFAULT_USER_ID, type_id=None) -> bool:
+        """Returns True if time_str is in the database."""
+        where, params = self._where(user_id, type_id)
+        self.cursor.execute(
+            "SELECT 1 FROM lens WHERE %s AND day = ?" % where,
+            params + [to_ordinal(time_str)],
+        )
+        return self.cursor.fetchone() is not None
+
+    def count(
+        self, since=None, until=None, user_id=DEFAULT_USER_ID, type_id=None
+    ) -> int:
+        """Returns the number of time strings, optionally between since and until."""
+        where, params = self._where(user_id, type_id)
+        self.cursor.execute(
+            "SELECT COUNT(*) FROM lens WHERE %s AND day >= ? AND day <= ?" % where,
+            params
+            + [
+                1 if since is None else to_ordinal(since),
+                date.max.toordinal() if until is None else to_ordinal(until),
+            ],
+        )
+        return self.cursor.fetchone()[0]
+
+    def before(
+        self, time_str: str, user_id=DEFAULT_USER_ID, type_id=None
+    ) -> Optional[str]:
+        """Returns the last time string before time_str."""
+        where, params = self._where(user_id, type_id)
+        self.cursor.execute(
+            "SELECT MAX(day) FROM lens WHERE %s AND day < ?" % where,
+            params + [to_ordinal(time_str)],
+        )
+        return from_ordinal(self.cursor.fetchone()[0])
 
-    def list(self) -> list_of_str:
+    def after(
+        self, time_str: str, user_id=DEFAULT_USER_ID, type_id=None
+    ) -> Optional[str]:
+        """Returns the first time string after time_str."""
+        where, params = self._where(user_id, type_id)
+        self.cursor.execute(
+            "SELECT MIN(day) FROM lens WHERE %s AND day > ?" % where,
+            params + [to_ordinal(time_str)],
+        )
+        return from_ordinal(self.cursor.fetchone()[0])
+
+    def list(self, user_id=DEFAULT_USER_ID, type_id=None) -> list_of_str:
         """Returns a list with every time string in the database."""
-        self.cursor.execute("SELECT timestamp FROM lens ORDER BY timestamp")
-        return sorted([x[0] for x in self.cursor.fetchall()])
+        where, params = self._where(user_id, type_id)
+        self.cursor.execute(
+            "SELECT day FROM lens WHERE %s ORDER BY day" % where, params
+        )
+        return [from_ordinal(x[0]) for x in self.cursor.fetchall()]
+
+    def iter(
+        self,
+        since=None,
+        until=None,
+        reverse=False,
+        batch_size=BATCH_SIZE,
+        limit=None,
+        offset=0,
+        user_id=DEFAULT_USER_ID,
+        type_id=None,
+    ) -> Iterator[str]:
+        """Yields the time strings of the database, fetching them in batches.
+
+        Args:
+            since (str): first time string to include (optional).
+            until (str): last time string to include (optional).
+            reverse (bool): if True, yields the time strings in descending order.
+            batch_size (int): number of rows fetched at once.
+            limit (int): maximum number of time strings to yield (optional).
+            offset (int): number of time strings to skip.
+            user_id (int): id of the user the time strings belong to.
+            type_id (int): id of the type of the lens (default: every type).
+        """
+        where, params = self._where(user_id, type_id)
+        query = "SELECT day FROM lens WHERE " + where
+
+        if since is not None:
+            query += " AND day >= ?"
+            params.append(to_ordinal(since))
+        if until is not None:
+            query += " AND day <= ?"
+            params.append(to_ordinal(until))
+
+        query += " ORDER BY day DESC" if reverse else " ORDER BY day"
+        query += " LIMIT ? OFFSET ?"
+        params += [-1 if limit is None else limit, offset]
+
+        cursor = self.connection.cursor()
+        try:
+            cursor.execute(query, params)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    return
+                for row in rows:
+                    yield from_ordinal(row[0])
+        finally:
+            cursor.close()
+
+    def add_user(
+        self, email: str, durability: int, enabled=True, rules=DEFAULT_RULE_SET
+    ) -> int:
+        """Adds a user to the database, returning its id."""
+        self.cursor.execute(
+            "INSERT INTO users (email, durability, enabled, rules) VALUES (?, ?, ?, ?)",
+            [email, durability, enabled, rules],
+        )
+        return self.cursor.lastrowid
+
+    def get_user(self, email: str) -> Optional[tuple]:
+        """Returns the row of the user with the given email, if it exists."""
+        self.cursor.execute(
+            "SELECT id, email, durability, enabled, rules FROM users WHERE email = ?",
+            [email],
+        )
+        return self.cursor.fetchone()
+
+    def list_users(self) -> List[tuple]:
+        """Returns the rows of every user, ordered by id."""
+        self.cursor.execute("SELECT id, email, durability, enabled, rules FROM users")
+        return self.cursor.fetchall()
+
+    def update_user(self, email: str, **values) -> bool:
+        """Updates the columns of a user, returning False if it does not exist."""
+        assignments = ", ".join("%s = ?" % x for x in values)
+        self.cursor.execute(
+            "UPDATE users SET %s WHERE email = ?" % assignments,
+            list(values.values()) + [email],
+        )
+        if not self.cursor.rowcount:
+            return False
+
+        if "durability" in values:
+            # Types with their own durability are not affected
+            self.cursor.execute(
+                """UPDATE schedule SET due_day = last_day + ? + 1
+                WHERE user_id = (SELECT id FROM users WHERE email = ?)
+                AND type_id IN (SELECT id FROM lens_types WHERE durability IS NULL)""",
+                [values["durability"], email],
+            )
+        return True
+
+    def add_lens_type(self, name: str, durability: int = None, rules=None) -> int:
+        """Adds a lens type to the database, returning its id."""
+        self.cursor.execute(
+            "INSERT INTO lens_types (name, durability, rules) VALUES (?, ?, ?)",
+            [name, durability, rules],
+        )
+        return self.cursor.lastrowid
+
+    def get_lens_type(self, name: str) -> Optional[tuple]:
+        """Returns the row of the lens type with the given name, if it exists."""
+        self.cursor.execute(
+            "SELECT id, name, durability, rules FROM lens_types WHERE name = ?", [name]
+        )
+        return self.cursor.fetchone()
+
+    def list_lens_types(self) -> List[tuple]:
+        """Returns the rows of every lens type, ordered by id."""
+        self.cursor.execute("SELECT id, name, durability, rules FROM lens_types")
+        return self.cursor.fetchall()
+
+    def get_due(self, today: str, margin: int) -> List[tuple]:
+        """Returns the lens of enabled users whose last change is close to expire.
+
+        Only the index of the table 'schedule' is searched, so the cost does
+        not depend on the size of the history.
+
+        Args:
+            today (str): time string of today.
+            margin (int): lens are due if their last change is at least
+                (durability - margin) days old.
+
+        Returns:
+            list: rows (user id, email, durability, enabled, rules, last time
+                string, due time string, type id, name, durability, rules).
+
+        """
+        self.cursor.execute(
+            """SELECT users.id, email, users.durability, enabled, users.rules,
+                last_day, due_day,
+                lens_types.id, name, lens_types.durability, lens_types.rules
+            FROM schedule
+            JOIN users ON users.id = schedule.user_id
+            JOIN lens_types ON lens_types.id = schedule.type_id
+            WHERE due_day <= ? AND enabled
+            ORDER BY users.id, lens_types.id""",
+            [to_ordinal(today) + margin + 1],
+        )
+        return [
+            x[:5] + (from_ordinal(x[5]), from_ordinal(x[6])) + x[7:]
+            for x in self.cursor.fetchall()
+        ]
+
+    def add_notification(
+        self, user_id: int, type_id: int, last: str, kind: str, sent_at: str
+    ) -> bool:
+        """Records a notification, returning False if it was already recorded."""
+        self.cursor.execute(
+            "INSERT OR IGNORE INTO notifications VALUES (?, ?, ?, ?, ?)",
+            [user_id, type_id, to_ordinal(last), kind, sent_at],
+        )
+        return self.cursor.rowcount > 0
+
+    def remove_notification(self, user_id: int, type_id: int, last: str, kind: str):
+        """Removes the record of a notification."""
+        self.cursor.execute(
+            "DELETE FROM notifications "
+            "WHERE user_id = ? AND type_id = ? AND last_day = ? AND kind = ?",
+            [user_id, type_id, to_ordinal(last), kind],
+        )
+
+    def add_outbox_email(
+        self,
+        user_id: int,
+        type_id: int,
+        last: str,
+        kind: str,
+        destination: str,
+        subject: str,
+        message: str,
+        next_attempt: float,
+    ):
+        """Adds an email to the outbox."""
+        self.cursor.execute(
+            "INSERT INTO outbox (user_id, type_id, last_day, kind, destination, "
+            "subject, message, next_attempt) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [
+                user_id,
+                type_id,
+                to_ordinal(last),
+                kind,
+                destination,
+                subject,
+                message,
+                next_attempt,
+            ],
+        )
+
+    def get_outbox_window(
+        self, destination: str, now: float, until: float
+    ) -> Optional[float]:
+        """Returns the earliest time, after now and until until, when an email
+        of the outbox for destination is first tried, or None."""
+        self.cursor.execute(
+            "SELECT MIN(next_attempt) FROM outbox WHERE destination = ? "
+            "AND attempts = 0 AND next_attempt > ? AND next_attempt <= ?",
+            [destination, now, until],
+        )
+        return self.cursor.fetchone()[0]
+
+    def begin_immediate(self):
+        """Starts a write transaction, so other writers wait until it ends."""
+        self.cursor.execute("BEGIN IMMEDIATE")
+
+    def get_rate_limit(self, name: str) -> Optional[tuple]:
+        """Returns the row (tokens, updated) of a token bucket, if it exists."""
+        self.cursor.execute(
+            "SELECT tokens, updated FROM rate_limits WHERE name = ?", [name]
+        )
+        return self.cursor.fetchone()
+
+    def set_rate_limit(self, name: str, tokens: float, updated: float):
+        """Stores the tokens of a token bucket at the time updated."""
+        self.cursor.execute(
+            "INSERT OR REPLACE INTO rate_limits VALUES (?, ?, ?)",
+            [name, tokens, updated],
+        )
+
+    def lease_outbox_emails(
+        self, now: float, limit: int, lease_until: float
+    ) -> List[tuple]:
+        """Returns the rows (id, user_id, type_id, last time string, kind,
+        destination, subject, message, attempts, last_error) of the emails of
+        the outbox that can be tried at now, oldest first, and delays them
+        until lease_until."""
+        # Other workers must wait until the emails are leased
+        self.begin_immediate()
+        self.cursor.execute(
+            "SELECT id, user_id, type_id, last_day, kind, destination, subject, "
+            "message, attempts, last_error FROM outbox "
+            "WHERE next_attempt <= ? ORDER BY next_attempt, id LIMIT ?",
+            [now, limit],
+        )
+        rows = self.cursor.fetchall()
+        self.cursor.executemany(
+            "UPDATE outbox SET next_attempt = ? WHERE id = ?",
+            [(lease_until, x[0]) for x in rows],
+        )
+        return [x[:3] + (from_ordinal(x[3]),) + x[4:] for x in rows]
+
+    def remove_outbox_email(self, email_id: int):
+        """Removes an email from the outbox."""
+        self.cursor.execute("DELETE FROM outbox WHERE id = ?", [email_id])
+
+    def retry_outbox_email(self, email_id: int, next_attempt: float, error: str):
+        """Records a failed attempt to send an email of the outbox."""
+        self.cursor.execute(
+            "UPDATE outbox SET attempts = attempts + 1, next_attempt = ?, "
+            "last_error = ? WHERE id = ?",
+            [next_attempt, error, email_id],
+        )
+
+    def list_notifications(self, user_id=DEFAULT_USER_ID) -> List[tuple]:
+        """Returns the rows (user_id, type_id, last time string, kind, sent_at)
+        of a user."""
+        self.cursor.execute(
+            "SELECT user_id, type_id, last_day, kind, sent_at FROM notifications "
+            "WHERE user_id = ? ORDER BY sent_at, last_day",
+            [user_id],
+        )
+        return [x[:2] + (from_ordinal(x[2]),) + x[3:] for x in self.cursor.fetchall()]
@@ -1,9 +1,24 @@
 import json
+import os
+import threading
 from collections import namedtuple
 
-from .config import CREDENTIALS_PATH
+from .config import (
+    CREDENTIALS_ENV,
+    CREDENTIALS_FD_ENV,
+    CREDENTIALS_PATH,
+    CREDENTIALS_SOURCES,
+)
 from .exceptions import NoCredentialsError
 
+UnencryptedCredentials = namedtuple("UnencryptedCredentials", ["username", "password"])
+
+# ROT13 is its own inverse, the same table encrypts and decrypts
+_ROT13 = str.maketrans(
+    "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz",
+    "NOPQRSTUVWXYZABCDEFGHIJKLMnopqrstuvwxyzabcdefghijklm",
+)
+
 
 class Credentials:
     def __init__(self, enc_user, enc_pass):
@@ -18,31 +33,22 @@ class Credentials:
         return cls(enc_user, enc_pass)
 
     @classmethod
-    def load_from_file(cls):
-        data = CREDENTIALS_PATH.read_text()
+    def load_from_file(cls, path=None):
+        data = (path or CREDENTIALS_PATH).read_text()
         return Credentials(**json.loads(data))
 
     def decrypt(self):
-        Interface = namedtuple("UnencryptedCredentials", ["username", "password"])
-        return Interface(self._decrypt(self.enc_user), self._decrypt(self.enc_pass))
+        return UnencryptedCredentials(
+            self._decrypt(self.enc_user), self._decrypt(self.enc_pass)
+        )
 
     @classmethod
     def _decrypt(cls, string):
-        d = {}
-        for c in (65, 97):
-            for i in range(26):
-                d[chr(i + c)] = chr((i + 13) % 26 + c)
-
-        return "".join([d.get(c, c) for c in string])
+        return string.translate(_ROT13)
 
     @classmethod
     def _encrypt(cls, string):
-        d = {}
-        for c in (65, 97):
-            for i in range(26):
-                d[chr(i + c)] = chr((i - 13) % 26 + c)
-
-        return "".join([d.get(c, c) for c in string])
+        return string.translate(_ROT13)
 
     def save(self):
         CREDENTIALS_PATH.parent.mkdir(exist_ok=True, parents=True)
@@ -51,14 +57,148 @@ class Credentials:
         return True
 
 
-def get_credentials():
-    if not CREDENTIALS_PATH.exists():
+class CredentialsSource:
+    """Place the credentials are read from.
+
+    Subclasses implement get(), which returns the credentials or None if the
+    source doesn't have them.
+    """
+
+    def get(self):
+        raise NotImplementedError
+
+    def clear(self):
+        """Forgets the credentials cached, if any."""
+
+
+class EnvSource(CredentialsSource):
+    """Reads the unencrypted credentials from environment variables.
+
+    Args:
+        names (tuple): names of the variables of the username and the password.
+
+    """
+
+    def __init__(self, names=CREDENTIALS_ENV):
+        self.names = names
+
+    def get(self):
+        username, password = (os.environ.get(x) for x in self.names)
+        if username is None or password is None:
+            return None
+        return UnencryptedCredentials(username, password)
+
+
+class FileSource(CredentialsSource):
+    """Reads the credentials saved by the command credentials.
+
+    The file is read and decrypted only once, until its modification time or
+    its size change: checking them costs a single stat() per call.
+
+    Args:
+        path (Path): path of the file (default: config CREDENTIALS_PATH).
+
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._cache = None
+
+    def get(self):
+        path = self.path or CREDENTIALS_PATH
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            self._cache = None
+            return None
+
+        key = (path, stat.st_mtime_ns, stat.st_size)
+        cache = self._cache
+        if cache is None or cache[0] != key:
+            cache = (key, Credentials.load_from_file(path).decrypt())
+            self._cache = cache
+        return cache[1]
+
+    def clear(self):
+        self._cache = None
+
+
+class FDSource(CredentialsSource):
+    """Reads the unencrypted credentials, as a JSON object with the keys
+    'username' and 'password', from a file descriptor (e.g. a pipe given by a
+    secrets manager).
+
+    The descriptor can only be read once, so the credentials are kept for the
+    life of the process.
+
+    Args:
+        env (str): environment variable with the number of the descriptor.
+
+    """
+
+    def __init__(self, env=CREDENTIALS_FD_ENV):
+        self.env = env
+        self._credentials = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        with self._lock:
+            if self._credentials is None:
+                fd = os.environ.get(self.env)
+                if fd is None:
+                    return None
+
+                with os.fdopen(int(fd), encoding="utf-8") as file:
+                    data = json.load(file)
+                self._credentials = UnencryptedCredentials(
+                    data["username"], data["password"]
+                )
+            return self._credentials
+
+
+SOURCES = {"env": EnvSource, "fd": FDSource, "file": FileSource}
+
+
+class CredentialsProvider:
+    """Returns the credentials of the first source that has them.
+
+    Args:
+        sources (tuple): names of the SOURCES, in order of preference.
+
+    """
+
+    def __init__(self, sources=CREDENTIALS_SOURCES):
+        self.sources = [SOURCES[x]() for x in sources]
+
+    def get(self):
+        """Returns the credentials.
+
+        Raises:
+            NoCredentialsError: if no source has the credentials.
+
+        """
+        for source in self.sources:
+            credentials = source.get()
+            if credentials is not None:
+                return credentials
+
         raise NoCredentialsError
 
-    creds = Credentials.load_from_file()
-    return creds.decrypt()
+    def clear(self):
+        """Forgets the credentials cached by the sources."""
+        for source in self.sources:
+            source.clear()
+
+
+provider = CredentialsProvider()
+
+
+def get_credentials():
+    return provider.get()
 
 
 def save_credentials(username, password):
     credentials = Credentials.from_unencrypted(username, password)
-    return credentials.save()
+    result = credentials.save()
+    provider.clear()
+    return result
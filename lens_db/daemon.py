@@ -0,0 +1,159 @@
+import asyncio
+import heapq
+import logging
+import os
+import signal
+from datetime import date, datetime, timedelta
+from typing import Optional
+
+from .config import DAEMON_POLL_INTERVAL
+from .core import Lens
+from .rules import offsets
+from .scanner import scan_users
+from .settings import get_settings
+from .utils import today_date
+from .worker import Worker
+
+logger = logging.getLogger(__name__)
+
+__all__ = ["Daemon", "next_notification", "run_daemon"]
+
+
+def next_notification(due: date, today: date) -> Optional[date]:
+    """Returns the next day, on or after today, when an email may be sent to a
+    user whose lens must be changed on due, or None if there are no more."""
+    for offset in offsets():
+        day = due + timedelta(days=offset)
+        if day >= today:
+            return day
+    return None
+
+
+class Daemon:
+    """Resident scanner.
+
+    The next day each user may be notified of each type of lens is kept in a min-heap, so the
+    daemon sleeps until the earliest one. The database files and the
+    disabled flag of the settings are checked every poll_interval seconds with
+    os.stat, and any change triggers a scan immediately. Repeated scans are
+    harmless, as each email is queued only once. If a worker is given, it is
+    woken after each scan to deliver the emails queued.
+    """
+
+    def __init__(
+        self, poll_interval=DAEMON_POLL_INTERVAL, worker: Worker = None, settings=None
+    ):
+        self.poll_interval = poll_interval
+        self.worker = worker
+        self.settings = settings or get_settings()
+        self.deadlines = []
+        self._stamp = None
+        self._stop = None
+
+    def stamp(self) -> tuple:
+        """Returns the modification times and sizes of the files that, if
+        changed, may alter the notifications."""
+        database = str(self.settings.database_path)
+        stamp = []
+        for path in (database, database + "-wal", str(self.settings.disabled_path)):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                stamp.append(None)
+            else:
+                stamp.append((stat.st_mtime_ns, stat.st_size))
+        return tuple(stamp)
+
+    def load(self, today: date):
+        """Rebuilds the heap of deadlines from the schedule of the database."""
+        deadlines = []
+        for user_id, type_id, due in Lens.get_schedule(settings=self.settings):
+            day = next_notification(due, today)
+            if day is not None:
+                deadlines.append((day, user_id, type_id))
+
+        heapq.heapify(deadlines)
+        self.deadlines = deadlines
+        logger.debug("Loaded %d deadlines", len(deadlines))
+
+    def scan(self, today: date):
+        """Scans the users, unless the scanner is disabled."""
+        if self.settings.disabled_path.exists():
+            logger.debug("DISABLED flag is active, skipping scan")
+            return
+        scan_users(today, self.settings)
+        if self.worker is not None:
+            self.worker.wake()
+
+    def tick(self):
+        """Scans the users if the database changed or a deadline was reached."""
+        today = today_date()
+        stamp = self.stamp()
+
+        if stamp != self._stamp:
+            logger.debug("Changes detected, scanning")
+            self._stamp = stamp
+            self.load(today)
+            return self.scan(today)
+
+        if self.deadlines and self.deadlines[0][0] <= today:
+            logger.debug("Deadline reached, scanning")
+            while self.deadlines and self.deadlines[0][0] <= today:
+                heapq.heappop(self.deadlines)
+            self.scan(today)
+            self.load(today + timedelta(days=1))
+
+    def timeout(self, now: datetime = None) -> float:
+        """Returns the seconds to sleep until the next deadline, at most
+        poll_interval."""
+        if not self.deadlines:
+            return self.poll_interval
+
+        now = now or datetime.now()
+        deadline = datetime.combine(self.deadlines[0][0], datetime.min.time())
+        seconds = (deadline - now).total_seconds()
+        return max(0, min(seconds, self.poll_interval))
+
+    async def run(self):
+        """Runs until stop() is called."""
+        self._stop = asyncio.Event()
+        logger.info("Daemon started")
+
+        while not self._stop.is_set():
+            self.tick()
+            try:
+                await asyncio.wait_for(self._stop.wait(), self.timeout())
+            except asyncio.TimeoutError:
+                pass
+
+        logger.info("Daemon stopped")
+
+    def stop(self):
+        """Makes run() return after the current tick."""
+        if self._stop is not None:
+            self._stop.set()
+
+
+def run_daemon(poll_interval=DAEMON_POLL_INTERVAL, settings=None):
+    """Runs the daemon, and a worker that delivers the emails it queues,
+    until SIGINT or SIGTERM is received."""
+    settings = settings or get_settings()
+    worker = Worker(settings=settings)
+    worker.start()
+    daemon = Daemon(poll_interval, worker, settings)
+    loop = asyncio.new_event_loop()
+
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(signum, daemon.stop)
+        except NotImplementedError:
+            # Windows: SIGINT still raises KeyboardInterrupt
+            pass
+
+    try:
+        loop.run_until_complete(daemon.run())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        loop.close()
+        worker.stop()
@@ -1,24 +1,237 @@
 import logging
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-from smtplib import SMTP, SMTPException
+import threading
+import time
 
-from .credentials import get_credentials
+from .config import (
+    EMAIL_BURST,
+    EMAIL_RATE,
+    EMAIL_RATE_SHARED,
+    SMTP_BACKOFF_BASE,
+    SMTP_BACKOFF_MAX,
+    SMTP_BREAKER_COOLDOWN,
+    SMTP_BREAKER_THRESHOLD,
+)
+from .core import DBConnection
+from .transports import open_transport
+from .utils import backoff
 
 logger = logging.getLogger(__name__)
 
-__all__ = ["send_email"]
+__all__ = [
+    "CircuitBreaker",
+    "breaker",
+    "TokenBucket",
+    "SharedTokenBucket",
+    "limiter",
+    "is_transient",
+    "send_email",
+]
 
 
-def send_email(destinations, subject, message, name=None, retries=5):
+def is_transient(exc: Exception) -> bool:
+    """Returns True if an error sending an email may not happen again.
+
+    Network errors, timeouts, dropped connections and 4xx replies are
+    transient. 5xx replies (e.g. bad credentials or an unknown recipient)
+    will fail again, so the email must not be retried.
+    """
+    # smtplib is only imported once it is needed, see send_email()
+    from smtplib import (
+        SMTPException,
+        SMTPRecipientsRefused,
+        SMTPResponseException,
+        SMTPServerDisconnected,
+    )
+
+    if isinstance(exc, SMTPRecipientsRefused):
+        return all(400 <= code < 500 for code, _ in exc.recipients.values())
+    if isinstance(exc, SMTPResponseException):
+        # Negative codes are errors of the connection, not replies
+        return exc.smtp_code < 0 or 400 <= exc.smtp_code < 500
+    if isinstance(exc, SMTPServerDisconnected):
+        return True
+    if isinstance(exc, SMTPException):
+        # Errors of the dialogue, like no suitable authentication method
+        return False
+    return isinstance(exc, OSError)
+
+
+class CircuitBreaker:
+    """Stops sending emails after repeated failures of the mail server.
+
+    After threshold consecutive transient failures the circuit opens, and no
+    email is sent for cooldown seconds. Then one attempt is allowed: if it
+    succeeds the circuit closes, and if it fails it stays open for another
+    cooldown.
+    """
+
+    def __init__(
+        self, threshold=SMTP_BREAKER_THRESHOLD, cooldown=SMTP_BREAKER_COOLDOWN
+    ):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """Returns True if an email can be sent."""
+        with self._lock:
+            if self.failures < self.threshold:
+                return True
+            return time.monotonic() - self.opened_at >= self.cooldown
+
+    def success(self):
+        """Records an email sent, closing the circuit."""
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def failure(self):
+        """Records a transient failure, opening the circuit after threshold."""
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                if self.opened_at is None:
+                    logger.error("Too many SMTP errors, stopping emails")
+                self.opened_at = time.monotonic()
+
+    def reset(self):
+        """Closes the circuit."""
+        self.success()
+
+
+# Shared by every transport of the process
+breaker = CircuitBreaker()
+
+
+class TokenBucket:
+    """Limits the rate of emails sent, shared by every thread of the process.
+
+    The bucket holds up to capacity tokens and gains rate tokens per second.
+    Each email takes a token, waiting for it if the bucket is empty, so after
+    a burst of capacity emails they are sent at rate per second.
+
+    Args:
+        rate (float): tokens gained per second. If None, there is no limit.
+        capacity (float): maximum number of tokens.
+
+    """
+
+    def __init__(self, rate=EMAIL_RATE, capacity=EMAIL_BURST):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def refill(tokens, updated, now, rate, capacity, needed=1) -> tuple:
+        """Returns the tokens left after taking needed tokens at now, and the
+        seconds to wait if there were not enough (0 if they were taken)."""
+        tokens = min(capacity, tokens + max(0, now - updated) * rate)
+        if tokens >= needed:
+            return tokens - needed, 0
+        return tokens, (needed - tokens) / rate
+
+    def take(self, now: float = None) -> float:
+        """Takes a token if there is one, returning 0. Otherwise, returns the
+        seconds to wait until there is one."""
+        if self.rate is None:
+            return 0
+
+        with self._lock:
+            now = time.monotonic() if now is None else now
+            self.tokens, wait = self.refill(
+                self.tokens, self.updated, now, self.rate, self.capacity
+            )
+            self.updated = now
+            return wait
+
+    def acquire(self):
+        """Takes a token, waiting for it if needed."""
+        wait = self.take()
+        while wait:
+            logger.debug("Rate limit reached, waiting %.2fs", wait)
+            time.sleep(wait)
+            wait = self.take()
+
+    def reset(self):
+        """Fills the bucket."""
+        with self._lock:
+            self.tokens = self.capacity
+            self.updated = time.monotonic()
+
+
+class SharedTokenBucket(TokenBucket):
+    """TokenBucket stored in the database, shared by every process.
+
+    Args:
+        name (str): name of the bucket in the table 'rate_limits'.
+        rate (float): tokens gained per second. If None, there is no limit.
+        capacity (float): maximum number of tokens.
+        settings (Settings): settings of the database (default: those of the
+            process).
+
+    """
+
+    def __init__(
+        self, name="email", rate=EMAIL_RATE, capacity=EMAIL_BURST, settings=None
+    ):
+        self.name = name
+        self.settings = settings
+        super().__init__(rate, capacity)
+
+    def take(self, now: float = None) -> float:
+        if self.rate is None:
+            return 0
+
+        # Wall clock time, as monotonic clocks are not shared by processes
+        now = time.time() if now is None else now
+        with DBConnection(settings=self.settings) as connection:
+            connection.begin_immediate()
+            row = connection.get_rate_limit(self.name)
+            tokens, updated = row or (self.capacity, now)
+            tokens, wait = self.refill(tokens, updated, now, self.rate, self.capacity)
+            connection.set_rate_limit(self.name, tokens, now)
+        return wait
+
+    def reset(self):
+        super().reset()
+        with DBConnection(settings=self.settings) as connection:
+            connection.set_rate_limit(self.name, self.capacity, time.time())
+
+
+# Shared by every transport of the process (or every process, if shared)
+limiter = SharedTokenBucket() if EMAIL_RATE_SHARED else TokenBucket()
+
+
+def send_email(
+    destinations,
+    subject,
+    message,
+    name=None,
+    retries=5,
+    transport=None,
+    settings=None,
+):
     """Sends an email.
 
+    Transient errors are retried, waiting longer after each one (see
+    utils.backoff). If the mail server keeps failing, the circuit breaker
+    opens and emails fail at once until it recovers. Each attempt waits for
+    the rate limiter, so the quota of the provider is not exceeded.
+
     Args:
         destinations (list or str): destination or list of destinations of the email.
         subject (str): subject of the email.
         message (str): message of the email.
         name (str): alias for the sender (optional).
-        retries (int): retries in case of error.
+        retries (int): attempts in case of transient errors.
+        transport (Transport): transport to send the email through. If None,
+            the one of settings is opened only for this email.
+        settings (Settings): settings of the transport, if it is not given
+            (default: those of the process).
 
     Returns:
         bool: True if everything went ok, False otherwise.
@@ -31,14 +244,17 @@ def send_email(destinations, subject, message, name=None, retries=5):
     if not isinstance(retries, int):
         raise TypeError("retries must be int, not %s" % type(retries).__name__)
 
-    email_credentials = get_credentials()
+    if transport is None:
+        with open_transport(settings=settings) as transport:
+            return send_email(destinations, subject, message, name, retries, transport)
 
-    logger.debug(
-        "Sending email from %r to %r (%s)",
-        email_credentials.username,
-        destinations,
-        subject,
-    )
+    # The email package is imported only when an email is sent, as most
+    # commands never send one
+    from email.mime.multipart import MIMEMultipart
+    from email.mime.text import MIMEText
+
+    sender = transport.sender
+    logger.debug("Sending email from %r to %r (%s)", sender, destinations, subject)
 
     if isinstance(destinations, str):
         destinations = [destinations]
@@ -46,9 +262,9 @@ def send_email(destinations, subject, message, name=None, retries=5):
     msg = MIMEMultipart()
 
     if name:
-        msg["From"] = "%s <%s>" % (name, email_credentials.username)
+        msg["From"] = "%s <%s>" % (name, sender)
     else:
-        msg["From"] = email_credentials.username
+        msg["From"] = sender
 
     # If destinations is set like msg["To"], only the first destination will
     # receive the email, the rest no.
@@ -58,20 +274,36 @@ def send_email(destinations, subject, message, name=None, retries=5):
     body = message.replace("\n", "<br>")
     msg.attach(MIMEText(body, "html"))
 
-    while retries > 0:
-        try:
-            server = SMTP("smtp.gmail.com", 587)
+    return send_message(transport, sender, destinations, msg, retries)
+
 
-            server.starttls()
-            server.login(email_credentials.username, email_credentials.password)
+def send_message(transport, from_addr, destinations, msg, retries):
+    """Sends a MIME message through transport, retrying transient errors."""
+    msg = msg.as_string()
+    for attempt in range(retries):
+        if not breaker.allow():
+            logger.warning("Email circuit breaker is open, email not sent")
+            return False
 
-            server.sendmail(email_credentials.username, destinations, msg.as_string())
-            server.quit()
-            return True
-        except SMTPException as exc:
-            retries -= 1
+        limiter.acquire()
+        try:
+            transport.sendmail(from_addr, destinations, msg)
+        except OSError as exc:
+            # SMTPException is a subclass of OSError
+            # Start again from a new connection
+            transport.close()
+            if not is_transient(exc):
+                logger.error("SMTP Error (%s): %s", type(exc).__name__, exc)
+                return False
+
+            breaker.failure()
             logger.warning("SMTP Error (%s): %s", type(exc).__name__, exc)
+            if attempt + 1 < retries:
+                time.sleep(backoff(attempt, SMTP_BACKOFF_BASE, SMTP_BACKOFF_MAX))
             continue
 
+        breaker.success()
+        return True
+
     logger.critical("Retries exceeded")
     return False
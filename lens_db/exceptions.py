@@ -20,3 +20,31 @@ class AlreadyDisabledError(BaseLensDBError):
 
 class AlreadyEnabledError(BaseLensDBError):
     """Already enabled error."""
+
+
+class SchemaVersionError(BaseLensDBError):
+    """Database schema newer than the program error."""
+
+
+class UserNotFoundError(BaseLensDBError):
+    """User not found error."""
+
+
+class UserAlreadyExistsError(BaseLensDBError):
+    """User already exists error."""
+
+
+class UnknownRulesError(BaseLensDBError):
+    """Unknown set of notification rules error."""
+
+
+class LensTypeNotFoundError(BaseLensDBError):
+    """Lens type not found error."""
+
+
+class LensTypeAlreadyExistsError(BaseLensDBError):
+    """Lens type already exists error."""
+
+
+class InvalidSettingsError(BaseLensDBError):
+    """Invalid settings or config file error."""
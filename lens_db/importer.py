@@ -0,0 +1,91 @@
+import csv
+import json
+import logging
+from typing import IO, Iterator
+
+logger = logging.getLogger(__name__)
+
+__all__ = ["FORMATS", "guess_format", "read_dates"]
+
+FORMATS = ("lines", "csv", "jsonl")
+DATE_KEYS = ("date", "timestamp")
+
+_EXTENSIONS = {".csv": "csv", ".jsonl": "jsonl", ".ndjson": "jsonl"}
+
+
+def guess_format(filename: str) -> str:
+    """Guesses the format of a file from its extension, defaulting to lines."""
+    for extension, fmt in _EXTENSIONS.items():
+        if filename.lower().endswith(extension):
+            return fmt
+    return "lines"
+
+
+def read_dates(file: IO[str], fmt: str = None) -> Iterator[str]:
+    """Yields the dates stored in a file.
+
+    Args:
+        file (file): text file to read the dates from.
+        fmt (str): one of "lines" (one date per line), "csv" (column "date",
+            "timestamp" or the first one) or "jsonl" (one string or object with
+            key "date" or "timestamp" per line). If None, it is guessed from
+            the name of the file.
+
+    Raises:
+        ValueError: if fmt is not a valid format.
+
+    """
+    if fmt is None:
+        fmt = guess_format(getattr(file, "name", ""))
+
+    logger.debug("Reading dates from %r (%s)", getattr(file, "name", file), fmt)
+
+    if fmt == "lines":
+        return _read_lines(file)
+    if fmt == "csv":
+        return _read_csv(file)
+    if fmt == "jsonl":
+        return _read_jsonl(file)
+
+    raise ValueError("Invalid format: %r (use one of %s)" % (fmt, ", ".join(FORMATS)))
+
+
+def _read_lines(file):
+    for line in file:
+        line = line.strip()
+        if line:
+            yield line
+
+
+def _read_csv(file):
+    column = 0
+    for index, row in enumerate(csv.reader(file)):
+        if not row:
+            continue
+
+        if index == 0:
+            header = [x.strip().lower() for x in row]
+            keys = [x for x in DATE_KEYS if x in header]
+            if keys:
+                column = header.index(keys[0])
+                continue
+
+        yield row[column].strip()
+
+
+def _read_jsonl(file):
+    for line in file:
+        line = line.strip()
+        if not line:
+            continue
+
+        try:
+            data = json.loads(line)
+        except ValueError:
+            # Let the validation of the dates report it
+            yield line
+            continue
+
+        if isinstance(data, dict):
+            data = next((data[x] for x in DATE_KEYS if x in data), None)
+        yield data
@@ -0,0 +1,151 @@
+import atexit
+import json
+import logging
+import queue
+from logging.handlers import (
+    QueueHandler,
+    QueueListener,
+    RotatingFileHandler,
+    TimedRotatingFileHandler,
+)
+
+from .config import LOGGING_BACKUP_COUNT, LOGGING_MAX_BYTES, LOGGING_ROTATE_WHEN
+from .exceptions import InvalidSettingsError
+from .settings import get_settings
+
+__all__ = ["JSONFormatter", "setup_logging", "stop_logging"]
+
+TEXT_FORMAT = "[%(asctime)s] %(levelname)s - %(module)s:%(lineno)s - %(message)s"
+
+
+class JSONFormatter(logging.Formatter):
+    """Formats each record as a JSON object, so the log is one object per line.
+
+    The objects have the keys 'time', 'level', 'logger', 'module', 'line',
+    'thread' and 'message' (with the traceback of the exception, if any).
+    """
+
+    def format(self, record):
+        message = record.getMessage()
+        if record.exc_info:
+            message += "\n" + self.formatException(record.exc_info)
+
+        data = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "module": record.module,
+            "line": record.lineno,
+            "thread": record.threadName,
+            "message": message,
+        }
+        return json.dumps(data, ensure_ascii=False)
+
+
+FORMATTERS = {
+    "text": lambda: logging.Formatter(TEXT_FORMAT),
+    "json": JSONFormatter,
+}
+
+
+def get_level(name: str) -> int:
+    """Returns the number of the logging level name (e.g. 'info').
+
+    Raises:
+        InvalidSettingsError: if there is no level with that name.
+
+    """
+    level = logging.getLevelName(str(name).upper())
+    if not isinstance(level, int):
+        raise InvalidSettingsError("Invalid logging level: %r" % name)
+    return level
+
+
+def file_handler(path) -> logging.Handler:
+    """Returns a handler that writes to path, rotating the file by size (or by
+    time, if config LOGGING_ROTATE_WHEN is set) and keeping the last
+    LOGGING_BACKUP_COUNT files. The file is only opened on the first record."""
+    if LOGGING_ROTATE_WHEN:
+        return TimedRotatingFileHandler(
+            path,
+            when=LOGGING_ROTATE_WHEN,
+            backupCount=LOGGING_BACKUP_COUNT,
+            encoding="utf-8",
+            delay=True,
+        )
+
+    return RotatingFileHandler(
+        path,
+        maxBytes=LOGGING_MAX_BYTES,
+        backupCount=LOGGING_BACKUP_COUNT,
+        encoding="utf-8",
+        delay=True,
+    )
+
+
+# Queue handler of the logger lens_db and listener that writes its records
+_pipeline = None
+
+
+def setup_logging(settings=None) -> QueueListener:
+    """Sends the records of lens_db to the log file of the settings.
+
+    The loggers only put the records in a queue, a background thread formats
+    them and writes them to the file. So the scans, the worker and the daemon
+    never wait for the disk. The queue is flushed when the process exits, or
+    when stop_logging() is called. Calling it again replaces the previous
+    configuration.
+
+    Args:
+        settings (Settings): settings with the path, level and format of the
+            log (default: those of the process).
+
+    Returns:
+        QueueListener: thread that writes the records.
+
+    Raises:
+        InvalidSettingsError: if the level or the format are not valid.
+
+    """
+    global _pipeline
+    settings = settings or get_settings()
+    level = get_level(settings.logging_level)
+    try:
+        formatter = FORMATTERS[settings.logging_format]()
+    except KeyError:
+        raise InvalidSettingsError(
+            "Invalid logging format %r (use one of %s)"
+            % (settings.logging_format, ", ".join(sorted(FORMATTERS)))
+        )
+
+    handler = file_handler(settings.logging_path)
+    handler.setFormatter(formatter)
+
+    stop_logging()
+    records = queue.Queue()
+    listener = QueueListener(records, handler)
+    listener.start()
+
+    queue_handler = QueueHandler(records)
+    logger = logging.getLogger("lens_db")
+    logger.setLevel(level)
+    logger.addHandler(queue_handler)
+
+    _pipeline = (queue_handler, listener)
+    return listener
+
+
+def stop_logging():
+    """Writes the records still queued and closes the log file."""
+    global _pipeline
+    if _pipeline is None:
+        return
+
+    (queue_handler, listener), _pipeline = _pipeline, None
+    logging.getLogger("lens_db").removeHandler(queue_handler)
+    listener.stop()
+    for handler in listener.handlers:
+        handler.close()
+
+
+atexit.register(stop_logging)
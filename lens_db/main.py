@@ -1,37 +1,111 @@
 import argparse
 import sys
 
-from .core import Lens
-from .credentials import save_credentials
+from .config import DAEMON_POLL_INTERVAL, LENS_DURABILITY, OUTBOX_POLL_INTERVAL
 from .exceptions import BaseLensDBError
-from .scanner import disable, enable, scan, show_status
-from .utils import exception_exit
+from .importer import FORMATS
+from .migrations import DEFAULT_TYPE_ID, DEFAULT_USER_ID
+from .rules import DEFAULT_RULE_SET, RULE_SETS
+from .settings import Settings, set_settings
+from .utils import exception_exit, today_date
+
+# The modules of each command are imported only when it runs, so quick
+# commands don't pay for the database, asyncio or smtplib.
 
 __all__ = ["main", "get_options"]
 
 HELPS = {
+    "version": "Show the version and exit",
+    "config": "JSON file with the settings (default: $LENS_DB_CONFIG or CONFIG_PATH)",
+    "database": "Path of the database (default: setting database_path)",
+    "log-level": "Minimum level of the records logged (default: setting logging_level)",
     "now": "Open lens today",
     "days": "Days after lens were opened",
     "scan": "Scan and send email report if needed",
+    "no-deliver": "Only queue the emails, for a running worker to send them",
+    "worker": "Keep sending the emails queued by scan",
+    "once": "Send the emails queued and exit",
+    "worker-interval": "Seconds between checks of the queue (default: %(default)s)",
+    "daemon": "Keep scanning, as soon as the database changes or a deadline is reached",
+    "simulate": "Show the emails that scan would send each day of a range",
+    "simulate-from": "First day of the range (YYYY-MM-DD, default: today)",
+    "simulate-to": "Last day of the range (YYYY-MM-DD)",
+    "interval": "Seconds between checks of the database (default: %(default)s)",
     "last": "Get timestamp of last entry",
     "from-str": "Load date from str in format YYYY-MM-DD",
     "list": "List database",
+    "limit": "Maximum number of entries to list",
+    "offset": "Number of entries to skip",
+    "since": "List only entries on or after this date (YYYY-MM-DD)",
+    "until": "List only entries on or before this date (YYYY-MM-DD)",
+    "reverse": "List newest entries first",
+    "import": "Import dates from a file (one per line, CSV or JSONL)",
+    "file": "File to read the dates from (default: stdin)",
+    "format": "Format of the file (default: guessed from its extension)",
     "credentials": "Sets the credentials for sending emails",
     "username": "Username to send the email from",
     "password": "Password associated to the username",
     "disable": "disable scan (if it was enabled)",
     "enable": "enable scan (if it was disabled)",
     "status": "show if scan is enabled or not",
+    "user": "Email of the user whose lens are managed (default: ADMIN_EMAIL)",
+    "users": "Manage the users whose lens are tracked",
+    "users-add": "Add a user",
+    "users-list": "List users",
+    "users-enable": "Enable the notifications of a user",
+    "users-disable": "Disable the notifications of a user",
+    "email": "Email of the user",
+    "durability": "Days that the lens of the user last",
+    "rules": "Rules that decide which emails are sent to the user",
+    "users-rules": "Change the rules of a user",
+    "type": "Type of lens managed (default: every type, or 'default' to add dates)",
+    "types": "Manage the types of lens",
+    "types-add": "Add a type of lens",
+    "types-list": "List types of lens",
+    "type-name": "Name of the type of lens (e.g. monthly-left)",
+    "type-durability": "Days that the lens of this type last (default: those of each user)",
+    "type-rules": "Rules that decide which emails are sent (default: those of each user)",
 }
 
 
+# Commands that work on the history of the user given by --user
+USER_COMMANDS = ("now", "days", "last", "from-str", "list", "import")
+
+
 def get_help(x):
     return HELPS.get(x, "ERROR (%r)" % x)
 
 
+class VersionAction(argparse.Action):
+    """Prints the version, which is only resolved when it is asked for (in a
+    source checkout, versioneer runs git)."""
+
+    def __init__(self, option_strings, dest=argparse.SUPPRESS, help=None):
+        super().__init__(option_strings, dest=dest, nargs=0, help=help)
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        from ._version import get_versions
+
+        print("lens-db %s" % get_versions()["version"])
+        parser.exit()
+
+
 def get_options(args=None):
     """Returns the CLI arguments parsed."""
     parser = argparse.ArgumentParser("lens-db")
+    parser.add_argument("--version", action=VersionAction, help=get_help("version"))
+    parser.add_argument("--config", metavar="file", help=get_help("config"))
+    parser.add_argument("--database", metavar="path", help=get_help("database"))
+    parser.add_argument(
+        "--log-level",
+        type=str.upper,
+        choices=("DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"),
+        help=get_help("log-level"),
+    )
+    parser.add_argument("--user", metavar="email", help=get_help("user"))
+    parser.add_argument(
+        "--type", dest="lens_type", metavar="name", help=get_help("type")
+    )
     subparsers = parser.add_subparsers(dest="command")
 
     subparsers.add_parser("now", help=get_help("now"))
@@ -39,7 +113,42 @@ def get_options(args=None):
     days_subparser = subparsers.add_parser("days", help=get_help("days"))
     days_subparser.add_argument("days", type=int, help=get_help("days"), metavar="days")
 
-    subparsers.add_parser("scan", help=get_help("scan"))
+    scan_parser = subparsers.add_parser("scan", help=get_help("scan"))
+    scan_parser.add_argument(
+        "--no-deliver",
+        dest="deliver",
+        action="store_false",
+        help=get_help("no-deliver"),
+    )
+
+    worker_parser = subparsers.add_parser("worker", help=get_help("worker"))
+    worker_parser.add_argument(
+        "--interval",
+        type=float,
+        default=OUTBOX_POLL_INTERVAL,
+        help=get_help("worker-interval"),
+    )
+    worker_parser.add_argument("--once", action="store_true", help=get_help("once"))
+
+    daemon_parser = subparsers.add_parser("daemon", help=get_help("daemon"))
+    daemon_parser.add_argument(
+        "--interval",
+        type=float,
+        default=DAEMON_POLL_INTERVAL,
+        help=get_help("interval"),
+    )
+
+    simulate_parser = subparsers.add_parser("simulate", help=get_help("simulate"))
+    simulate_parser.add_argument(
+        "--from", dest="since", metavar="date", help=get_help("simulate-from")
+    )
+    simulate_parser.add_argument(
+        "--to",
+        dest="until",
+        metavar="date",
+        required=True,
+        help=get_help("simulate-to"),
+    )
 
     subparsers.add_parser("last", help=get_help("last"))
 
@@ -48,7 +157,26 @@ def get_options(args=None):
         "string", type=str, help=get_help("from-str"), metavar="str"
     )
 
-    subparsers.add_parser("list", help=get_help("list"))
+    list_subparser = subparsers.add_parser("list", help=get_help("list"))
+    list_subparser.add_argument("--limit", type=int, help=get_help("limit"))
+    list_subparser.add_argument(
+        "--offset", type=int, default=0, help=get_help("offset")
+    )
+    list_subparser.add_argument("--since", help=get_help("since"))
+    list_subparser.add_argument("--until", help=get_help("until"))
+    list_subparser.add_argument(
+        "--reverse", action="store_true", help=get_help("reverse")
+    )
+
+    import_parser = subparsers.add_parser("import", help=get_help("import"))
+    import_parser.add_argument(
+        "file",
+        nargs="?",
+        default="-",
+        type=argparse.FileType("r"),
+        help=get_help("file"),
+    )
+    import_parser.add_argument("--format", choices=FORMATS, help=get_help("format"))
 
     credentials_parser = subparsers.add_parser(
         "credentials", help=get_help("credentials")
@@ -61,6 +189,53 @@ def get_options(args=None):
 
     subparsers.add_parser("status", help=get_help("status"))
 
+    users_parser = subparsers.add_parser("users", help=get_help("users"))
+    users_subparsers = users_parser.add_subparsers(dest="users_command")
+    users_subparsers.required = True
+
+    users_add_parser = users_subparsers.add_parser("add", help=get_help("users-add"))
+    users_add_parser.add_argument("email", help=get_help("email"))
+    users_add_parser.add_argument(
+        "--durability", type=int, default=LENS_DURABILITY, help=get_help("durability")
+    )
+    users_add_parser.add_argument(
+        "--rules",
+        choices=sorted(RULE_SETS),
+        default=DEFAULT_RULE_SET,
+        help=get_help("rules"),
+    )
+
+    users_subparsers.add_parser("list", help=get_help("users-list"))
+
+    for action in ("enable", "disable"):
+        action_parser = users_subparsers.add_parser(
+            action, help=get_help("users-" + action)
+        )
+        action_parser.add_argument("email", help=get_help("email"))
+
+    users_rules_parser = users_subparsers.add_parser(
+        "rules", help=get_help("users-rules")
+    )
+    users_rules_parser.add_argument("email", help=get_help("email"))
+    users_rules_parser.add_argument(
+        "rules", choices=sorted(RULE_SETS), help=get_help("rules")
+    )
+
+    types_parser = subparsers.add_parser("types", help=get_help("types"))
+    types_subparsers = types_parser.add_subparsers(dest="types_command")
+    types_subparsers.required = True
+
+    types_add_parser = types_subparsers.add_parser("add", help=get_help("types-add"))
+    types_add_parser.add_argument("name", help=get_help("type-name"))
+    types_add_parser.add_argument(
+        "--durability", type=int, help=get_help("type-durability")
+    )
+    types_add_parser.add_argument(
+        "--rules", choices=sorted(RULE_SETS), help=get_help("type-rules")
+    )
+
+    types_subparsers.add_parser("list", help=get_help("types-list"))
+
     return parser.parse_args(args)
 
 
@@ -78,40 +253,202 @@ def _main():
         sys.argv.append("-h")
 
     options = get_options()
+    settings = load_settings(options)
+    set_settings(settings)
+
+    from .logs import setup_logging
+
+    setup_logging(settings)
 
     if options.command == "scan":
-        return scan()
+        from .scanner import scan
+        from .worker import run_worker
 
-    if options.command == "days":
-        return Lens.add(delta_days=options.days)
+        scan()
+        if options.deliver:
+            run_worker(once=True)
+        return
 
-    if options.command == "now":
-        return Lens.add(delta_days=0)
+    if options.command == "worker":
+        from .worker import run_worker
 
-    if options.command == "from-str":
-        return Lens.add_custom(options.string)
+        return run_worker(options.interval, once=options.once)
 
-    if options.command == "list":
-        exit(Lens.list())
+    if options.command == "daemon":
+        from .daemon import run_daemon
 
-    if options.command == "last":
-        last = Lens.get_last()
-        if last is None:
-            exit("No lens in database")
-        exit("Last lens opened on %r" % last.strftime("%Y-%m-%d"))
+        return run_daemon(options.interval)
+
+    if options.command == "users":
+        return manage_users(options)
+
+    if options.command == "types":
+        return manage_types(options)
+
+    if options.command == "simulate":
+        return run_simulation(options)
 
     if options.command == "credentials":
+        from .credentials import save_credentials
+
         save_credentials(username=options.username, password=options.password)
         return
 
     if options.command == "enable":
+        from .scanner import enable
+
         enable()
         return
 
     if options.command == "disable":
+        from .scanner import disable
+
         disable()
         return
 
     if options.command == "status":
+        from .scanner import show_status
+
         show_status()
         return
+
+    from .core import Lens, LensTypes, Users
+
+    user_id = DEFAULT_USER_ID
+    type_id = None
+    if options.command in USER_COMMANDS:
+        if options.user:
+            user_id = Users.get(options.user).id
+        if options.lens_type:
+            type_id = LensTypes.get(options.lens_type).id
+
+    # Dates are added to the default type, but read from every type
+    add_type_id = DEFAULT_TYPE_ID if type_id is None else type_id
+
+    if options.command == "days":
+        return Lens.add(delta_days=options.days, user_id=user_id, type_id=add_type_id)
+
+    if options.command == "now":
+        return Lens.add(delta_days=0, user_id=user_id, type_id=add_type_id)
+
+    if options.command == "from-str":
+        return Lens.add_custom(options.string, user_id=user_id, type_id=add_type_id)
+
+    if options.command == "list":
+        entries = Lens.iter(
+            since=options.since,
+            until=options.until,
+            reverse=options.reverse,
+            limit=options.limit,
+            offset=options.offset,
+            user_id=user_id,
+            type_id=type_id,
+        )
+        for entry in entries:
+            print(entry, flush=True)
+        return
+
+    if options.command == "import":
+        from .importer import read_dates
+
+        with options.file:
+            result = Lens.add_many(
+                read_dates(options.file, options.format),
+                user_id=user_id,
+                type_id=add_type_id,
+            )
+
+        print("Added %d dates" % result.added)
+        if result.duplicates:
+            print(
+                "Skipped %d dates already in the database: %s"
+                % (len(result.duplicates), ", ".join(result.duplicates))
+            )
+        return
+
+    if options.command == "last":
+        last = Lens.get_last(user_id=user_id, type_id=type_id)
+        if last is None:
+            exit("No lens in database")
+        exit("Last lens opened on %r" % last.strftime("%Y-%m-%d"))
+
+
+def load_settings(options) -> Settings:
+    """Returns the settings of the config file and the environment,
+    overridden by the CLI flags."""
+    return Settings.load(
+        options.config,
+        database_path=options.database,
+        logging_level=options.log_level,
+    )
+
+
+def manage_users(options):
+    """Runs the subcommands of the command users."""
+    from .core import Users
+
+    if options.users_command == "add":
+        Users.add(options.email, durability=options.durability, rules=options.rules)
+        return
+
+    if options.users_command == "list":
+        for user in Users.list():
+            rules = "" if user.rules == DEFAULT_RULE_SET else ", %s rules" % user.rules
+            print(
+                "%s (%d days%s)%s"
+                % (
+                    user.email,
+                    user.durability,
+                    rules,
+                    "" if user.enabled else " [disabled]",
+                )
+            )
+        return
+
+    if options.users_command == "enable":
+        Users.update(options.email, enabled=True)
+        return
+
+    if options.users_command == "disable":
+        Users.update(options.email, enabled=False)
+        return
+
+    if options.users_command == "rules":
+        Users.update(options.email, rules=options.rules)
+        return
+
+
+def manage_types(options):
+    """Runs the subcommands of the command types."""
+    from .core import LensTypes
+
+    if options.types_command == "add":
+        LensTypes.add(options.name, durability=options.durability, rules=options.rules)
+        return
+
+    if options.types_command == "list":
+        for lens_type in LensTypes.list():
+            durability = "user durability"
+            if lens_type.durability is not None:
+                durability = "%d days" % lens_type.durability
+            rules = "" if lens_type.rules is None else ", %s rules" % lens_type.rules
+            print("%s (%s%s)" % (lens_type.name, durability, rules))
+        return
+
+
+def run_simulation(options):
+    """Prints the emails that scan would send from --from to --to."""
+    from .core import Users, as_date, as_date_string
+    from .simulator import simulate, summarize
+
+    since = as_date(as_date_string(options.since or today_date()))
+    until = as_date(as_date_string(options.until))
+    users = [Users.get(options.user)] if options.user else None
+
+    events = simulate(since, until, users=users)
+    for event in events:
+        print("%s %s: %s" % (event.day, event.user.email, event.rule.subject))
+
+    for month, count in sorted(summarize(events).items()):
+        print("%s: %d emails" % (month, count))
+    print("Total: %d emails" % len(events))
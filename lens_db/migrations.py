@@ -0,0 +1,281 @@
+import logging
+import sqlite3
+
+from .config import ADMIN_EMAIL, LENS_DURABILITY
+from .exceptions import SchemaVersionError
+from .utils import to_ordinal
+
+logger = logging.getLogger(__name__)
+
+__all__ = ["MIGRATIONS", "DEFAULT_USER_ID", "DEFAULT_TYPE_ID", "get_version", "migrate"]
+
+MIGRATIONS = []
+
+# Owner of the history recorded before multi-user support
+DEFAULT_USER_ID = 1
+# Type of the lens recorded before lens types were supported
+DEFAULT_TYPE_ID = 1
+
+
+def migration(function):
+    """Registers function as the next migration of the schema."""
+    MIGRATIONS.append(function)
+    return function
+
+
+def get_version(connection: sqlite3.Connection) -> int:
+    """Returns the schema version of the database (PRAGMA user_version)."""
+    return connection.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(connection: sqlite3.Connection) -> int:
+    """Applies the pending migrations to the database.
+
+    If the database is up to date, only its version is read. Otherwise, each
+    pending migration is applied in its own transaction, along with the
+    new version number.
+
+    Args:
+        connection (sqlite3.Connection): connection to the database.
+
+    Raises:
+        SchemaVersionError: if the database is newer than the program.
+
+    Returns:
+        int: schema version of the database.
+
+    """
+    version = get_version(connection)
+    if version == len(MIGRATIONS):
+        return version
+
+    while True:
+        connection.execute("BEGIN IMMEDIATE")
+
+        # Another process may have migrated the database in the meantime
+        version = get_version(connection)
+        if version > len(MIGRATIONS):
+            connection.rollback()
+            raise SchemaVersionError(
+                "Database schema version is %d, but the newest known is %d"
+                % (version, len(MIGRATIONS))
+            )
+
+        if version == len(MIGRATIONS):
+            connection.rollback()
+            break
+
+        function = MIGRATIONS[version]
+        logger.info("Applying migration %d (%s)", version + 1, function.__name__)
+        try:
+            function(connection)
+            connection.execute("PRAGMA user_version = %d" % (version + 1))
+        except BaseException:
+            connection.rollback()
+            raise
+        connection.commit()
+
+    # Reclaim the space of dropped tables and indexes
+    connection.execute("VACUUM")
+    return version
+
+
+@migration
+def create_lens(connection):
+    """Creates the original table 'lens', with text timestamps."""
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS lens ("
+        "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+        "timestamp TEXT NOT NULL UNIQUE)"
+    )
+
+
+@migration
+def lens_day_ordinals(connection):
+    """Stores dates as day ordinals in a table without rowid."""
+    columns = [x[1] for x in connection.execute("PRAGMA table_info(lens)")]
+    if "timestamp" not in columns:
+        # Created by a version that did not record the schema version
+        return
+
+    connection.execute("ALTER TABLE lens RENAME TO lens_timestamps")
+    connection.execute("CREATE TABLE lens (day INTEGER PRIMARY KEY) WITHOUT ROWID")
+    connection.executemany(
+        "INSERT INTO lens VALUES (?)",
+        (
+            (to_ordinal(x[0]),)
+            for x in connection.execute("SELECT timestamp FROM lens_timestamps")
+        ),
+    )
+    connection.execute("DROP TABLE lens_timestamps")
+
+
+@migration
+def create_users(connection):
+    """Creates the table 'users', owner of the history in the table 'lens'."""
+    connection.execute(
+        "CREATE TABLE users ("
+        "id INTEGER PRIMARY KEY, "
+        "email TEXT NOT NULL UNIQUE, "
+        "durability INTEGER NOT NULL, "
+        "enabled INTEGER NOT NULL DEFAULT 1)"
+    )
+    connection.execute(
+        "INSERT INTO users (id, email, durability) VALUES (?, ?, ?)",
+        [DEFAULT_USER_ID, ADMIN_EMAIL, LENS_DURABILITY],
+    )
+
+    connection.execute("ALTER TABLE lens RENAME TO lens_single_user")
+    connection.execute(
+        "CREATE TABLE lens ("
+        "user_id INTEGER NOT NULL REFERENCES users (id), "
+        "day INTEGER NOT NULL, "
+        "PRIMARY KEY (user_id, day)) WITHOUT ROWID"
+    )
+    connection.execute(
+        "INSERT INTO lens SELECT ?, day FROM lens_single_user", [DEFAULT_USER_ID]
+    )
+    connection.execute("DROP TABLE lens_single_user")
+
+
+@migration
+def create_schedule(connection):
+    """Creates the table 'schedule', with the day each user must change lens."""
+    connection.execute(
+        "CREATE TABLE schedule ("
+        "user_id INTEGER PRIMARY KEY REFERENCES users (id), "
+        "last_day INTEGER NOT NULL, "
+        "due_day INTEGER NOT NULL)"
+    )
+    connection.execute("CREATE INDEX schedule_due_day ON schedule (due_day)")
+    connection.execute(
+        "INSERT INTO schedule "
+        "SELECT users.id, MAX(lens.day), MAX(lens.day) + durability + 1 "
+        "FROM users JOIN lens ON lens.user_id = users.id GROUP BY users.id"
+    )
+
+
+@migration
+def create_notifications(connection):
+    """Creates the table 'notifications', with the emails sent to each user."""
+    connection.execute(
+        "CREATE TABLE notifications ("
+        "user_id INTEGER NOT NULL REFERENCES users (id), "
+        "last_day INTEGER NOT NULL, "
+        "kind TEXT NOT NULL, "
+        "sent_at TEXT NOT NULL, "
+        "PRIMARY KEY (user_id, last_day, kind)) WITHOUT ROWID"
+    )
+
+
+@migration
+def users_rules(connection):
+    """Adds the column 'rules', with the name of the notification rules of a user."""
+    connection.execute(
+        "ALTER TABLE users ADD COLUMN rules TEXT NOT NULL DEFAULT 'default'"
+    )
+
+
+@migration
+def create_lens_types(connection):
+    """Creates the table 'lens_types' and adds the type to every table keyed
+    by the history of a user.
+
+    The durability and rules of a type override those of the user, if set.
+    """
+    connection.execute(
+        "CREATE TABLE lens_types ("
+        "id INTEGER PRIMARY KEY, "
+        "name TEXT NOT NULL UNIQUE, "
+        "durability INTEGER, "
+        "rules TEXT)"
+    )
+    connection.execute(
+        "INSERT INTO lens_types (id, name) VALUES (?, 'default')", [DEFAULT_TYPE_ID]
+    )
+
+    connection.execute("ALTER TABLE lens RENAME TO lens_untyped")
+    connection.execute(
+        "CREATE TABLE lens ("
+        "user_id INTEGER NOT NULL REFERENCES users (id), "
+        "type_id INTEGER NOT NULL DEFAULT %d REFERENCES lens_types (id), "
+        "day INTEGER NOT NULL, "
+        "PRIMARY KEY (user_id, type_id, day)) WITHOUT ROWID" % DEFAULT_TYPE_ID
+    )
+    connection.execute(
+        "INSERT INTO lens SELECT user_id, ?, day FROM lens_untyped", [DEFAULT_TYPE_ID]
+    )
+    connection.execute("DROP TABLE lens_untyped")
+    # Queries over every type of a user
+    connection.execute("CREATE INDEX lens_user_day ON lens (user_id, day)")
+
+    connection.execute("ALTER TABLE schedule RENAME TO schedule_untyped")
+    connection.execute("DROP INDEX schedule_due_day")
+    connection.execute(
+        "CREATE TABLE schedule ("
+        "user_id INTEGER NOT NULL REFERENCES users (id), "
+        "type_id INTEGER NOT NULL REFERENCES lens_types (id), "
+        "last_day INTEGER NOT NULL, "
+        "due_day INTEGER NOT NULL, "
+        "PRIMARY KEY (user_id, type_id))"
+    )
+    connection.execute(
+        "INSERT INTO schedule SELECT user_id, ?, last_day, due_day "
+        "FROM schedule_untyped",
+        [DEFAULT_TYPE_ID],
+    )
+    connection.execute("DROP TABLE schedule_untyped")
+    connection.execute("CREATE INDEX schedule_due_day ON schedule (due_day)")
+
+    connection.execute("ALTER TABLE notifications RENAME TO notifications_untyped")
+    connection.execute(
+        "CREATE TABLE notifications ("
+        "user_id INTEGER NOT NULL REFERENCES users (id), "
+        "type_id INTEGER NOT NULL REFERENCES lens_types (id), "
+        "last_day INTEGER NOT NULL, "
+        "kind TEXT NOT NULL, "
+        "sent_at TEXT NOT NULL, "
+        "PRIMARY KEY (user_id, type_id, last_day, kind)) WITHOUT ROWID"
+    )
+    connection.execute(
+        "INSERT INTO notifications "
+        "SELECT user_id, ?, last_day, kind, sent_at FROM notifications_untyped",
+        [DEFAULT_TYPE_ID],
+    )
+    connection.execute("DROP TABLE notifications_untyped")
+
+
+@migration
+def create_outbox(connection):
+    """Creates the table 'outbox', with the emails waiting to be delivered.
+
+    Each email keeps the notification it belongs to, the number of failed
+    attempts and when it can be tried again (seconds since the epoch).
+    """
+    connection.execute(
+        "CREATE TABLE outbox ("
+        "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+        "user_id INTEGER NOT NULL REFERENCES users (id), "
+        "type_id INTEGER NOT NULL REFERENCES lens_types (id), "
+        "last_day INTEGER NOT NULL, "
+        "kind TEXT NOT NULL, "
+        "destination TEXT NOT NULL, "
+        "subject TEXT NOT NULL, "
+        "message TEXT NOT NULL, "
+        "attempts INTEGER NOT NULL DEFAULT 0, "
+        "next_attempt REAL NOT NULL, "
+        "last_error TEXT)"
+    )
+    connection.execute("CREATE INDEX outbox_next_attempt ON outbox (next_attempt)")
+
+
+@migration
+def create_rate_limits(connection):
+    """Creates the table 'rate_limits', with the token buckets shared by the
+    processes that send emails."""
+    connection.execute(
+        "CREATE TABLE rate_limits ("
+        "name TEXT PRIMARY KEY, "
+        "tokens REAL NOT NULL, "
+        "updated REAL NOT NULL)"
+    )
@@ -0,0 +1,160 @@
+import logging
+from collections import namedtuple
+from functools import lru_cache
+from typing import Iterable, Optional
+
+from .exceptions import UnknownRulesError
+
+logger = logging.getLogger(__name__)
+
+__all__ = [
+    "Rule",
+    "RuleTable",
+    "DEFAULT_RULES",
+    "DEFAULT_RULE_SET",
+    "RULE_SETS",
+    "register_rules",
+    "get_rules",
+    "compile_rules",
+    "offsets",
+    "match",
+    "render",
+]
+
+# offset: days after the due date when the rule applies (-1 is the day before).
+# open_ended: the rule also applies to every later day without its own rule.
+Rule = namedtuple(
+    "Rule", ["offset", "kind", "subject", "template", "severity", "open_ended"]
+)
+Rule.__new__.__defaults__ = (False,)
+
+# exact: rules by days since the last change. open_ended: (days, rule) or None.
+RuleTable = namedtuple("RuleTable", ["exact", "open_ended"])
+
+DEFAULT_RULES = (
+    Rule(
+        -2,
+        "day after tomorrow",
+        "Cambiar lentillas pasado mañana",
+        "Pasado mañana hay que cambiar las lentillas, "
+        "el último cambio fue el %(last)s (%(days)s días)",
+        "info",
+    ),
+    Rule(
+        -1,
+        "tomorrow",
+        "Cambiar lentillas mañana",
+        "Mañana hay que cambiar las lentillas, "
+        "el último cambio fue el %(last)s (%(days)s días)",
+        "warning",
+    ),
+    Rule(
+        0,
+        "today",
+        "Cambiar lentillas hoy",
+        "Hay que cambiar hoy las lentillas, "
+        "el último cambio fue el %(last)s (%(days)s días)",
+        "warning",
+    ),
+    Rule(
+        1,
+        "expired",
+        "Cambiar lentillas YA",
+        "Hay que cambiar ya las lentillas, "
+        "el último cambio fue el %(last)s (%(days)s días)",
+        "critical",
+        open_ended=True,
+    ),
+)
+
+DEFAULT_RULE_SET = "default"
+
+RULE_SETS = {
+    "default": DEFAULT_RULES,
+    # Only on the due date and once expired
+    "quiet": DEFAULT_RULES[2:],
+}
+
+
+def register_rules(name: str, rules: Iterable[Rule]):
+    """Registers a set of rules, which can then be assigned to users.
+
+    Args:
+        name (str): name of the set of rules.
+        rules (list): rules of the set. At most one can be open ended.
+
+    Raises:
+        ValueError: if more than one rule is open ended, or two rules share
+            the same offset.
+
+    """
+    rules = tuple(rules)
+    if sum(x.open_ended for x in rules) > 1:
+        raise ValueError("Only one rule can be open ended")
+    if len({x.offset for x in rules}) != len(rules):
+        raise ValueError("Two rules can't have the same offset")
+
+    RULE_SETS[name] = rules
+    compile_rules.cache_clear()
+
+
+def get_rules(name: str) -> tuple:
+    """Returns the rules of a set.
+
+    Raises:
+        UnknownRulesError: if there is no set of rules with that name.
+
+    """
+    try:
+        return RULE_SETS[name]
+    except KeyError:
+        raise UnknownRulesError(
+            "Unknown rules %r (use one of %s)" % (name, ", ".join(sorted(RULE_SETS)))
+        )
+
+
+@lru_cache(maxsize=None)
+def compile_rules(name: str, durability: int) -> RuleTable:
+    """Returns the rules of a set indexed by the days since the last change.
+
+    The lens must be changed durability + 1 days after the last change, so
+    that is the day of the rules with offset 0. Tables are cached by name and
+    durability, so they are built once for all the users that share them.
+
+    Raises:
+        UnknownRulesError: if there is no set of rules with that name.
+
+    """
+    rules = get_rules(name)
+    logger.debug("Compiling rules %r for %d days", name, durability)
+    due = durability + 1
+    exact = {due + x.offset: x for x in rules}
+    open_ended = next(((due + x.offset, x) for x in rules if x.open_ended), None)
+    return RuleTable(exact, open_ended)
+
+
+def offsets() -> tuple:
+    """Returns the offsets of every registered rule, in ascending order."""
+    return tuple(sorted({x.offset for rules in RULE_SETS.values() for x in rules}))
+
+
+def match(name: str, durability: int, days: int) -> Optional[Rule]:
+    """Returns the rule that applies days after the last change, or None.
+
+    Args:
+        name (str): name of the set of rules.
+        durability (int): days that the lens last.
+        days (int): days since the last change.
+
+    """
+    table = compile_rules(name, durability)
+    rule = table.exact.get(days)
+    if rule is None and table.open_ended is not None:
+        if days >= table.open_ended[0]:
+            rule = table.open_ended[1]
+    return rule
+
+
+def render(rule: Rule, last, days: int) -> str:
+    """Returns the message of the email of a rule."""
+    return rule.template % {"last": last, "days": days}
@@ -1,102 +1,131 @@
 import logging
-from datetime import timedelta
 
 from colorama import Fore
 
-from .config import ADMIN_EMAIL, DISABLED, DISABLED_PATH, LENS_DURABILITY_DELTA
-from .core import Lens
-from .email import send_email
+from .core import DEFAULT_LENS_TYPE, Lens, Outbox, lens_settings
 from .exceptions import AlreadyDisabledError, AlreadyEnabledError
+from .rules import match, offsets, render
+from .settings import get_settings
 from .utils import today_date
 
 logger = logging.getLogger(__name__)
 
-__all__ = ["scan"]
+__all__ = ["scan", "scan_users"]
 
 
-def scan():
-    """Scanner of the program. If it is needed, an email will be sent."""
+def scan(today=None, settings=None):
+    """Scanner of the program. If it is needed, an email will be queued for each user.
 
-    if DISABLED:
+    Every enabled user whose lens are about to expire (or have expired) is
+    found with a single query. The emails are only added to the outbox, they
+    are sent by the worker (see lens_db.worker).
+
+    Args:
+        today (date): day to scan (default: today).
+        settings (Settings): settings of the database (default: those of the
+            process).
+
+    """
+    settings = settings or get_settings()
+    if settings.disabled:
         logger.info("DISABLED flag is active, cancelling scan")
         return
 
-    last = Lens.get_last()
-    if not last:
-        logger.debug("No entries")
+    scan_users(today or today_date(), settings)
+
+
+def scan_users(today, settings=None):
+    """Queues an email for every enabled user whose lens are about to expire
+    or have expired.
+
+    Every type of lens of every user is checked, from a single query.
+
+    Args:
+        today (date): today's date.
+        settings (Settings): settings of the database.
+
+    """
+    # Users are due from the day of the earliest rule
+    due = Lens.get_due(today, margin=-offsets()[0] - 1, settings=settings)
+    if not due:
+        logger.debug("No users due")
+        return
+
+    for user, last, due_date, lens_type in due:
+        check(user, last, due_date, today, lens_type, settings)
+
+
+def check(user, last, due, today, lens_type=DEFAULT_LENS_TYPE, settings=None):
+    """Queues an email to user if a rule applies today.
+
+    The rules of the user are compiled once per durability, so finding the
+    rule is a single lookup by the days since the last change. Each kind of
+    email is queued only once per change of lens, so repeated scans don't send
+    it again.
+
+    Args:
+        user (User): user to check.
+        last (date): date of the last change of lens of the user.
+        due (date): date when the user must change lens.
+        today (date): today's date.
+        lens_type (LensType): type of the lens.
+        settings (Settings): settings of the database.
+
+    Returns:
+        bool: True if an email was queued.
+
+    """
+    days = (today - last).days
+    left = (due - today).days
+    logger.debug("Calculated %s days left for %r", left, user.email)
+
+    durability, rules = lens_settings(user, lens_type)
+    rule = match(rules, durability, days)
+    if rule is None:
+        logger.debug("%d days left with current lens", left - 1)
         return
 
-    today = today_date()
-    delta = today - last
-    logger.debug("Calculated delta of %s days", delta.days)
-
-    email_name = "Lens-db"
-
-    if delta == LENS_DURABILITY_DELTA + timedelta(days=1):
-        logger.debug(
-            "Delta == %s days, sending email (today)", LENS_DURABILITY_DELTA.days + 1
-        )
-        message = (
-            "Hay que cambiar hoy las lentillas, el último cambio fue el %s (%s días)"
-            % (last, delta.days)
-        )
-        return send_email(
-            ADMIN_EMAIL, "Cambiar lentillas hoy", message, name=email_name
-        )
-    if delta > LENS_DURABILITY_DELTA:
-        logger.debug(
-            "Delta > %s days, sending email (expired)", LENS_DURABILITY_DELTA.days
-        )
-        message = (
-            "Hay que cambiar ya las lentillas, el último cambio fue el %s (%s días)"
-            % (last, delta.days)
-        )
-        return send_email(ADMIN_EMAIL, "Cambiar lentillas YA", message, name=email_name)
-    if delta == LENS_DURABILITY_DELTA:
-        logger.debug(
-            "Delta == %s days, sending email (tomorrow)", LENS_DURABILITY_DELTA.days
-        )
-        message = (
-            "Mañana hay que cambiar las lentillas, el último cambio fue el %s (%s días)"
-            % (last, delta.days)
-        )
-        return send_email(
-            ADMIN_EMAIL, "Cambiar lentillas mañana", message, name=email_name
-        )
-    elif delta == LENS_DURABILITY_DELTA - timedelta(days=1):
-        logger.debug(
-            "Delta == %s days, sending email (day after tomorrow)",
-            LENS_DURABILITY_DELTA.days - 1,
-        )
-        message = (
-            "Pasado mañana hay que cambiar las lentillas, el último cambio fue el %s (%s días)"
-            % (last, delta.days)
-        )
-        return send_email(
-            ADMIN_EMAIL, "Cambiar lentillas pasado mañana", message, name=email_name
-        )
-
-    logger.debug(
-        "%d days left with current lens", LENS_DURABILITY_DELTA.days - delta.days
-    )
-
-
-def disable():
-    if DISABLED_PATH.exists():
+    subject = rule.subject
+    if lens_type.id != DEFAULT_LENS_TYPE.id:
+        subject += " (%s)" % lens_type.name
+
+    message = render(rule, last, days)
+    if not Outbox.enqueue(
+        user.id,
+        last,
+        rule.kind,
+        user.email,
+        subject,
+        message,
+        lens_type.id,
+        settings=settings,
+    ):
+        logger.debug("Email (%s) already sent to %r", rule.kind, user.email)
+        return False
+
+    logger.debug("%s days left, queueing email (%s)", left, rule.kind)
+    return True
+
+
+def disable(settings=None):
+    settings = settings or get_settings()
+    if settings.disabled_path.exists():
         raise AlreadyDisabledError("Scan is already disabled")
 
-    DISABLED_PATH.touch()
+    settings.set_disabled(True)
 
 
-def enable():
-    if not DISABLED_PATH.exists():
+def enable(settings=None):
+    settings = settings or get_settings()
+    if not settings.disabled_path.exists():
         raise AlreadyEnabledError("Scan is already enabled")
 
-    DISABLED_PATH.unlink()
+    settings.set_disabled(False)
 
 
-def show_status():
-    if DISABLED_PATH.exists():
+def show_status(settings=None):
+    settings = settings or get_settings()
+    if settings.disabled_path.exists():
         print(Fore.LIGHTYELLOW_EX + "Scanner is disabled" + Fore.RESET)
     else:
         print(Fore.LIGHTGREEN_EX + "Scanner is enabled" + Fore.RESET)
@@ -0,0 +1,182 @@
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+from . import config
+from .config import CONFIG_ENV, CONFIG_PATH, DISABLED_CHECK_INTERVAL
+from .exceptions import InvalidSettingsError
+
+__all__ = ["Settings", "get_settings", "set_settings"]
+
+# Each setting defaults to the constant of lens_db.config with its name in uppercase
+FIELDS = (
+    "database_path",
+    "disabled_path",
+    "email_transport",
+    "email_sink_path",
+    "smtp_host",
+    "smtp_port",
+    "smtp_security",
+    "logging_path",
+    "logging_level",
+    "logging_format",
+)
+ENV_PREFIX = "LENS_DB_"
+
+
+class Settings:
+    """Runtime configuration: where the database is, how emails are sent...
+
+    Each setting is taken from the first layer that sets it:
+
+    1. The values given to load() or to the constructor (e.g. CLI flags).
+    2. The environment variables LENS_DB_<NAME> (e.g. LENS_DB_DATABASE_PATH).
+    3. The JSON config file, if any (see load()).
+    4. The constants of lens_db.config.
+
+    The constructor only uses the first and the last layers. Settings are
+    independent of each other, so a process can use several databases by
+    passing different settings to Lens, DBConnection, scan or send_email.
+
+    Args:
+        **values: settings that override the defaults. None is ignored.
+
+    Raises:
+        InvalidSettingsError: if a setting is unknown or has an invalid value.
+
+    """
+
+    def __init__(self, **values):
+        unknown = set(values) - set(FIELDS)
+        if unknown:
+            raise InvalidSettingsError(
+                "Unknown settings: %s" % ", ".join(sorted(unknown))
+            )
+
+        for name in FIELDS:
+            default = getattr(config, name.upper())
+            value = values.get(name)
+            setattr(self, name, default if value is None else convert(name, value))
+
+        self._disabled = None
+
+    def __repr__(self):
+        values = ", ".join("%s=%r" % (x, getattr(self, x)) for x in FIELDS)
+        return "Settings(%s)" % values
+
+    @classmethod
+    def load(cls, path=None, environ=None, **values) -> "Settings":
+        """Returns the settings of every layer.
+
+        Args:
+            path (str or Path): config file. If None, the one of the
+                environment variable LENS_DB_CONFIG is used, or config
+                CONFIG_PATH if it exists.
+            environ (dict): environment variables (default: os.environ).
+            **values: settings that override the others. None is ignored.
+
+        Raises:
+            InvalidSettingsError: if the config file can't be read or a setting
+                is invalid.
+
+        """
+        environ = os.environ if environ is None else environ
+        path = path or environ.get(CONFIG_ENV)
+
+        layers = {}
+        if path is not None:
+            layers.update(read_config(Path(path)))
+        elif CONFIG_PATH.exists():
+            layers.update(read_config(CONFIG_PATH))
+
+        for name in FIELDS:
+            if ENV_PREFIX + name.upper() in environ:
+                layers[name] = environ[ENV_PREFIX + name.upper()]
+
+        layers.update((x, y) for x, y in values.items() if y is not None)
+        return cls(**layers)
+
+    @property
+    def disabled(self) -> bool:
+        """True if the scans are disabled, i.e. disabled_path exists.
+
+        The file is checked at most once every DISABLED_CHECK_INTERVAL seconds,
+        so long-running processes see the changes made by other processes
+        without a stat on every check.
+        """
+        now = time.monotonic()
+        cached = self._disabled
+        if cached is None or now - cached[0] >= DISABLED_CHECK_INTERVAL:
+            cached = (now, self.disabled_path.exists())
+            self._disabled = cached
+        return cached[1]
+
+    def set_disabled(self, disabled: bool):
+        """Disables or enables the scans, creating or removing disabled_path."""
+        if disabled:
+            self.disabled_path.touch()
+        else:
+            self.disabled_path.unlink()
+        self._disabled = (time.monotonic(), disabled)
+
+
+def convert(name: str, value):
+    """Returns value with the type of the default of the setting name.
+
+    Raises:
+        InvalidSettingsError: if value can't be converted.
+
+    """
+    default = getattr(config, name.upper())
+    if isinstance(default, Path):
+        return Path(value).expanduser()
+
+    try:
+        return type(default)(value)
+    except (TypeError, ValueError):
+        raise InvalidSettingsError("Invalid value for %s: %r" % (name, value))
+
+
+def read_config(path: Path) -> dict:
+    """Returns the settings of a JSON config file. Relative paths are relative
+    to the directory of the file.
+
+    Raises:
+        InvalidSettingsError: if the file can't be read or parsed.
+
+    """
+    try:
+        values = json.loads(path.read_text())
+    except (OSError, ValueError) as exc:
+        raise InvalidSettingsError("Invalid config file %s: %s" % (path, exc))
+
+    if not isinstance(values, dict):
+        raise InvalidSettingsError("Invalid config file %s: not an object" % path)
+
+    for name, value in values.items():
+        if name in FIELDS and isinstance(getattr(config, name.upper()), Path):
+            values[name] = path.parent / Path(value).expanduser()
+    return values
+
+
+_settings = None
+_lock = threading.Lock()
+
+
+def get_settings() -> Settings:
+    """Returns the settings of the process, loaded on the first call."""
+    global _settings
+    if _settings is None:
+        with _lock:
+            if _settings is None:
+                _settings = Settings.load()
+    return _settings
+
+
+def set_settings(settings: Settings = None):
+    """Replaces the settings of the process. If None, they are loaded again
+    on the next call to get_settings()."""
+    global _settings
+    _settings = settings
@@ -0,0 +1,128 @@
+import logging
+from collections import Counter, namedtuple
+from datetime import date
+from operator import itemgetter
+from typing import Callable, List
+
+from .core import DEFAULT_LENS_TYPE, Lens, LensType, LensTypes, User, Users
+from .core import lens_settings
+from .rules import compile_rules
+from .utils import to_ordinal
+
+logger = logging.getLogger(__name__)
+
+__all__ = ["Event", "simulate", "summarize"]
+
+Event = namedtuple("Event", ["day", "user", "last", "rule", "lens_type"])
+Event.__new__.__defaults__ = (DEFAULT_LENS_TYPE,)
+
+
+def simulate(
+    since: date, until: date, users: List[User] = None, sink: Callable = None
+) -> List[Event]:
+    """Returns the emails that scan would send if it ran every day of a range.
+
+    Instead of scanning once per day, each interval between two changes of
+    a type of lens is solved at once: the rules of the user give the days when an
+    email is sent, relative to the change that starts the interval. The
+    ledger of notifications is ignored, as if none had been sent yet.
+
+    Args:
+        since (date): first day of the range.
+        until (date): last day of the range.
+        users (list): users to simulate (default: every enabled user).
+        sink (callable): if given, it is called with each Event, in order,
+            instead of sending an email.
+
+    Returns:
+        list: Events, sorted by day and user id.
+
+    """
+    if users is None:
+        users = [x for x in Users.list() if x.enabled]
+
+    lens_types = LensTypes.list()
+    fired = []
+    for user in users:
+        for lens_type in lens_types:
+            changes = list(
+                Lens.iter(until=until, user_id=user.id, type_id=lens_type.id)
+            )
+            fired += simulate_user(user, changes, since, until, lens_type)
+
+    # Dates are shared by many events, so each one is built only once
+    dates = {}
+    fired.sort(key=itemgetter(0, 1))
+    events = [
+        Event(
+            dates.get(day) or dates.setdefault(day, date.fromordinal(day)),
+            user,
+            dates.get(last) or dates.setdefault(last, date.fromordinal(last)),
+            rule,
+            lens_type,
+        )
+        for day, _, user, last, rule, lens_type in fired
+    ]
+    logger.debug("Simulated %d emails from %s to %s", len(events), since, until)
+
+    if sink is not None:
+        for event in events:
+            sink(event)
+    return events
+
+
+def simulate_user(
+    user: User,
+    changes: List[str],
+    since: date,
+    until: date,
+    lens_type: LensType = DEFAULT_LENS_TYPE,
+) -> List[tuple]:
+    """Returns the emails sent to a user about a type of lens from since to until.
+
+    Args:
+        user (User): user to simulate.
+        changes (list): time strings of the changes of lens of the user, in
+            ascending order.
+        since (date): first day of the range.
+        until (date): last day of the range.
+        lens_type (LensType): type of the lens changed.
+
+    Returns:
+        list: tuples (day, user id, user, last change, rule, lens type), with
+            the days as ordinals.
+
+    """
+    durability, rules = lens_settings(user, lens_type)
+    table = compile_rules(rules, durability)
+    exact = [(x, y) for x, y in table.exact.items() if not y.open_ended]
+    lo, hi = since.toordinal(), until.toordinal()
+    days = [to_ordinal(x) for x in changes]
+
+    fired = []
+    for index, last in enumerate(days):
+        # The interval ends the day before the next change
+        end = days[index + 1] - 1 if index + 1 < len(days) else hi
+        first, end = max(last, lo), min(end, hi)
+        if first > end:
+            continue
+
+        for offset, rule in exact:
+            if first <= last + offset <= end:
+                fired.append((last + offset, user.id, user, last, rule, lens_type))
+
+        if table.open_ended is not None:
+            # Sent once, the first day without another rule
+            offset, rule = table.open_ended
+            day = max(last + offset, first)
+            while table.exact.get(day - last, rule) is not rule:
+                day += 1
+            if day <= end:
+                fired.append((day, user.id, user, last, rule, lens_type))
+
+    return fired
+
+
+def summarize(events: List[Event]) -> Counter:
+    """Returns the number of emails sent per month (YYYY-MM)."""
+    return Counter(x.day.strftime("%Y-%m") for x in events)
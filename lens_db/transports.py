@@ -0,0 +1,305 @@
+import json
+import logging
+import threading
+from collections import namedtuple
+from datetime import datetime
+from pathlib import Path
+
+from .config import (
+    ADMIN_EMAIL,
+    EMAIL_SINK_PATH,
+    SMTP_CONNECT_TIMEOUT,
+    SMTP_HOST,
+    SMTP_PORT,
+    SMTP_READ_TIMEOUT,
+    SMTP_SECURITY,
+)
+from .credentials import get_credentials
+from .settings import get_settings
+
+logger = logging.getLogger(__name__)
+
+__all__ = [
+    "Transport",
+    "SMTPTransport",
+    "MaildirTransport",
+    "JSONLTransport",
+    "MemoryTransport",
+    "TRANSPORTS",
+    "open_transport",
+]
+
+SentEmail = namedtuple("SentEmail", ["from_addr", "destinations", "msg"])
+
+
+class Transport:
+    """Delivers emails. It can be shared to send several emails.
+
+    Subclasses implement sendmail() and, if they hold resources, close().
+    They import the modules they need (smtplib, mailbox...) on the first
+    email, so opening a transport that sends nothing is cheap. Use them as
+    context managers:
+
+        with open_transport() as transport:
+            send_email(destinations, subject, message, transport=transport)
+
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @classmethod
+    def from_settings(cls, settings):
+        """Returns a transport configured by settings."""
+        return cls()
+
+    @property
+    def sender(self) -> str:
+        """Email address the emails are sent from."""
+        return ADMIN_EMAIL
+
+    def sendmail(self, from_addr: str, destinations: list, msg: str):
+        """Sends an email.
+
+        Args:
+            from_addr (str): email address of the sender.
+            destinations (list): email addresses of the recipients.
+            msg (str): message, with its headers.
+
+        Raises:
+            OSError: if the email could not be sent (SMTPException included).
+
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """Releases the resources of the transport."""
+
+
+class SMTPTransport(Transport):
+    """Sends the emails to an SMTP server.
+
+    The connection is opened (with starttls and login) on the first email and
+    kept open until the transport is closed, so the handshake is paid only
+    once. If the server drops the connection, it is opened again
+    transparently.
+
+    Args:
+        host (str): host of the server.
+        port (int): port of the server.
+        security (str): 'starttls', 'ssl' (SMTP over TLS) or 'none'.
+        connect_timeout (float): seconds to wait for the connection.
+        read_timeout (float): seconds to wait for each reply of the server.
+
+    """
+
+    def __init__(
+        self,
+        host=SMTP_HOST,
+        port=SMTP_PORT,
+        security=SMTP_SECURITY,
+        connect_timeout=SMTP_CONNECT_TIMEOUT,
+        read_timeout=SMTP_READ_TIMEOUT,
+    ):
+        if security not in ("starttls", "ssl", "none"):
+            raise ValueError("Invalid SMTP security: %r" % security)
+
+        self.host = host
+        self.port = port
+        self.security = security
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.server = None
+        self.credentials = None
+
+    @classmethod
+    def from_settings(cls, settings):
+        return cls(settings.smtp_host, settings.smtp_port, settings.smtp_security)
+
+    @property
+    def sender(self) -> str:
+        if self.credentials is None:
+            self.credentials = get_credentials()
+        return self.credentials.username
+
+    def connect(self):
+        """Opens the connection and logs in, closing the previous one if any."""
+        from smtplib import SMTP, SMTP_SSL
+
+        self.close()
+        credentials = self.credentials or get_credentials()
+        smtp = SMTP_SSL if self.security == "ssl" else SMTP
+        server = smtp(self.host, self.port, timeout=self.connect_timeout)
+        try:
+            server.sock.settimeout(self.read_timeout)
+            if self.security == "starttls":
+                server.starttls()
+            server.login(credentials.username, credentials.password)
+        except BaseException:
+            server.close()
+            # They are read again on the next attempt, in case they changed
+            self.credentials = None
+            raise
+        self.credentials = credentials
+        self.server = server
+
+    def close(self):
+        """Closes the connection, if it is open."""
+        if self.server is None:
+            return
+
+        server, self.server = self.server, None
+        try:
+            server.quit()
+        except OSError as exc:
+            # The server may have already dropped the connection
+            logger.debug("Error closing SMTP session: %s", exc)
+
+    def sendmail(self, from_addr, destinations, msg):
+        """Sends an email, connecting first if needed.
+
+        If the server has dropped the connection, it is opened again and the
+        email is sent once more.
+
+        Raises:
+            SMTPException: if the email could not be sent.
+            OSError: if the connection failed or timed out.
+
+        """
+        from smtplib import SMTPServerDisconnected
+
+        if self.server is None:
+            self.connect()
+
+        try:
+            return self.server.sendmail(from_addr, destinations, msg)
+        except SMTPServerDisconnected:
+            logger.info("SMTP server disconnected, reconnecting")
+            self.server = None
+            self.connect()
+            return self.server.sendmail(from_addr, destinations, msg)
+
+
+class MaildirTransport(Transport):
+    """Stores the emails in a local maildir, created if needed.
+
+    Args:
+        path (str or Path): directory of the maildir.
+
+    """
+
+    def __init__(self, path=EMAIL_SINK_PATH):
+        self.path = Path(path)
+        self.maildir = None
+
+    @classmethod
+    def from_settings(cls, settings):
+        return cls(settings.email_sink_path)
+
+    def sendmail(self, from_addr, destinations, msg):
+        import mailbox
+
+        if self.maildir is None:
+            self.maildir = mailbox.Maildir(self.path.as_posix(), create=True)
+        self.maildir.add(msg)
+
+    def close(self):
+        if self.maildir is not None:
+            self.maildir.close()
+            self.maildir = None
+
+
+class JSONLTransport(Transport):
+    """Appends the emails to a local file, one JSON object per line.
+
+    Each object has the keys 'date', 'from', 'to', 'subject' and 'message'
+    (with the headers).
+
+    Args:
+        path (str or Path): path of the file.
+
+    """
+
+    def __init__(self, path=EMAIL_SINK_PATH):
+        self.path = Path(path)
+        self.file = None
+
+    @classmethod
+    def from_settings(cls, settings):
+        return cls(settings.email_sink_path)
+
+    def sendmail(self, from_addr, destinations, msg):
+        from email import message_from_string
+        from email.header import decode_header, make_header
+
+        if self.file is None:
+            self.file = self.path.open("a", encoding="utf-8")
+
+        subject = message_from_string(msg)["Subject"] or ""
+        email = {
+            "date": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "from": from_addr,
+            "to": destinations,
+            "subject": str(make_header(decode_header(subject))),
+            "message": msg,
+        }
+        self.file.write(json.dumps(email, ensure_ascii=False) + "\n")
+        self.file.flush()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class MemoryTransport(Transport):
+    """Keeps the emails in memory, in MemoryTransport.sent (shared by every
+    instance), so tests can check them."""
+
+    sent = []
+    _lock = threading.Lock()
+
+    def sendmail(self, from_addr, destinations, msg):
+        with self._lock:
+            self.sent.append(SentEmail(from_addr, list(destinations), msg))
+
+    @classmethod
+    def clear(cls):
+        """Forgets the emails sent."""
+        with cls._lock:
+            del cls.sent[:]
+
+
+TRANSPORTS = {
+    "smtp": SMTPTransport,
+    "maildir": MaildirTransport,
+    "jsonl": JSONLTransport,
+    "memory": MemoryTransport,
+}
+
+
+def open_transport(name: str = None, settings=None) -> Transport:
+    """Returns a new transport.
+
+    Args:
+        name (str): one of TRANSPORTS (default: the email_transport setting).
+        settings (Settings): settings of the transport (default: those of the
+            process).
+
+    Raises:
+        ValueError: if there is no transport with that name.
+
+    """
+    settings = settings or get_settings()
+    name = name or settings.email_transport
+    try:
+        transport = TRANSPORTS[name]
+    except KeyError:
+        raise ValueError(
+            "Unknown transport %r (use one of %s)"
+            % (name, ", ".join(sorted(TRANSPORTS)))
+        )
+    return transport.from_settings(settings)
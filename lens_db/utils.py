@@ -1,8 +1,10 @@
-from datetime import datetime
+import random
+from datetime import date, datetime
+from typing import Optional
 
 from colorama import Fore
 
-__all__ = ["today_date", "exception_exit"]
+__all__ = ["today_date", "to_ordinal", "from_ordinal", "backoff", "exception_exit"]
 
 
 def today_date():
@@ -10,6 +12,28 @@ def today_date():
     return datetime.today().date()
 
 
+def to_ordinal(time_str: str) -> int:
+    """Returns the day ordinal of a valid time string in format YYYY-MM-DD."""
+    return date(int(time_str[:4]), int(time_str[5:7]), int(time_str[8:10])).toordinal()
+
+
+def from_ordinal(day: Optional[int]) -> Optional[str]:
+    """Returns the time string of a day ordinal, or None if it is None."""
+    if day is None:
+        return None
+    return date.fromordinal(day).isoformat()
+
+
+def backoff(attempt: int, base: float, maximum: float) -> float:
+    """Returns the seconds to wait before retry number attempt (starting at 0).
+
+    The delay doubles on each attempt, up to maximum, and a random half of it
+    is subtracted (jitter), so clients that failed at once don't retry at once.
+    """
+    delay = min(maximum, base * 2 ** min(attempt, 32))
+    return delay * random.uniform(0.5, 1)
+
+
 def exception_exit(exception):
     """Exists the progam showing an exception.
 
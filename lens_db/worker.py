@@ -0,0 +1,199 @@
+import logging
+import signal
+import threading
+from collections import OrderedDict, namedtuple
+
+from .config import (
+    OUTBOX_BATCH_SIZE,
+    OUTBOX_POLL_INTERVAL,
+    OUTBOX_RETRY_DELAY,
+    OUTBOX_RETRY_MAX_DELAY,
+)
+from .core import Outbox
+from .email import breaker, limiter, send_email
+from .transports import open_transport
+from .utils import backoff
+
+logger = logging.getLogger(__name__)
+
+__all__ = ["Worker", "deliver", "run_worker"]
+
+DeliverResult = namedtuple("DeliverResult", ["sent", "failed"])
+
+
+def digest(emails: list) -> tuple:
+    """Returns the subject and the message of one email that replaces several
+    emails of the same recipient.
+
+    Args:
+        emails (list): OutboxEmails to send together, in order.
+
+    Returns:
+        tuple: subject and message of the digest.
+
+    """
+    if len(emails) == 1:
+        return emails[0].subject, emails[0].message
+
+    subject = "%s (y %d más)" % (emails[0].subject, len(emails) - 1)
+    message = "\n\n".join("%s: %s" % (x.subject, x.message) for x in emails)
+    return subject, message
+
+
+def deliver(
+    limit=OUTBOX_BATCH_SIZE, retry_delay=OUTBOX_RETRY_DELAY, settings=None
+) -> DeliverResult:
+    """Sends the emails of the outbox that are ready, through one transport.
+
+    The emails of the same recipient are sent together, as a digest (see
+    config DIGEST_WINDOW to make them wait for each other). Each email is removed from the outbox once it has been sent. Emails that
+    can't be sent are kept and tried again later, doubling the delay after
+    each failure. While the circuit breaker of the mail server is open, no
+    email is taken from the outbox. The emails are sent at the pace of the
+    rate limiter, so a batch is never larger than what it allows before the
+    lease of the emails expires.
+
+    Args:
+        limit (int): maximum number of emails sent.
+        retry_delay (float): seconds to wait before the first retry of an email.
+        settings (Settings): settings of the outbox and the transport
+            (default: those of the process).
+
+    Returns:
+        DeliverResult: number of emails of the outbox sent and failed.
+
+    """
+    if not breaker.allow():
+        logger.debug("SMTP circuit breaker is open, delivery paused")
+        return DeliverResult(0, 0)
+
+    if limiter.rate is not None:
+        # Don't take more emails than can be sent before their lease expires
+        limit = min(limit, max(1, int(limiter.rate * retry_delay)))
+
+    emails = Outbox.take(limit=limit, lease=retry_delay, settings=settings)
+    if not emails:
+        return DeliverResult(0, 0)
+
+    recipients = OrderedDict()
+    for email in emails:
+        recipients.setdefault(email.destination, []).append(email)
+
+    sent = failed = messages = 0
+    with open_transport(settings=settings) as transport:
+        for destination, group in recipients.items():
+            if not breaker.allow():
+                # The rest are taken again once their lease expires
+                logger.warning("SMTP circuit breaker is open, delivery paused")
+                break
+
+            subject, message = digest(group)
+            if send_email(
+                destination,
+                subject,
+                message,
+                name="Lens-db",
+                retries=1,
+                transport=transport,
+            ):
+                for email in group:
+                    Outbox.delivered(email.id, settings=settings)
+                sent += len(group)
+                messages += 1
+                continue
+
+            for email in group:
+                delay = backoff(email.attempts, retry_delay, OUTBOX_RETRY_MAX_DELAY)
+                logger.warning(
+                    "Could not send email %d to %r (attempt %d), retrying in %ds",
+                    email.id,
+                    destination,
+                    email.attempts + 1,
+                    delay,
+                )
+                Outbox.retry(email.id, delay, "SMTP error", settings=settings)
+            failed += len(group)
+
+    logger.info("Delivered %d emails in %d messages, %d failed", sent, messages, failed)
+    return DeliverResult(sent, failed)
+
+
+class Worker:
+    """Delivers the emails of the outbox in a background thread.
+
+    The outbox is checked every poll_interval seconds, or as soon as wake()
+    is called (e.g. after a scan of the same process).
+
+    Args:
+        poll_interval (float): seconds between checks of the outbox.
+        settings (Settings): settings of the outbox and the transport
+            (default: those of the process).
+
+    """
+
+    def __init__(self, poll_interval=OUTBOX_POLL_INTERVAL, settings=None):
+        self.poll_interval = poll_interval
+        self.settings = settings
+        self.thread = None
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+
+    def run(self):
+        """Delivers emails until stop() is called."""
+        logger.info("Worker started")
+
+        while not self._stop.is_set():
+            self._wake.clear()
+            try:
+                result = deliver(settings=self.settings)
+            except Exception:
+                # The worker must keep running, the emails stay in the outbox
+                logger.exception("Error delivering emails")
+            else:
+                if result.sent and not result.failed:
+                    # There may be more emails than the size of a batch
+                    continue
+            self._wake.wait(self.poll_interval)
+
+        logger.info("Worker stopped")
+
+    def start(self):
+        """Runs the worker in a daemon thread."""
+        self.thread = threading.Thread(target=self.run, name="worker", daemon=True)
+        self.thread.start()
+
+    def wake(self):
+        """Makes the worker check the outbox now."""
+        self._wake.set()
+
+    def stop(self, timeout=None):
+        """Stops the worker, waiting for its thread if it was started."""
+        self._stop.set()
+        self._wake.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+
+def run_worker(poll_interval=OUTBOX_POLL_INTERVAL, once=False, settings=None):
+    """Delivers the emails of the outbox until SIGINT or SIGTERM is received.
+
+    Args:
+        poll_interval (float): seconds between checks of the outbox.
+        once (bool): if True, deliver the emails that are ready and return.
+        settings (Settings): settings of the outbox and the transport
+            (default: those of the process).
+
+    """
+    if once:
+        while True:
+            result = deliver(settings=settings)
+            if not result.sent or result.failed:
+                return
+
+    worker = Worker(poll_interval, settings)
+    signal.signal(signal.SIGTERM, lambda signum, frame: worker.stop())
+
+    try:
+        worker.run()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,24 @@
+import pytest
+
+from lens_db.core import pool
+from lens_db.email import limiter
+from lens_db.settings import Settings, set_settings
+
+
+@pytest.fixture
+def database(tmp_path):
+    """Points the program to an empty database, returning its path."""
+    path = tmp_path / "lens.db"
+    pool.clear()
+    set_settings(Settings(database_path=path, disabled_path=tmp_path / ".disabled"))
+
+    yield path.as_posix()
+
+    set_settings(None)
+    pool.clear()
+
+
+@pytest.fixture(autouse=True)
+def full_limiter():
+    """Every test starts with the rate limit of emails unused."""
+    limiter.reset()
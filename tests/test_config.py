@@ -39,7 +39,7 @@ def test_database_path():
     assert DATABASE_PATH.name == "lens.db"
 
 
-def test_disabled():
-    from lens_db.config import DISABLED
+def test_disabled_check_interval():
+    from lens_db.config import DISABLED_CHECK_INTERVAL
 
-    assert isinstance(DISABLED, bool)
+    assert isinstance(DISABLED_CHECK_INTERVAL, (int, float))
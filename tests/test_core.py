@@ -1,11 +1,41 @@
+import sqlite3
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
 from datetime import date
-from sqlite3 import IntegrityError
+from sqlite3 import IntegrityError, ProgrammingError
 from unittest import mock
 
 import pytest
 
-from lens_db.core import DBConnection, Lens
-from lens_db.exceptions import AlreadyAddedError, InvalidDateError
+import lens_db.core
+from lens_db.config import ADMIN_EMAIL, LENS_DURABILITY
+from lens_db.core import (
+    ConnectionPool,
+    DBConnection,
+    DEFAULT_LENS_TYPE,
+    Due,
+    Lens,
+    LensType,
+    LensTypes,
+    Notifications,
+    Outbox,
+    User,
+    Users,
+    pool,
+)
+from lens_db.exceptions import (
+    AlreadyAddedError,
+    InvalidDateError,
+    LensTypeAlreadyExistsError,
+    LensTypeNotFoundError,
+    UnknownRulesError,
+    SchemaVersionError,
+    UserAlreadyExistsError,
+    UserNotFoundError,
+)
+from lens_db.settings import Settings
+from lens_db.utils import to_ordinal
 
 
 class TestLens:
@@ -28,7 +58,7 @@ class TestLens:
     def test_add(self, add_custom, today_date, days, day_str):
         Lens.add(days)
         today_date.assert_called_once_with()
-        add_custom.assert_called_once_with(day_str)
+        add_custom.assert_called_once_with(day_str, user_id=1, type_id=1, settings=None)
 
     add_custom_data = (
         ("2019-12-27", True),
@@ -54,7 +84,7 @@ class TestLens:
         db_mock.assert_called()
         db_mock.return_value.__enter__.assert_called()
         db_mock.return_value.__enter__.return_value.add.assert_called_once_with(
-            date_str
+            date_str, user_id=1, type_id=1
         )
         db_mock.return_value.__exit__.assert_called()
 
@@ -68,7 +98,7 @@ class TestLens:
         db_mock.assert_called()
         db_mock.return_value.__enter__.assert_called()
         db_mock.return_value.__enter__.return_value.add.assert_called_once_with(
-            "2020-02-03"
+            "2020-02-03", user_id=1, type_id=1
         )
         db_mock.return_value.__exit__.assert_called()
 
@@ -94,7 +124,24 @@ class TestLens:
 
         db_mock.assert_called()
         db_mock.return_value.__enter__.assert_called()
-        db_mock.return_value.__enter__.return_value.get_last.assert_called_once_with()
+        db_mock.return_value.__enter__.return_value.get_last.assert_called_once_with(
+            user_id=1, type_id=None
+        )
+        db_mock.return_value.__exit__.assert_called()
+
+    @pytest.mark.parametrize("date_returned, expected", get_last_data)
+    @mock.patch("lens_db.core.DBConnection")
+    def test_get_first(self, db_mock, date_returned, expected):
+        db_mock.return_value.__enter__.return_value.get_first.return_value = (
+            date_returned
+        )
+
+        first = Lens.get_first()
+        assert expected == first
+
+        db_mock.return_value.__enter__.return_value.get_first.assert_called_once_with(
+            user_id=1, type_id=None
+        )
         db_mock.return_value.__exit__.assert_called()
 
     @mock.patch("lens_db.core.DBConnection")
@@ -114,19 +161,548 @@ class TestLens:
         assert days_list == days
 
         db_mock.return_value.__enter__.assert_called()
-        db_mock.return_value.__enter__.return_value.list.assert_called_once_with()
+        db_mock.return_value.__enter__.return_value.list.assert_called_once_with(
+            user_id=1, type_id=None
+        )
         db_mock.return_value.__exit__.assert_called()
 
 
+class TestLensAddMany:
+    def test_add_many(self, database):
+        Lens.add_custom("2019-12-15")
+        dates = ["2019-12-11", date(2019, 12, 15), "2019-12-21", "2019-12-11"]
+
+        result = Lens.add_many(dates, batch_size=2)
+
+        assert result.added == 2
+        assert result.duplicates == ["2019-12-15", "2019-12-11"]
+        assert Lens.list() == ["2019-12-11", "2019-12-15", "2019-12-21"]
+
+    def test_generator(self, database):
+        dates = ("2019-12-%02d" % x for x in range(1, 32))
+
+        result = Lens.add_many(dates, batch_size=10)
+
+        assert result == (31, [])
+        assert len(Lens.list()) == 31
+
+    def test_invalid(self, database):
+        dates = ["2019-12-11", "15-12-2019", "2019-12-21", None]
+
+        with pytest.raises(InvalidDateError, match="'15-12-2019', None are not valid"):
+            Lens.add_many(dates, batch_size=1)
+
+        assert Lens.list() == []
+
+    def test_single_transaction(self, database):
+        with mock.patch("lens_db.core.DBConnection.commit") as commit_mock:
+            Lens.add_many(["2019-12-11", "2019-12-15", "2019-12-21"], batch_size=1)
+
+        commit_mock.assert_called_once_with()
+
+
+class TestLensIter:
+    days = ["2019-12-11", "2019-12-15", "2019-12-21", "2019-12-22", "2019-12-25"]
+
+    @pytest.fixture(autouse=True)
+    def history(self, database):
+        for day in self.days:
+            Lens.add_custom(day)
+
+    def test_all(self):
+        assert list(Lens.iter()) == self.days
+
+    def test_is_lazy(self):
+        entries = Lens.iter(batch_size=1)
+        assert next(entries) == "2019-12-11"
+        entries.close()
+
+    @pytest.mark.parametrize("batch_size", [1, 2, 100])
+    def test_batch_size(self, batch_size):
+        assert list(Lens.iter(batch_size=batch_size)) == self.days
+
+    def test_reverse(self):
+        assert list(Lens.iter(reverse=True)) == self.days[::-1]
+
+    def test_since_until(self):
+        entries = Lens.iter(since=date(2019, 12, 15), until="2019-12-22")
+        assert list(entries) == self.days[1:4]
+
+    def test_limit_offset(self):
+        assert list(Lens.iter(limit=2, offset=1)) == self.days[1:3]
+        assert list(Lens.iter(reverse=True, limit=1)) == self.days[-1:]
+
+    def test_invalid_date(self):
+        with pytest.raises(InvalidDateError):
+            list(Lens.iter(since="15-12-2019"))
+
+
+class TestLensQueries:
+    days = ["2019-12-11", "2019-12-15", "2019-12-21", "2019-12-22", "2019-12-25"]
+
+    @pytest.fixture(autouse=True)
+    def history(self, database):
+        Lens.add_many(self.days)
+
+    between_data = (
+        ("2019-12-15", "2019-12-22", [date(2019, 12, x) for x in (15, 21, 22)]),
+        (date(2019, 12, 12), date(2019, 12, 14), []),
+        ("2019-12-25", "2019-12-25", [date(2019, 12, 25)]),
+        ("2019-12-22", "2019-12-15", []),
+    )
+
+    @pytest.mark.parametrize("start, end, expected", between_data)
+    def test_between(self, start, end, expected):
+        assert Lens.between(start, end) == expected
+
+    @pytest.mark.parametrize(
+        "day, expected",
+        [("2019-12-11", True), (date(2019, 12, 21), True), ("2019-12-12", False)],
+    )
+    def test_contains(self, day, expected):
+        assert Lens.contains(day) is expected
+
+    count_data = (
+        (None, None, 5),
+        ("2019-12-21", None, 3),
+        (None, date(2019, 12, 21), 3),
+        ("2019-12-16", "2019-12-24", 2),
+        ("2020-01-01", None, 0),
+    )
+
+    @pytest.mark.parametrize("since, until, expected", count_data)
+    def test_count(self, since, until, expected):
+        assert Lens.count(since=since, until=until) == expected
+
+    @pytest.mark.parametrize(
+        "day, expected",
+        [
+            ("2019-12-21", date(2019, 12, 15)),
+            (date(2019, 12, 24), date(2019, 12, 22)),
+            ("2019-12-11", None),
+        ],
+    )
+    def test_before(self, day, expected):
+        assert Lens.before(day) == expected
+
+    @pytest.mark.parametrize(
+        "day, expected",
+        [
+            ("2019-12-21", date(2019, 12, 22)),
+            (date(2019, 12, 1), date(2019, 12, 11)),
+            ("2019-12-25", None),
+        ],
+    )
+    def test_after(self, day, expected):
+        assert Lens.after(day) == expected
+
+    @pytest.mark.parametrize("method", ["contains", "before", "after"])
+    def test_invalid_date(self, method):
+        with pytest.raises(InvalidDateError):
+            getattr(Lens, method)("15-12-2019")
+
+
+class TestUsers:
+    def test_instance(self):
+        with pytest.raises(
+            NotImplementedError, match="Users shouldn't be instanciated"
+        ):
+            Users()
+
+    def test_default_user(self, database):
+        assert Users.list() == [User(1, ADMIN_EMAIL, LENS_DURABILITY, True)]
+
+    def test_add_get(self, database):
+        user = Users.add("a@example.com", durability=30)
+
+        assert user == User(2, "a@example.com", 30, True)
+        assert Users.get("a@example.com") == user
+
+    def test_add_duplicate(self, database):
+        Users.add("a@example.com")
+        with pytest.raises(UserAlreadyExistsError):
+            Users.add("a@example.com")
+
+    def test_get_missing(self, database):
+        with pytest.raises(UserNotFoundError):
+            Users.get("a@example.com")
+
+    def test_update(self, database):
+        Users.add("a@example.com")
+        Users.update("a@example.com", durability=30, enabled=False)
+
+        assert Users.get("a@example.com") == User(2, "a@example.com", 30, False)
+
+    def test_rules(self, database):
+        user = Users.add("a@example.com", rules="quiet")
+        assert user.rules == "quiet"
+        assert Users.get("a@example.com") == user
+
+        Users.update("a@example.com", rules="default")
+        assert Users.get("a@example.com").rules == "default"
+
+    def test_unknown_rules(self, database):
+        with pytest.raises(UnknownRulesError):
+            Users.add("a@example.com", rules="invalid")
+
+        Users.add("a@example.com")
+        with pytest.raises(UnknownRulesError):
+            Users.update("a@example.com", rules="invalid")
+
+    def test_update_missing(self, database):
+        with pytest.raises(UserNotFoundError):
+            Users.update("a@example.com", enabled=False)
+
+
+class TestLensUsers:
+    def test_separate_histories(self, database):
+        user = Users.add("a@example.com")
+        Lens.add_custom("2019-12-11")
+        Lens.add_custom("2019-12-11", user_id=user.id)
+        Lens.add_many(["2019-12-15", "2019-12-27"], user_id=user.id)
+
+        assert Lens.list() == ["2019-12-11"]
+        assert Lens.list(user_id=user.id) == ["2019-12-11", "2019-12-15", "2019-12-27"]
+        assert Lens.get_last() == date(2019, 12, 11)
+        assert Lens.get_last(user_id=user.id) == date(2019, 12, 27)
+        assert Lens.count(user_id=user.id) == 3
+
+    def test_missing_user(self, database):
+        with pytest.raises(UserNotFoundError):
+            Lens.add_custom("2019-12-11", user_id=5)
+        with pytest.raises(UserNotFoundError):
+            Lens.add_many(["2019-12-11"], user_id=5)
+
+    def test_get_due(self, database):
+        Users.update(ADMIN_EMAIL, durability=15)
+        Lens.add_many(["2019-12-01", "2019-12-10"])
+        soon = Users.add("soon@example.com", durability=30)
+        Lens.add_custom("2019-11-26", user_id=soon.id)
+        Users.add("empty@example.com")
+        later = Users.add("later@example.com", durability=30)
+        Lens.add_custom("2019-12-20", user_id=later.id)
+        disabled = Users.add("disabled@example.com", durability=1)
+        Lens.add_custom("2019-12-01", user_id=disabled.id)
+        Users.update("disabled@example.com", enabled=False)
+
+        due = Lens.get_due(date(2019, 12, 25), margin=1)
+
+        assert due == [
+            Due(Users.get(ADMIN_EMAIL), date(2019, 12, 10), date(2019, 12, 26)),
+            Due(soon, date(2019, 11, 26), date(2019, 12, 27)),
+        ]
+        assert Lens.get_due(date(2019, 12, 25)) == due[:1]
+
+    def test_get_due_date(self, database):
+        assert Lens.get_due_date() is None
+
+        Users.update(ADMIN_EMAIL, durability=15)
+        Lens.add_custom("2019-12-10")
+        assert Lens.get_due_date() == date(2019, 12, 26)
+
+        Lens.add_many(["2019-12-01", "2019-12-20"])
+        assert Lens.get_due_date() == date(2020, 1, 5)
+
+        # Adding an older date does not move the schedule back
+        Lens.add_custom("2019-12-15")
+        assert Lens.get_due_date() == date(2020, 1, 5)
+
+        Users.update(ADMIN_EMAIL, durability=30)
+        assert Lens.get_due_date() == date(2020, 1, 20)
+
+
+class TestLensTypes:
+    def test_instance(self):
+        with pytest.raises(NotImplementedError):
+            LensTypes()
+
+    def test_default_type(self, database):
+        assert LensTypes.list() == [DEFAULT_LENS_TYPE]
+
+    def test_add_get(self, database):
+        lens_type = LensTypes.add("left", durability=30, rules="quiet")
+
+        assert lens_type == LensType(2, "left", 30, "quiet")
+        assert LensTypes.get("left") == lens_type
+        assert LensTypes.list() == [DEFAULT_LENS_TYPE, lens_type]
+
+    def test_add_duplicate(self, database):
+        LensTypes.add("left")
+        with pytest.raises(LensTypeAlreadyExistsError):
+            LensTypes.add("left")
+
+    def test_unknown_rules(self, database):
+        with pytest.raises(UnknownRulesError):
+            LensTypes.add("left", rules="invalid")
+
+    def test_get_missing(self, database):
+        with pytest.raises(LensTypeNotFoundError):
+            LensTypes.get("left")
+
+
+class TestLensTypesHistory:
+    def test_separate_histories(self, database):
+        left = LensTypes.add("left", durability=30)
+        Lens.add_custom("2019-12-11")
+        Lens.add_many(["2019-12-01", "2019-12-11"], type_id=left.id)
+
+        assert Lens.list() == ["2019-12-01", "2019-12-11", "2019-12-11"]
+        assert Lens.list(type_id=DEFAULT_LENS_TYPE.id) == ["2019-12-11"]
+        assert Lens.list(type_id=left.id) == ["2019-12-01", "2019-12-11"]
+        assert Lens.get_first(type_id=left.id) == date(2019, 12, 1)
+        assert Lens.count(type_id=DEFAULT_LENS_TYPE.id) == 1
+
+    def test_get_due(self, database):
+        Users.update(ADMIN_EMAIL, durability=15)
+        left = LensTypes.add("left", durability=30, rules="quiet")
+        Lens.add_custom("2019-12-10")
+        Lens.add_custom("2019-11-26", type_id=left.id)
+
+        assert Lens.get_due(date(2019, 12, 25), margin=1) == [
+            Due(Users.get(ADMIN_EMAIL), date(2019, 12, 10), date(2019, 12, 26)),
+            Due(Users.get(ADMIN_EMAIL), date(2019, 11, 26), date(2019, 12, 27), left),
+        ]
+        assert Lens.get_due_date(type_id=left.id) == date(2019, 12, 27)
+
+    def test_update_durability(self, database):
+        Users.update(ADMIN_EMAIL, durability=15)
+        left = LensTypes.add("left", durability=30)
+        Lens.add_custom("2019-12-10")
+        Lens.add_custom("2019-12-10", type_id=left.id)
+
+        # Only the types without their own durability follow the user
+        Users.update(ADMIN_EMAIL, durability=20)
+        assert Lens.get_due_date() == date(2019, 12, 31)
+        assert Lens.get_due_date(type_id=left.id) == date(2020, 1, 10)
+
+
+class TestNotifications:
+    def test_claim(self, database):
+        Lens.add_custom("2019-12-10")
+
+        assert Notifications.claim(1, date(2019, 12, 10), "tomorrow")
+        assert not Notifications.claim(1, date(2019, 12, 10), "tomorrow")
+        assert Notifications.claim(1, date(2019, 12, 10), "today")
+        assert Notifications.claim(1, date(2019, 12, 27), "tomorrow")
+
+        assert {x[:3] for x in Notifications.list()} == {
+            (1, date(2019, 12, 10), "tomorrow"),
+            (1, date(2019, 12, 10), "today"),
+            (1, date(2019, 12, 27), "tomorrow"),
+        }
+
+    def test_release(self, database):
+        Notifications.claim(1, date(2019, 12, 10), "today")
+        Notifications.release(1, date(2019, 12, 10), "today")
+
+        assert Notifications.list() == []
+        assert Notifications.claim(1, date(2019, 12, 10), "today")
+
+    def test_instance(self):
+        with pytest.raises(NotImplementedError):
+            Notifications()
+
+
+class TestOutbox:
+    def test_instance(self):
+        with pytest.raises(NotImplementedError):
+            Outbox()
+
+    def test_enqueue(self, database):
+        last = date(2019, 12, 10)
+        assert Outbox.enqueue(1, last, "today", "a@example.com", "subject", "body")
+        assert not Outbox.enqueue(1, last, "today", "a@example.com", "subject", "body")
+
+        emails = Outbox.take()
+        assert [x[1:] for x in emails] == [
+            (1, 1, last, "today", "a@example.com", "subject", "body", 0, None)
+        ]
+        assert [x.kind for x in Notifications.list()] == ["today"]
+
+    def test_take_lease(self, database):
+        Outbox.enqueue(1, date(2019, 12, 10), "today", "a@example.com", "s", "m")
+        Outbox.enqueue(1, date(2019, 12, 10), "expired", "a@example.com", "s", "m")
+
+        assert len(Outbox.take(limit=1, lease=60)) == 1
+        assert len(Outbox.take(lease=60)) == 1
+        assert Outbox.take() == []
+
+        # The lease expired without the emails being delivered
+        assert len(Outbox.take(now=time.time() + 61)) == 2
+
+    @mock.patch("lens_db.core.DIGEST_WINDOW", 60)
+    def test_enqueue_digest_window(self, database):
+        last = date(2019, 12, 10)
+        Outbox.enqueue(1, last, "today", "a@example.com", "s", "m")
+        Outbox.enqueue(1, last, "expired", "a@example.com", "s", "m")
+        Outbox.enqueue(1, date(2019, 12, 1), "today", "b@example.com", "s", "m")
+
+        # The emails wait for the window of the first one of their recipient
+        assert Outbox.take() == []
+        with DBConnection() as connection:
+            connection.cursor.execute(
+                "SELECT destination, next_attempt FROM outbox ORDER BY id"
+            )
+            (_, first), (_, second), (_, third) = connection.cursor.fetchall()
+        assert first == second < third
+
+        emails = Outbox.take(now=time.time() + 61)
+        assert [x.kind for x in emails] == ["today", "expired", "today"]
+
+    def test_retry_delivered(self, database):
+        Outbox.enqueue(1, date(2019, 12, 10), "today", "a@example.com", "s", "m")
+        email = Outbox.take()[0]
+
+        Outbox.retry(email.id, -1, "error")
+        email = Outbox.take()[0]
+        assert (email.attempts, email.last_error) == (1, "error")
+
+        Outbox.delivered(email.id)
+        assert Outbox.take(now=time.time() + 10**6) == []
+
+
+class TestConnectionPool:
+    def test_reuse(self, database):
+        pool = ConnectionPool()
+        connection = pool.acquire(database)
+        pool.release(database, connection)
+
+        assert pool.acquire(database) is connection
+
+    def test_concurrent_checkout(self, database):
+        pool = ConnectionPool()
+        first = pool.acquire(database)
+        second = pool.acquire(database)
+
+        assert first is not second
+
+    @mock.patch("lens_db.core.migrate")
+    def test_schema_checked_once(self, migrate_mock, database):
+        pool = ConnectionPool()
+        for _ in range(3):
+            pool.release(database, pool.acquire(database))
+
+        migrate_mock.assert_called_once()
+
+    @mock.patch("lens_db.core.migrate", side_effect=SchemaVersionError)
+    def test_schema_error(self, migrate_mock, database):
+        pool = ConnectionPool()
+        with pytest.raises(SchemaVersionError):
+            pool.acquire(database)
+        with pytest.raises(SchemaVersionError):
+            pool.acquire(database)
+
+        assert migrate_mock.call_count == 2
+
+    def test_max_idle(self, database):
+        pool = ConnectionPool(max_idle=1)
+        first = pool.acquire(database)
+        second = pool.acquire(database)
+        pool.release(database, first)
+        pool.release(database, second)
+
+        assert pool.acquire(database) is first
+        with pytest.raises(ProgrammingError, match="closed"):
+            second.execute("SELECT 1")
+
+    def test_release_rollbacks(self, database):
+        pool = ConnectionPool()
+        connection = pool.acquire(database)
+        connection.execute("INSERT INTO lens VALUES (1, 1, 737425)")
+        pool.release(database, connection)
+
+        connection = pool.acquire(database)
+        assert connection.execute("SELECT * FROM lens").fetchall() == []
+
+    def test_connect(self, database):
+        connection = ConnectionPool.connect(database)
+
+        assert connection.execute("PRAGMA journal_mode").fetchone() == ("wal",)
+        assert connection.execute("PRAGMA synchronous").fetchone() == (1,)
+
+    def test_readonly(self, database):
+        pool = ConnectionPool()
+        connection = pool.acquire(database, readonly=True)
+
+        assert connection.execute("SELECT * FROM lens").fetchall() == []
+        with pytest.raises(sqlite3.OperationalError, match="readonly"):
+            connection.execute("INSERT INTO lens VALUES (1, 1, 737425)")
+
+    def test_readonly_separate(self, database):
+        pool = ConnectionPool()
+        connection = pool.acquire(database, readonly=True)
+        pool.release(database, connection, readonly=True)
+
+        assert pool.acquire(database) is not connection
+        assert pool.acquire(database, readonly=True) is connection
+
+    def test_threads(self, database):
+        def worker(n):
+            for i in range(25):
+                Lens.add_custom("20%02d-01-%02d" % (n, i + 1))
+
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert len(Lens.list()) == 200
+
+
+def write_entries(path, year):
+    settings = Settings(database_path=path)
+    for day in range(1, 101):
+        Lens.add(delta_days=-day - 365 * year, settings=settings)
+    return year
+
+
+def read_entries(path):
+    settings = Settings(database_path=path)
+    for _ in range(200):
+        Lens.get_last(settings=settings)
+        list(Lens.iter(reverse=True, limit=10, settings=settings))
+    return len(Lens.list(settings=settings))
+
+
+def test_settings(database, tmp_path):
+    other = Settings(database_path=tmp_path / "other.db")
+    Lens.add_custom("2020-01-01")
+    Lens.add_custom("2020-02-01", settings=other)
+
+    assert Lens.list() == ["2020-01-01"]
+    assert Lens.list(settings=other) == ["2020-02-01"]
+
+
+def test_processes(database):
+    with ProcessPoolExecutor(max_workers=8) as executor:
+        writers = [executor.submit(write_entries, database, x) for x in range(4)]
+        readers = [executor.submit(read_entries, database) for _ in range(4)]
+
+        assert sorted(x.result() for x in writers) == [0, 1, 2, 3]
+        assert all(0 <= x.result() <= 400 for x in readers)
+
+    assert len(Lens.list()) == 400
+
+
+@pytest.fixture
+def clear_pool():
+    pool.clear()
+    with mock.patch("lens_db.core.migrate"):
+        yield
+    pool.clear()
+
+
+@pytest.mark.usefixtures("clear_pool")
 class TestDBConnection:
-    @mock.patch("lens_db.core.DBConnection.ensure_table")
     @mock.patch("sqlite3.connect")
-    def test_init(self, connect_mock, table_mock):
+    def test_init(self, connect_mock):
+        DBConnection()
         DBConnection()
 
         connect_mock.assert_called()
-        connect_mock.return_value.cursor.assert_called_once()
-        table_mock.assert_called_once()
+        connect_mock.return_value.cursor.assert_called()
+        lens_db.core.migrate.assert_called_once_with(connect_mock.return_value)
 
     @mock.patch("lens_db.core.DBConnection.commit")
     @mock.patch("lens_db.core.DBConnection.close")
@@ -161,6 +737,17 @@ class TestDBConnection:
         close_mock.assert_called()
         commit_mock.assert_called()
 
+    @mock.patch("lens_db.core.DBConnection.commit")
+    @mock.patch("lens_db.core.DBConnection.close")
+    @mock.patch("sqlite3.connect")
+    def test_exit_error(self, connect_mock, close_mock, commit_mock):
+        connection = DBConnection()
+        connection.__exit__(ValueError, ValueError(), None)
+
+        connect_mock.return_value.rollback.assert_called_once()
+        close_mock.assert_called()
+        commit_mock.assert_not_called()
+
     @mock.patch("sqlite3.connect")
     def test_commit(self, connect_mock):
         connection = DBConnection()
@@ -175,60 +762,22 @@ class TestDBConnection:
         connection = DBConnection()
         connection.close()
 
-        connect_mock.return_value.close.assert_called_once()
+        connect_mock.return_value.close.assert_not_called()
         cursor_mock.return_value.close.assert_called_once()
 
-    @mock.patch("sqlite3.connect")
-    def test_ensure_table(self, connect_mock):
-        connection = DBConnection()
-        connection.ensure_table()
-
-        cursor = connect_mock.return_value.cursor
-        call_arg = cursor.return_value.execute.call_args[0][0]
-
-        assert "CREATE TABLE IF NOT EXISTS 'lens'" in call_arg
-        assert "id" in call_arg
-        assert "timestamp" in call_arg
+        DBConnection()
+        connect_mock.assert_called_once()
 
     @mock.patch("sqlite3.connect")
     def test_add(self, connect_mock):
         connection = DBConnection()
-        connection.add("hello")
+        connection.add("2019-12-27")
 
         cursor = connect_mock.return_value.cursor
-        cursor.return_value.execute.assert_called_with(
-            "INSERT INTO lens VALUES (NULL, ?)", ["hello"]
+        cursor.return_value.execute.assert_any_call(
+            "INSERT INTO lens (user_id, type_id, day) VALUES (?, ?, ?)", [1, 1, 737420]
         )
 
-    @pytest.mark.parametrize("full", [True, False])
-    @mock.patch("lens_db.core.DBConnection.list")
-    @mock.patch("sqlite3.connect")
-    def test_get_last(self, connect_mock, list_mock, full):
-        days = [
-            "2019-12-11",
-            "2019-12-15",
-            "2019-12-21",
-            "2019-12-22",
-            "2019-12-25",
-            "2019-12-27",
-        ]
-
-        if full:
-            list_mock.return_value = sorted(days)
-        else:
-            list_mock.side_effect = IndexError
-
-        connection = DBConnection()
-        last = connection.get_last()
-
-        if full:
-            assert last == "2019-12-27"
-        else:
-            assert last is None
-
-        list_mock.assert_called_once()
-        connect_mock.assert_called()
-
     @mock.patch("sqlite3.connect")
     def test_list(self, connect_mock):
         days = [
@@ -242,9 +791,49 @@ class TestDBConnection:
         expected = [x[0] for x in days]
         cursor = connect_mock.return_value.cursor
 
-        cursor.return_value.fetchall.return_value = sorted(days)
+        cursor.return_value.fetchall.return_value = [(to_ordinal(x),) for x in expected]
 
         connection = DBConnection()
         days_list = connection.list()
 
         assert days_list == expected
+
+
+class TestDBConnectionQueries:
+    days = ["2019-12-15", "2019-12-27", "2019-12-11", "2019-12-21"]
+
+    @pytest.mark.parametrize("full", [True, False])
+    def test_get_first(self, database, full):
+        with DBConnection() as connection:
+            if full:
+                for day in self.days:
+                    connection.add(day)
+
+            first = connection.get_first()
+
+        assert first == ("2019-12-11" if full else None)
+
+    @pytest.mark.parametrize("full", [True, False])
+    def test_get_last(self, database, full):
+        with DBConnection() as connection:
+            if full:
+                for day in self.days:
+                    connection.add(day)
+
+            last = connection.get_last()
+
+        assert last == ("2019-12-27" if full else None)
+
+    def test_get_last_uses_index(self, database):
+        with DBConnection() as connection:
+            connection.cursor.execute("EXPLAIN QUERY PLAN SELECT MAX(day) FROM lens")
+            plan = connection.cursor.fetchall()
+
+        assert "SEARCH lens" in plan[0][-1]
+
+    def test_list_sorted(self, database):
+        with DBConnection() as connection:
+            for day in self.days:
+                connection.add(day)
+
+            assert connection.list() == sorted(self.days)
@@ -1,10 +1,19 @@
 import json
+import os
 from unittest import mock
 
 import pytest
 
 from lens_db.config import CREDENTIALS_PATH
-from lens_db.credentials import Credentials, get_credentials, save_credentials
+from lens_db.credentials import (
+    Credentials,
+    CredentialsProvider,
+    EnvSource,
+    FDSource,
+    FileSource,
+    get_credentials,
+    save_credentials,
+)
 from lens_db.exceptions import NoCredentialsError
 
 encryption_data_test = (
@@ -76,28 +85,99 @@ class TestCredentials:
         creds_path_mock.write_text.assert_called_with(string_data)
 
 
-@pytest.mark.parametrize("exist", [True, False])
-@mock.patch("lens_db.credentials.Credentials")
-@mock.patch("lens_db.credentials.CREDENTIALS_PATH")
-def test_get_credentials(creds_path_mock, creds_mock, exist):
-    creds_path_mock.exists.return_value = exist
+class TestEnvSource:
+    def test_get(self):
+        env = {"LENS_DB_USERNAME": "-user-", "LENS_DB_PASSWORD": "-pass-"}
+        with mock.patch.dict("os.environ", env):
+            assert EnvSource().get() == ("-user-", "-pass-")
+
+    def test_missing(self):
+        with mock.patch.dict("os.environ", {"LENS_DB_USERNAME": "-user-"}):
+            os.environ.pop("LENS_DB_PASSWORD", None)
+            assert EnvSource().get() is None
+
+
+class TestFileSource:
+    def test_missing(self, tmp_path):
+        assert FileSource(tmp_path / "credentials.json").get() is None
+
+    def test_cache(self, tmp_path):
+        path = tmp_path / "credentials.json"
+        path.write_text(json.dumps({"enc_user": "hfre", "enc_pass": "cnff"}))
+        source = FileSource(path)
+
+        with mock.patch.object(
+            Credentials, "load_from_file", wraps=Credentials.load_from_file
+        ) as load_mock:
+            assert source.get() == ("user", "pass")
+            assert source.get() == ("user", "pass")
+            load_mock.assert_called_once_with(path)
+
+    def test_invalidate(self, tmp_path):
+        path = tmp_path / "credentials.json"
+        path.write_text(json.dumps({"enc_user": "hfre", "enc_pass": "cnff"}))
+        source = FileSource(path)
+        assert source.get() == ("user", "pass")
+
+        path.write_text(json.dumps({"enc_user": "bgure", "enc_pass": "cnff"}))
+        os.utime(path, ns=(0, 0))
+        assert source.get() == ("other", "pass")
+
+        path.unlink()
+        assert source.get() is None
 
-    if not exist:
+
+class TestFDSource:
+    def test_get(self):
+        read, write = os.pipe()
+        os.write(write, json.dumps({"username": "u", "password": "p"}).encode())
+        os.close(write)
+
+        source = FDSource()
+        with mock.patch.dict("os.environ", {"LENS_DB_CREDENTIALS_FD": str(read)}):
+            assert source.get() == ("u", "p")
+            # The descriptor is closed, the credentials are kept
+            assert source.get() == ("u", "p")
+
+    def test_missing(self):
+        with mock.patch.dict("os.environ"):
+            os.environ.pop("LENS_DB_CREDENTIALS_FD", None)
+            assert FDSource().get() is None
+
+
+class TestCredentialsProvider:
+    def test_order(self):
+        provider = CredentialsProvider(("env", "file"))
+        provider.sources = [mock.Mock(), mock.Mock()]
+        provider.sources[0].get.return_value = None
+
+        assert provider.get() == provider.sources[1].get.return_value
+        provider.sources[0].get.assert_called_once_with()
+
+    def test_no_credentials(self):
+        provider = CredentialsProvider(())
         with pytest.raises(NoCredentialsError):
-            get_credentials()
-        return
+            provider.get()
+
+    def test_clear(self):
+        provider = CredentialsProvider()
+        provider.sources = [mock.Mock()]
+        provider.clear()
+        provider.sources[0].clear.assert_called_once_with()
 
-    creds = get_credentials()
 
-    assert creds == creds_mock.load_from_file.return_value.decrypt.return_value
-    creds_mock.load_from_file.assert_called_once_with()
-    creds_mock.load_from_file.return_value.decrypt.assert_called_once_with()
+@mock.patch("lens_db.credentials.provider")
+def test_get_credentials(provider_mock):
+    assert get_credentials() == provider_mock.get.return_value
+    provider_mock.get.assert_called_once_with()
 
 
+@mock.patch("lens_db.credentials.provider")
 @mock.patch("lens_db.credentials.Credentials.from_unencrypted")
-def test_save_credentials(creds_fu_mock):
+def test_save_credentials(creds_fu_mock, provider_mock):
     creds = save_credentials("-user-", "-pass-")
 
     creds_fu_mock.assert_called_once_with("-user-", "-pass-")
     creds_fu_mock.return_value.save.assert_called_once_with()
     assert creds == creds_fu_mock.return_value.save.return_value
+    provider_mock.clear.assert_called_once_with()
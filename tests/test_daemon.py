@@ -0,0 +1,122 @@
+import asyncio
+from datetime import date, datetime
+from unittest import mock
+
+import pytest
+
+from lens_db.core import Lens, Users
+from lens_db.daemon import Daemon, next_notification
+from lens_db.settings import Settings
+
+
+@pytest.mark.parametrize(
+    "today, expected",
+    [
+        (date(2019, 12, 1), date(2019, 12, 24)),
+        (date(2019, 12, 24), date(2019, 12, 24)),
+        (date(2019, 12, 25), date(2019, 12, 25)),
+        (date(2019, 12, 26), date(2019, 12, 26)),
+        (date(2019, 12, 27), date(2019, 12, 27)),
+        (date(2019, 12, 28), None),
+    ],
+)
+def test_next_notification(today, expected):
+    assert next_notification(date(2019, 12, 26), today) == expected
+
+
+class TestDaemon:
+    @pytest.fixture
+    def daemon(self, database, tmp_path):
+        disabled_path = tmp_path / ".disabled"
+        settings = Settings(database_path=database, disabled_path=disabled_path)
+        scan_users = mock.patch("lens_db.daemon.scan_users").start()
+        today_date = mock.patch("lens_db.daemon.today_date").start()
+        today_date.return_value = date(2019, 12, 20)
+
+        Lens.add_custom("2019-12-10")
+        user = Users.add("a@example.com", durability=30)
+        Lens.add_custom("2019-12-01", user_id=user.id)
+        Users.add("empty@example.com")
+
+        daemon = Daemon(poll_interval=0.01, settings=settings)
+        yield daemon, scan_users, today_date, disabled_path
+
+        mock.patch.stopall()
+
+    def test_load(self, daemon):
+        daemon, scan_users, today_date, disabled_path = daemon
+        daemon.load(date(2019, 12, 20))
+
+        assert sorted(daemon.deadlines) == [
+            (date(2019, 12, 24), 1, 1),
+            (date(2019, 12, 30), 2, 1),
+        ]
+        assert daemon.deadlines[0] == (date(2019, 12, 24), 1, 1)
+
+    def test_tick_changes(self, daemon):
+        daemon, scan_users, today_date, disabled_path = daemon
+
+        daemon.tick()
+        scan_users.assert_called_once_with(date(2019, 12, 20), daemon.settings)
+
+        daemon.tick()
+        scan_users.assert_called_once()
+
+        Lens.add_custom("2019-12-11")
+        daemon.tick()
+        assert scan_users.call_count == 2
+        assert daemon.deadlines[0] == (date(2019, 12, 25), 1, 1)
+
+    def test_tick_deadline(self, daemon):
+        daemon, scan_users, today_date, disabled_path = daemon
+        daemon.tick()
+
+        today_date.return_value = date(2019, 12, 23)
+        daemon.tick()
+        scan_users.assert_called_once()
+
+        today_date.return_value = date(2019, 12, 24)
+        daemon.tick()
+        scan_users.assert_called_with(date(2019, 12, 24), daemon.settings)
+        assert daemon.deadlines[0] == (date(2019, 12, 25), 1, 1)
+
+    def test_tick_disabled(self, daemon):
+        daemon, scan_users, today_date, disabled_path = daemon
+        disabled_path.touch()
+
+        daemon.tick()
+        scan_users.assert_not_called()
+
+        disabled_path.unlink()
+        daemon.tick()
+        scan_users.assert_called_once()
+
+    def test_wakes_worker(self, daemon):
+        daemon, scan_users, today_date, disabled_path = daemon
+        daemon.worker = mock.Mock()
+
+        daemon.tick()
+        scan_users.assert_called_once()
+        daemon.worker.wake.assert_called_once_with()
+
+    def test_timeout(self, daemon):
+        daemon, scan_users, today_date, disabled_path = daemon
+        daemon.poll_interval = 60
+        assert daemon.timeout() == 60
+
+        daemon.load(date(2019, 12, 20))
+        assert daemon.timeout(datetime(2019, 12, 23, 23, 59, 30)) == 30
+        assert daemon.timeout(datetime(2019, 12, 23, 12)) == 60
+        assert daemon.timeout(datetime(2019, 12, 24, 0, 0, 1)) == 0
+
+    def test_run(self, daemon):
+        daemon, scan_users, today_date, disabled_path = daemon
+        loop = asyncio.new_event_loop()
+        loop.call_later(0.05, daemon.stop)
+
+        try:
+            loop.run_until_complete(asyncio.wait_for(daemon.run(), 1))
+        finally:
+            loop.close()
+
+        scan_users.assert_called_once()
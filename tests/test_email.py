@@ -1,14 +1,40 @@
+import socket
+import threading
 from collections import namedtuple
-from smtplib import SMTPConnectError
+from smtplib import (
+    SMTPAuthenticationError,
+    SMTPConnectError,
+    SMTPDataError,
+    SMTPException,
+    SMTPRecipientsRefused,
+    SMTPServerDisconnected,
+)
 from unittest import mock
 
 import pytest
 
-from lens_db.email import send_email
+from lens_db.config import SMTP_CONNECT_TIMEOUT, SMTP_READ_TIMEOUT
+from lens_db.email import (
+    CircuitBreaker,
+    SharedTokenBucket,
+    TokenBucket,
+    breaker,
+    is_transient,
+    send_email,
+)
+from lens_db.transports import MemoryTransport, Transport
 
 Interface = namedtuple("UnencryptedCredentials", ["username", "password"])
 
 
+@pytest.fixture(autouse=True)
+def sleep():
+    breaker.reset()
+    with mock.patch("lens_db.email.time.sleep") as sleep:
+        yield sleep
+    breaker.reset()
+
+
 @pytest.fixture(params=["example@example.com", None])
 def destinations(request):
     return request.param
@@ -24,36 +50,64 @@ def message(request):
     return request.param
 
 
-@mock.patch("lens_db.email.SMTP")
-@mock.patch("lens_db.email.get_credentials")
-def test_callings_1(get_creds_mock, smtp_mock, destinations, subject, message):
-    get_creds_mock.return_value = Interface("--user--", "--pass--")
+@pytest.fixture
+def transport():
+    MemoryTransport.clear()
+    yield MemoryTransport()
+    MemoryTransport.clear()
+
+
+@pytest.fixture
+def failing():
+    """Transport whose sendmail fails as set in its side_effect."""
+    transport = mock.Mock(spec=Transport)
+    transport.sender = "--user--"
+    return transport
+
+
+def test_callings_1(transport, destinations, subject, message):
     raises = not (destinations and subject and message)
     if raises:
         with pytest.raises(TypeError):
-            send_email(destinations, subject, message)
+            send_email(destinations, subject, message, transport=transport)
+        assert transport.sent == []
     else:
-        result = send_email(destinations, subject, message)
+        result = send_email(destinations, subject, message, transport=transport)
         assert result
+        assert transport.sent[0][:2] == (transport.sender, [destinations])
 
 
-@mock.patch("lens_db.email.SMTP")
-@mock.patch("lens_db.email.get_credentials")
-def test_callings_2(get_creds_mock, smtp_mock):
+def test_callings_2(transport):
     with pytest.raises(TypeError):
         send_email("destinations", "subject", "message", retries=2 + 2j)
 
 
-@mock.patch("lens_db.email.SMTP")
-@mock.patch("lens_db.email.get_credentials")
+@mock.patch("lens_db.email.open_transport")
+def test_config_transport(open_mock, transport):
+    open_mock.return_value = transport
+
+    assert send_email("a@example.com", "subject", "message", name="name")
+
+    open_mock.assert_called_once_with(settings=None)
+    ((from_addr, destinations, msg),) = transport.sent
+    assert destinations == ["a@example.com"]
+    assert "From: name <%s>" % from_addr in msg
+    assert "Subject: subject" in msg
+
+
+@mock.patch("smtplib.SMTP")
+@mock.patch("lens_db.transports.get_credentials")
 def test_normal(get_creds_mock, smtp_mock):
     get_creds_mock.return_value = Interface("--user--", "--pass--")
 
     result = send_email("destinations", "subject", "message", name="name")
     assert result
 
-    smtp_mock.assert_called_once_with("smtp.gmail.com", 587)
+    smtp_mock.assert_called_once_with(
+        "smtp.gmail.com", 587, timeout=SMTP_CONNECT_TIMEOUT
+    )
     server = smtp_mock.return_value
+    server.sock.settimeout.assert_called_once_with(SMTP_READ_TIMEOUT)
     server.starttls.assert_called_once_with()
     server.login.assert_called_once_with("--user--", "--pass--")
 
@@ -63,8 +117,8 @@ def test_normal(get_creds_mock, smtp_mock):
 
 
 @mock.patch("lens_db.email.logger")
-@mock.patch("lens_db.email.SMTP")
-@mock.patch("lens_db.email.get_credentials")
+@mock.patch("smtplib.SMTP")
+@mock.patch("lens_db.transports.get_credentials")
 def test_errors(get_creds_mock, smtp_mock, logger_mock):
     get_creds_mock.return_value = Interface("--user--", "--pass--")
     server = mock.MagicMock()
@@ -73,7 +127,7 @@ def test_errors(get_creds_mock, smtp_mock, logger_mock):
     result = send_email("destinations", "subject", "message", name="name")
     assert result
 
-    smtp_mock.assert_any_call("smtp.gmail.com", 587)
+    smtp_mock.assert_any_call("smtp.gmail.com", 587, timeout=SMTP_CONNECT_TIMEOUT)
     assert smtp_mock.call_count == 4
 
     server.starttls.assert_called_once_with()
@@ -88,8 +142,8 @@ def test_errors(get_creds_mock, smtp_mock, logger_mock):
 
 
 @mock.patch("lens_db.email.logger")
-@mock.patch("lens_db.email.SMTP")
-@mock.patch("lens_db.email.get_credentials")
+@mock.patch("smtplib.SMTP")
+@mock.patch("lens_db.transports.get_credentials")
 def test_critical_error(get_creds_mock, smtp_mock, logger_mock):
     get_creds_mock.return_value = Interface("--user--", "--pass--")
     smtp_mock.side_effect = SMTPConnectError(-1, "Custom call")
@@ -97,7 +151,7 @@ def test_critical_error(get_creds_mock, smtp_mock, logger_mock):
     result = send_email("destinations", "subject", "message", name="name")
     assert not result
 
-    smtp_mock.assert_any_call("smtp.gmail.com", 587)
+    smtp_mock.assert_any_call("smtp.gmail.com", 587, timeout=SMTP_CONNECT_TIMEOUT)
     assert smtp_mock.call_count == 5
     server = smtp_mock.return_value
 
@@ -111,3 +165,170 @@ def test_critical_error(get_creds_mock, smtp_mock, logger_mock):
     logger_mock.debug.assert_called_once()
     assert logger_mock.warning.call_count == 5
     logger_mock.critical.assert_called_once()
+
+
+@pytest.mark.parametrize(
+    "exc, transient",
+    [
+        (SMTPConnectError(-1, "refused"), True),
+        (SMTPServerDisconnected("dropped"), True),
+        (socket.timeout("timed out"), True),
+        (ConnectionRefusedError(), True),
+        (SMTPDataError(451, "try again later"), True),
+        (SMTPDataError(554, "rejected"), False),
+        (SMTPAuthenticationError(535, "bad credentials"), False),
+        (SMTPRecipientsRefused({"a": (450, b"busy"), "b": (421, b"busy")}), True),
+        (SMTPRecipientsRefused({"a": (450, b"busy"), "b": (550, b"unknown")}), False),
+        (SMTPException("no suitable authentication method"), False),
+    ],
+)
+def test_is_transient(exc, transient):
+    assert is_transient(exc) == transient
+
+
+def test_backoff(failing, sleep):
+    failing.sendmail.side_effect = socket.timeout("timed out")
+
+    assert not send_email(
+        "destinations", "subject", "message", retries=4, transport=failing
+    )
+
+    assert failing.sendmail.call_count == 4
+    assert failing.close.call_count == 4
+    delays = [x[0][0] for x in sleep.call_args_list]
+    assert len(delays) == 3
+    for attempt, delay in enumerate(delays):
+        assert 2**attempt / 2 <= delay <= 2**attempt
+
+
+def test_permanent_error(failing, sleep):
+    failing.sendmail.side_effect = SMTPRecipientsRefused({"a": (550, b"unknown")})
+
+    assert not send_email("destinations", "subject", "message", transport=failing)
+
+    failing.sendmail.assert_called_once()
+    sleep.assert_not_called()
+    assert breaker.failures == 0
+
+
+@mock.patch("smtplib.SMTP")
+@mock.patch("lens_db.transports.get_credentials")
+def test_login_error_closes(get_creds_mock, smtp_mock):
+    get_creds_mock.return_value = Interface("--user--", "--pass--")
+    server = smtp_mock.return_value
+    server.login.side_effect = SMTPAuthenticationError(535, "bad credentials")
+
+    assert not send_email("destinations", "subject", "message")
+
+    smtp_mock.assert_called_once()
+    server.close.assert_called_once_with()
+
+
+class TestCircuitBreaker:
+    @mock.patch("lens_db.email.time.monotonic")
+    def test_open_close(self, monotonic_mock):
+        monotonic_mock.return_value = 100
+        circuit = CircuitBreaker(threshold=2, cooldown=60)
+
+        circuit.failure()
+        assert circuit.allow()
+        circuit.failure()
+        assert not circuit.allow()
+
+        monotonic_mock.return_value = 159
+        assert not circuit.allow()
+
+        # After the cooldown, one failure opens the circuit again
+        monotonic_mock.return_value = 160
+        assert circuit.allow()
+        circuit.failure()
+        assert not circuit.allow()
+
+        monotonic_mock.return_value = 220
+        circuit.success()
+        assert circuit.allow()
+        assert circuit.failures == 0
+
+    def test_fail_fast(self, failing, sleep):
+        failing.sendmail.side_effect = SMTPConnectError(-1, "refused")
+
+        assert not send_email(
+            "destinations", "subject", "message", retries=10, transport=failing
+        )
+
+        # The circuit opened after 5 failures
+        assert failing.sendmail.call_count == 5
+        assert not breaker.allow()
+
+        failing.reset_mock()
+        assert not send_email("destinations", "subject", "message", transport=failing)
+        failing.sendmail.assert_not_called()
+
+
+class TestTokenBucket:
+    def test_take(self):
+        bucket = TokenBucket(rate=1, capacity=2)
+        bucket.updated = 0
+
+        assert bucket.take(0) == 0
+        assert bucket.take(0) == 0
+        assert bucket.take(0) == 1
+        assert bucket.take(0.5) == 0.5
+        assert bucket.take(1) == 0
+
+        # The bucket never holds more than its capacity
+        assert bucket.take(100) == 0
+        assert bucket.take(100) == 0
+        assert bucket.take(100) == 1
+
+    def test_unlimited(self):
+        bucket = TokenBucket(rate=None, capacity=0)
+        assert [bucket.take() for _ in range(100)] == [0] * 100
+
+    @mock.patch("lens_db.email.time.monotonic")
+    def test_acquire(self, monotonic_mock, sleep):
+        monotonic_mock.return_value = 0
+        sleep.side_effect = lambda x: setattr(
+            monotonic_mock, "return_value", monotonic_mock.return_value + x
+        )
+        bucket = TokenBucket(rate=4, capacity=1)
+
+        for _ in range(5):
+            bucket.acquire()
+
+        assert [x[0][0] for x in sleep.call_args_list] == [0.25] * 4
+        assert monotonic_mock.return_value == 1
+
+    def test_threads(self):
+        bucket = TokenBucket(rate=1e-9, capacity=5)
+        taken = []
+
+        def take():
+            taken.extend(x for x in range(10) if bucket.take() == 0)
+
+        threads = [threading.Thread(target=take) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert len(taken) == 5
+
+    def test_shared(self, database):
+        first = SharedTokenBucket("test", rate=1, capacity=2)
+        second = SharedTokenBucket("test", rate=1, capacity=2)
+
+        assert first.take(100) == 0
+        assert second.take(100) == 0
+        assert first.take(100) == 1
+        assert second.take(101) == 0
+
+        first.reset()
+        assert second.take() == 0
+
+    def test_send_email(self, transport):
+        with mock.patch("lens_db.email.limiter") as limiter:
+            send_email("a@example.com", "subject", "message", transport=transport)
+            send_email("b@example.com", "subject", "message", transport=transport)
+
+        assert limiter.acquire.call_count == 2
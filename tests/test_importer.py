@@ -0,0 +1,59 @@
+import io
+
+import pytest
+
+from lens_db.importer import guess_format, read_dates
+
+
+@pytest.mark.parametrize(
+    "filename, fmt",
+    [
+        ("dates.txt", "lines"),
+        ("dates", "lines"),
+        ("<stdin>", "lines"),
+        ("dates.csv", "csv"),
+        ("DATES.CSV", "csv"),
+        ("dates.jsonl", "jsonl"),
+        ("dates.ndjson", "jsonl"),
+    ],
+)
+def test_guess_format(filename, fmt):
+    assert guess_format(filename) == fmt
+
+
+def test_read_lines():
+    file = io.StringIO("2020-01-01\n\n 2020-01-16 \nwhatever\n")
+    dates = read_dates(file, "lines")
+    assert list(dates) == ["2020-01-01", "2020-01-16", "whatever"]
+
+
+csv_data = (
+    ("2020-01-01,a\n2020-01-16,b\n", ["2020-01-01", "2020-01-16"]),
+    ("date,note\n2020-01-01,a\n\n2020-01-16,b\n", ["2020-01-01", "2020-01-16"]),
+    ("note,Timestamp\na,2020-01-01\nb,2020-01-16\n", ["2020-01-01", "2020-01-16"]),
+)
+
+
+@pytest.mark.parametrize("data, expected", csv_data)
+def test_read_csv(data, expected):
+    assert list(read_dates(io.StringIO(data), "csv")) == expected
+
+
+def test_read_jsonl():
+    file = io.StringIO(
+        '"2020-01-01"\n{"date": "2020-01-16"}\n\n{"timestamp": "2020-01-31"}\n'
+        '{"other": 1}\nnot json\n'
+    )
+    dates = read_dates(file, "jsonl")
+    assert list(dates) == ["2020-01-01", "2020-01-16", "2020-01-31", None, "not json"]
+
+
+def test_guessed_format():
+    file = io.StringIO('{"date": "2020-01-01"}\n')
+    file.name = "dates.jsonl"
+    assert list(read_dates(file)) == ["2020-01-01"]
+
+
+def test_invalid_format():
+    with pytest.raises(ValueError, match="Invalid format: 'xml'"):
+        read_dates(io.StringIO(""), "xml")
@@ -0,0 +1,124 @@
+import json
+import logging
+import re
+import sys
+from unittest import mock
+
+import pytest
+
+from lens_db.exceptions import InvalidSettingsError
+from lens_db.logs import JSONFormatter, get_level, setup_logging, stop_logging
+from lens_db.settings import Settings
+
+logger = logging.getLogger("lens_db.test")
+
+
+@pytest.fixture
+def log_path(tmp_path):
+    yield tmp_path / "lens-db.log"
+
+    stop_logging()
+    logging.getLogger("lens_db").setLevel(logging.NOTSET)
+
+
+def test_text(log_path):
+    setup_logging(Settings(logging_path=log_path))
+    logger.debug("debug message")
+    logger.info("info message")
+    logger.warning("warning %d", 2)
+    stop_logging()
+
+    lines = log_path.read_text().splitlines()
+    assert len(lines) == 2
+    assert re.match(r"\[[\d\-: ,]+\] INFO - test_logs:\d+ - info message$", lines[0])
+    assert re.match(r"\[[\d\-: ,]+\] WARNING - test_logs:\d+ - warning 2$", lines[1])
+
+
+def test_json(log_path):
+    setup_logging(
+        Settings(logging_path=log_path, logging_level="debug", logging_format="json")
+    )
+    logger.debug("debug message")
+    try:
+        raise ValueError("invalid")
+    except ValueError:
+        logger.exception("error message")
+    stop_logging()
+
+    first, second = [json.loads(x) for x in log_path.read_text().splitlines()]
+    assert first["level"] == "DEBUG"
+    assert first["logger"] == "lens_db.test"
+    assert first["module"] == "test_logs"
+    assert first["thread"] == "MainThread"
+    assert first["message"] == "debug message"
+    assert second["level"] == "ERROR"
+    assert second["message"].startswith("error message\nTraceback")
+    assert second["message"].endswith("ValueError: invalid")
+
+
+def test_json_formatter():
+    try:
+        raise ValueError("invalid")
+    except ValueError:
+        record = logger.makeRecord(
+            "lens_db.test", logging.ERROR, __file__, 1, "a %s", ("b",), None
+        )
+        record.exc_info = sys.exc_info()
+
+    data = json.loads(JSONFormatter().format(record))
+    assert data["line"] == 1
+    assert data["message"].startswith("a b\nTraceback")
+
+
+@mock.patch("lens_db.logs.LOGGING_MAX_BYTES", 200)
+@mock.patch("lens_db.logs.LOGGING_BACKUP_COUNT", 2)
+def test_rotation(log_path):
+    setup_logging(Settings(logging_path=log_path))
+    for i in range(20):
+        logger.info("message %d", i)
+    stop_logging()
+
+    files = sorted(x.name for x in log_path.parent.iterdir())
+    assert files == ["lens-db.log", "lens-db.log.1", "lens-db.log.2"]
+    assert "message 19" in log_path.read_text()
+
+
+@mock.patch("lens_db.logs.LOGGING_ROTATE_WHEN", "midnight")
+def test_rotation_by_time(log_path):
+    listener = setup_logging(Settings(logging_path=log_path))
+    (handler,) = listener.handlers
+    assert isinstance(handler, logging.handlers.TimedRotatingFileHandler)
+
+
+def test_setup_again(log_path):
+    setup_logging(Settings(logging_path=log_path))
+    setup_logging(Settings(logging_path=log_path, logging_level="warning"))
+    logger.info("info message")
+    logger.warning("warning message")
+    stop_logging()
+
+    assert len(logging.getLogger("lens_db").handlers) == 0
+    assert log_path.read_text().count("warning message") == 1
+    assert "info message" not in log_path.read_text()
+
+
+def test_lazy_file(log_path):
+    setup_logging(Settings(logging_path=log_path))
+    stop_logging()
+    assert not log_path.exists()
+
+
+def test_invalid(log_path):
+    with pytest.raises(InvalidSettingsError, match="Invalid logging level"):
+        setup_logging(Settings(logging_path=log_path, logging_level="verbose"))
+
+    with pytest.raises(InvalidSettingsError, match="Invalid logging format"):
+        setup_logging(Settings(logging_path=log_path, logging_format="xml"))
+
+
+def test_get_level():
+    assert get_level("info") == logging.INFO
+    assert get_level("DEBUG") == logging.DEBUG
+
+    with pytest.raises(InvalidSettingsError):
+        get_level("verbose")
@@ -1,11 +1,35 @@
+import io
+import subprocess
+import sys
 from argparse import Namespace
+from datetime import date
 from unittest import mock
 
 import pytest
 
 import lens_db
-from lens_db.exceptions import BaseLensDBError
-from lens_db.main import _main, get_options, main
+from lens_db.exceptions import BaseLensDBError, InvalidDateError
+from lens_db.config import DAEMON_POLL_INTERVAL, LENS_DURABILITY, OUTBOX_POLL_INTERVAL
+from lens_db.core import LensType, User
+from lens_db.simulator import Event
+from lens_db.main import (
+    _main,
+    get_options,
+    main,
+    manage_types,
+    manage_users,
+    run_simulation,
+)
+
+# Seconds that importing lens_db.main may take, about twice the usual time
+IMPORT_BUDGET = 0.1
+
+
+@pytest.fixture(autouse=True)
+def setup_logging_m():
+    """The commands run by these tests don't write to the log file."""
+    with mock.patch("lens_db.logs.setup_logging") as setup_logging_m:
+        yield setup_logging_m
 
 
 def modified_get_options(string: str):
@@ -35,6 +59,48 @@ class TestGetOptions:
     def test_scan(self):
         opt = modified_get_options("scan")
         assert opt.command == "scan"
+        assert opt.deliver
+
+    def test_scan_no_deliver(self):
+        opt = modified_get_options("scan --no-deliver")
+        assert not opt.deliver
+
+    class TestWorker:
+        def test_default(self):
+            opt = modified_get_options("worker")
+            assert opt.command == "worker"
+            assert opt.interval == OUTBOX_POLL_INTERVAL
+            assert not opt.once
+
+        def test_once(self):
+            opt = modified_get_options("worker --interval 0.5 --once")
+            assert opt.interval == 0.5
+            assert opt.once
+
+    class TestDaemon:
+        def test_default_interval(self):
+            opt = modified_get_options("daemon")
+            assert opt.command == "daemon"
+            assert opt.interval == DAEMON_POLL_INTERVAL
+
+        def test_interval(self):
+            opt = modified_get_options("daemon --interval 0.5")
+            assert opt.interval == 0.5
+
+    class TestSimulate:
+        def test_range(self):
+            opt = modified_get_options("simulate --from 2026-01-01 --to 2027-01-01")
+            assert opt.command == "simulate"
+            assert opt.since == "2026-01-01"
+            assert opt.until == "2027-01-01"
+
+        def test_default_from(self):
+            opt = modified_get_options("simulate --to 2027-01-01")
+            assert opt.since is None
+
+        def test_without_to(self):
+            with pytest.raises(SystemExit):
+                modified_get_options("simulate --from 2026-01-01")
 
     def test_last(self):
         opt = modified_get_options("last")
@@ -50,9 +116,66 @@ class TestGetOptions:
             with pytest.raises(SystemExit):
                 modified_get_options("from-str")
 
-    def test_list(self):
-        opt = modified_get_options("list")
-        assert opt.command == "list"
+    class TestList:
+        def test_without_arguments(self):
+            opt = modified_get_options("list")
+            assert opt.command == "list"
+            assert opt.limit is None
+            assert opt.offset == 0
+            assert opt.since is None
+            assert opt.until is None
+            assert opt.reverse is False
+
+        def test_with_arguments(self):
+            opt = modified_get_options(
+                "list --limit 5 --offset 2 --since 2020-01-01 --until 2020-12-31 "
+                "--reverse"
+            )
+            assert opt.command == "list"
+            assert opt.limit == 5
+            assert opt.offset == 2
+            assert opt.since == "2020-01-01"
+            assert opt.until == "2020-12-31"
+            assert opt.reverse is True
+
+        def test_invalid_limit(self):
+            with pytest.raises(SystemExit):
+                modified_get_options("list --limit many")
+
+    class TestImport:
+        def test_stdin(self):
+            opt = modified_get_options("import")
+            assert opt.command == "import"
+            assert opt.file is sys.stdin
+            assert opt.format is None
+
+        def test_file(self, tmp_path):
+            path = tmp_path / "dates.csv"
+            path.write_text("2020-01-01\n")
+
+            opt = get_options(["import", path.as_posix(), "--format", "jsonl"])
+            with opt.file:
+                assert opt.file.name == path.as_posix()
+            assert opt.format == "jsonl"
+
+        def test_invalid_format(self):
+            with pytest.raises(SystemExit):
+                modified_get_options("import --format xml")
+
+    def test_version(self, capsys):
+        with mock.patch("lens_db._version.get_versions") as get_versions_m:
+            get_versions_m.return_value = {"version": "1.2.3"}
+            with pytest.raises(SystemExit):
+                get_options(["--version"])
+
+        assert capsys.readouterr().out == "lens-db 1.2.3\n"
+
+    def test_log_level(self):
+        assert modified_get_options("status").log_level is None
+        assert modified_get_options("--log-level debug status").log_level == "DEBUG"
+
+        with pytest.raises(SystemExit):
+            modified_get_options("--log-level verbose status")
 
     class TestCredentials:
         def test_ok_normal(self):
@@ -75,6 +198,50 @@ class TestGetOptions:
             with pytest.raises(SystemExit):
                 get_options(["credentials"])
 
+    class TestUsers:
+        def test_user_option(self):
+            opt = modified_get_options("--user a@b.c now")
+            assert opt.user == "a@b.c"
+            assert modified_get_options("now").user is None
+
+        def test_add(self):
+            opt = modified_get_options("users add a@b.c --durability 30")
+            assert opt.command == "users"
+            assert opt.users_command == "add"
+            assert opt.email == "a@b.c"
+            assert opt.durability == 30
+
+        def test_add_default_durability(self):
+            opt = modified_get_options("users add a@b.c")
+            assert opt.durability == LENS_DURABILITY
+            assert opt.rules == "default"
+
+        def test_add_rules(self):
+            opt = modified_get_options("users add a@b.c --rules quiet")
+            assert opt.rules == "quiet"
+
+            with pytest.raises(SystemExit):
+                modified_get_options("users add a@b.c --rules invalid")
+
+        def test_rules(self):
+            opt = modified_get_options("users rules a@b.c quiet")
+            assert opt.users_command == "rules"
+            assert opt.email == "a@b.c"
+            assert opt.rules == "quiet"
+
+        @pytest.mark.parametrize("action", ["enable", "disable"])
+        def test_enable_disable(self, action):
+            opt = modified_get_options("users %s a@b.c" % action)
+            assert opt.users_command == action
+            assert opt.email == "a@b.c"
+
+        def test_list(self):
+            assert modified_get_options("users list").users_command == "list"
+
+        def test_no_action(self):
+            with pytest.raises(SystemExit):
+                modified_get_options("users")
+
     def test_disable(self):
         opt = get_options(["disable"])
         assert opt.command == "disable"
@@ -91,24 +258,28 @@ class TestGetOptions:
 class TestHiddenMain:
     @pytest.fixture
     def mocks(self):
-        scan_m = mock.patch("lens_db.main.scan").start()
+        scan_m = mock.patch("lens_db.scanner.scan").start()
         options_m = mock.patch("lens_db.main.get_options").start()
-        lens_m = mock.patch("lens_db.main.Lens").start()
-        creds_m = mock.patch("lens_db.main.save_credentials").start()
-        dis_m = mock.patch("lens_db.main.disable").start()
-        en_m = mock.patch("lens_db.main.enable").start()
-        st_m = mock.patch("lens_db.main.show_status").start()
+        lens_m = mock.patch("lens_db.core.Lens").start()
+        creds_m = mock.patch("lens_db.credentials.save_credentials").start()
+        dis_m = mock.patch("lens_db.scanner.disable").start()
+        en_m = mock.patch("lens_db.scanner.enable").start()
+        st_m = mock.patch("lens_db.scanner.show_status").start()
+        mock.patch("lens_db.main.load_settings").start()
+        mock.patch("lens_db.main.set_settings").start()
 
         yield scan_m, options_m, lens_m, creds_m, dis_m, en_m, st_m
 
         mock.patch.stopall()
 
-    def test_scan(self, mocks):
+    @mock.patch("lens_db.worker.run_worker")
+    def test_scan(self, worker_m, mocks):
         scan_m, options_m, lens_m, creds_m, dis_m, en_m, st_m = mocks
-        options_m.return_value = Namespace(command="scan")
+        options_m.return_value = Namespace(command="scan", deliver=True)
         _main()
 
         scan_m.assert_called_once_with()
+        worker_m.assert_called_once_with(once=True)
         lens_m.add.assert_not_called()
         lens_m.add_custom.assert_not_called()
         lens_m.list.assert_not_called()
@@ -118,14 +289,43 @@ class TestHiddenMain:
         en_m.assert_not_called()
         st_m.assert_not_called()
 
+    @mock.patch("lens_db.worker.run_worker")
+    def test_scan_no_deliver(self, worker_m, mocks):
+        scan_m, options_m, lens_m, creds_m, dis_m, en_m, st_m = mocks
+        options_m.return_value = Namespace(command="scan", deliver=False)
+        _main()
+
+        scan_m.assert_called_once_with()
+        worker_m.assert_not_called()
+
+    @mock.patch("lens_db.worker.run_worker")
+    def test_worker(self, worker_m, mocks):
+        scan_m, options_m, lens_m, creds_m, dis_m, en_m, st_m = mocks
+        options_m.return_value = Namespace(command="worker", interval=2.0, once=True)
+        _main()
+
+        worker_m.assert_called_once_with(2.0, once=True)
+        scan_m.assert_not_called()
+
+    @mock.patch("lens_db.daemon.run_daemon")
+    def test_daemon(self, daemon_m, mocks):
+        scan_m, options_m, lens_m, creds_m, dis_m, en_m, st_m = mocks
+        options_m.return_value = Namespace(command="daemon", interval=2.0)
+        _main()
+
+        daemon_m.assert_called_once_with(2.0)
+        scan_m.assert_not_called()
+
     def test_days(self, mocks):
         scan_m, options_m, lens_m, creds_m, dis_m, en_m, st_m = mocks
-        options_m.return_value = Namespace(days=5, command="days")
+        options_m.return_value = Namespace(
+            days=5, command="days", user=None, lens_type=None
+        )
 
         _main()
 
         scan_m.assert_not_called()
-        lens_m.add.assert_called_once_with(delta_days=5)
+        lens_m.add.assert_called_once_with(delta_days=5, user_id=1, type_id=1)
         lens_m.add_custom.assert_not_called()
         lens_m.list.assert_not_called()
         lens_m.get_last.assert_not_called()
@@ -136,11 +336,11 @@ class TestHiddenMain:
 
     def test_now(self, mocks):
         scan_m, options_m, lens_m, creds_m, dis_m, en_m, st_m = mocks
-        options_m.return_value = Namespace(command="now")
+        options_m.return_value = Namespace(command="now", user=None, lens_type=None)
         _main()
 
         scan_m.assert_not_called()
-        lens_m.add.assert_called_once_with(delta_days=0)
+        lens_m.add.assert_called_once_with(delta_days=0, user_id=1, type_id=1)
         lens_m.add_custom.assert_not_called()
         lens_m.list.assert_not_called()
         lens_m.get_last.assert_not_called()
@@ -151,12 +351,14 @@ class TestHiddenMain:
 
     def test_from_str(self, mocks):
         scan_m, options_m, lens_m, creds_m, dis_m, en_m, st_m = mocks
-        options_m.return_value = Namespace(string="some-str", command="from-str")
+        options_m.return_value = Namespace(
+            string="some-str", command="from-str", user=None, lens_type=None
+        )
         _main()
 
         scan_m.assert_not_called()
         lens_m.add.assert_not_called()
-        lens_m.add_custom.assert_called_once_with("some-str")
+        lens_m.add_custom.assert_called_once_with("some-str", user_id=1, type_id=1)
         lens_m.list.assert_not_called()
         lens_m.get_last.assert_not_called()
         creds_m.assert_not_called()
@@ -164,26 +366,71 @@ class TestHiddenMain:
         en_m.assert_not_called()
         st_m.assert_not_called()
 
-    def test_list(self, mocks):
+    def test_list(self, mocks, capsys):
         scan_m, options_m, lens_m, creds_m, dis_m, en_m, st_m = mocks
-        options_m.return_value = Namespace(command="list")
+        options_m.return_value = Namespace(
+            command="list",
+            user=None,
+            lens_type=None,
+            since="2020-01-01",
+            until=None,
+            reverse=False,
+            limit=2,
+            offset=0,
+        )
+        lens_m.iter.return_value = iter(["2020-01-01", "2020-01-16"])
 
-        with pytest.raises(SystemExit):
-            _main()
+        _main()
 
+        assert capsys.readouterr().out == "2020-01-01\n2020-01-16\n"
         scan_m.assert_not_called()
         lens_m.add.assert_not_called()
         lens_m.add_custom.assert_not_called()
-        lens_m.list.assert_called_once_with()
+        lens_m.iter.assert_called_once_with(
+            since="2020-01-01",
+            until=None,
+            reverse=False,
+            limit=2,
+            offset=0,
+            user_id=1,
+            type_id=None,
+        )
         lens_m.get_last.assert_not_called()
         creds_m.assert_not_called()
         dis_m.assert_not_called()
         en_m.assert_not_called()
         st_m.assert_not_called()
 
+    @pytest.mark.parametrize("duplicates", [[], ["2020-01-01"]])
+    @mock.patch("lens_db.importer.read_dates")
+    def test_import(self, read_dates_m, mocks, duplicates, capsys):
+        scan_m, options_m, lens_m, creds_m, dis_m, en_m, st_m = mocks
+        file = io.StringIO("2020-01-01\n2020-01-16\n")
+        options_m.return_value = Namespace(
+            command="import", user=None, lens_type=None, file=file, format=None
+        )
+        lens_m.add_many.return_value.added = 2 - len(duplicates)
+        lens_m.add_many.return_value.duplicates = duplicates
+
+        _main()
+
+        out = capsys.readouterr().out
+        assert "Added %d dates" % (2 - len(duplicates)) in out
+        assert ("Skipped 1 dates already in the database: 2020-01-01" in out) == bool(
+            duplicates
+        )
+        assert file.closed
+        read_dates_m.assert_called_once_with(file, None)
+        lens_m.add_many.assert_called_once_with(
+            read_dates_m.return_value, user_id=1, type_id=1
+        )
+        scan_m.assert_not_called()
+        lens_m.add.assert_not_called()
+        lens_m.add_custom.assert_not_called()
+
     def test_last(self, mocks):
         scan_m, options_m, lens_m, creds_m, dis_m, en_m, st_m = mocks
-        options_m.return_value = Namespace(command="last")
+        options_m.return_value = Namespace(command="last", user=None, lens_type=None)
 
         with pytest.raises(SystemExit):
             _main()
@@ -192,7 +439,7 @@ class TestHiddenMain:
         lens_m.add.assert_not_called()
         lens_m.add_custom.assert_not_called()
         lens_m.list.assert_not_called()
-        lens_m.get_last.assert_called_once_with()
+        lens_m.get_last.assert_called_once_with(user_id=1, type_id=None)
         creds_m.assert_not_called()
         dis_m.assert_not_called()
         en_m.assert_not_called()
@@ -200,7 +447,7 @@ class TestHiddenMain:
 
     def test_last_empty(self, mocks):
         scan_m, options_m, lens_m, creds_m, dis_m, en_m, st_m = mocks
-        options_m.return_value = Namespace(command="last")
+        options_m.return_value = Namespace(command="last", user=None, lens_type=None)
 
         lens_m.get_last.return_value = None
 
@@ -211,7 +458,7 @@ class TestHiddenMain:
         lens_m.add.assert_not_called()
         lens_m.add_custom.assert_not_called()
         lens_m.list.assert_not_called()
-        lens_m.get_last.assert_called_once_with()
+        lens_m.get_last.assert_called_once_with(user_id=1, type_id=None)
         creds_m.assert_not_called()
         dis_m.assert_not_called()
         en_m.assert_not_called()
@@ -281,6 +528,59 @@ class TestHiddenMain:
         st_m.assert_called()
 
 
+class TestUsers:
+    @pytest.fixture
+    def users_m(self):
+        with mock.patch("lens_db.core.Users") as users_m:
+            yield users_m
+
+    @mock.patch("lens_db.main.get_options")
+    @mock.patch("lens_db.core.Lens")
+    def test_user_option(self, lens_m, options_m, users_m, setup_logging_m):
+        options_m.return_value = Namespace(
+            command="now",
+            user="a@b.c",
+            lens_type=None,
+            config=None,
+            database=None,
+            log_level=None,
+        )
+        users_m.get.return_value = User(7, "a@b.c", 15, True)
+
+        _main()
+
+        users_m.get.assert_called_once_with("a@b.c")
+        settings = setup_logging_m.call_args[0][0]
+        assert settings.logging_level == "INFO"
+        lens_m.add.assert_called_once_with(delta_days=0, user_id=7, type_id=1)
+
+    def test_add(self, users_m):
+        manage_users(
+            Namespace(users_command="add", email="a@b.c", durability=30, rules="quiet")
+        )
+        users_m.add.assert_called_once_with("a@b.c", durability=30, rules="quiet")
+
+    def test_list(self, users_m, capsys):
+        users_m.list.return_value = [
+            User(1, "a@b.c", 15, True),
+            User(2, "d@e.f", 30, False, "quiet"),
+        ]
+
+        manage_users(Namespace(users_command="list"))
+
+        out = capsys.readouterr().out
+        assert out == "a@b.c (15 days)\nd@e.f (30 days, quiet rules) [disabled]\n"
+
+    @pytest.mark.parametrize("action", ["enable", "disable"])
+    def test_enable_disable(self, users_m, action):
+        manage_users(Namespace(users_command=action, email="a@b.c"))
+        users_m.update.assert_called_once_with("a@b.c", enabled=action == "enable")
+
+    def test_rules(self, users_m):
+        manage_users(Namespace(users_command="rules", email="a@b.c", rules="quiet"))
+        users_m.update.assert_called_once_with("a@b.c", rules="quiet")
+
+
 @mock.patch("lens_db.main._main")
 class TestRealMain:
     def test_normal(self, hidden_main_mock):
@@ -294,3 +594,134 @@ class TestRealMain:
 
         main()
         exc_exit_mock.assert_called_once_with(exc)
+
+
+class TestLensTypes:
+    @pytest.fixture
+    def types_m(self):
+        with mock.patch("lens_db.core.LensTypes") as types_m:
+            yield types_m
+
+    def test_options(self):
+        opt = modified_get_options("types add monthly --durability 30 --rules quiet")
+        assert opt.command == "types"
+        assert opt.types_command == "add"
+        assert opt.name == "monthly"
+        assert opt.durability == 30
+        assert opt.rules == "quiet"
+
+        opt = modified_get_options("types add daily")
+        assert opt.durability is None
+        assert opt.rules is None
+
+        assert modified_get_options("types list").types_command == "list"
+        assert modified_get_options("--type monthly list").lens_type == "monthly"
+
+    @mock.patch("lens_db.main.get_options")
+    @mock.patch("lens_db.core.Lens")
+    def test_type_option(self, lens_m, options_m, types_m):
+        types_m.get.return_value = LensType(3, "monthly", 30, None)
+
+        options_m.return_value = Namespace(
+            command="now",
+            user=None,
+            lens_type="monthly",
+            config=None,
+            database=None,
+            log_level=None,
+        )
+        _main()
+        lens_m.add.assert_called_once_with(delta_days=0, user_id=1, type_id=3)
+
+        options_m.return_value = Namespace(
+            command="last",
+            user=None,
+            lens_type="monthly",
+            config=None,
+            database=None,
+            log_level=None,
+        )
+        with pytest.raises(SystemExit):
+            _main()
+        lens_m.get_last.assert_called_once_with(user_id=1, type_id=3)
+        types_m.get.assert_called_with("monthly")
+
+    def test_add(self, types_m):
+        manage_types(
+            Namespace(types_command="add", name="monthly", durability=30, rules=None)
+        )
+        types_m.add.assert_called_once_with("monthly", durability=30, rules=None)
+
+    def test_list(self, types_m, capsys):
+        types_m.list.return_value = [
+            LensType(1, "default", None, None),
+            LensType(2, "monthly", 30, "quiet"),
+        ]
+
+        manage_types(Namespace(types_command="list"))
+
+        out = capsys.readouterr().out
+        assert out == "default (user durability)\nmonthly (30 days, quiet rules)\n"
+
+
+class TestRunSimulation:
+    @pytest.fixture
+    def simulate_m(self):
+        with mock.patch("lens_db.simulator.simulate") as simulate_m:
+            yield simulate_m
+
+    def test_output(self, simulate_m, capsys):
+        user = User(1, "a@b.c", 15, True)
+        rule = mock.Mock(subject="Cambiar lentillas hoy")
+        simulate_m.return_value = [
+            Event(date(2026, 1, 16), user, date(2025, 12, 31), rule),
+            Event(date(2026, 2, 1), user, date(2026, 1, 16), rule),
+        ]
+
+        run_simulation(Namespace(since="2026-01-01", until="2027-01-01", user=None))
+
+        simulate_m.assert_called_once_with(
+            date(2026, 1, 1), date(2027, 1, 1), users=None
+        )
+        assert capsys.readouterr().out == (
+            "2026-01-16 a@b.c: Cambiar lentillas hoy\n"
+            "2026-02-01 a@b.c: Cambiar lentillas hoy\n"
+            "2026-01: 1 emails\n"
+            "2026-02: 1 emails\n"
+            "Total: 2 emails\n"
+        )
+
+    @mock.patch("lens_db.main.today_date", return_value=date(2026, 1, 1))
+    @mock.patch("lens_db.core.Users")
+    def test_defaults(self, users_m, today_m, simulate_m):
+        simulate_m.return_value = []
+        run_simulation(Namespace(since=None, until="2026-02-01", user="a@b.c"))
+
+        users_m.get.assert_called_once_with("a@b.c")
+        simulate_m.assert_called_once_with(
+            date(2026, 1, 1), date(2026, 2, 1), users=[users_m.get.return_value]
+        )
+
+    def test_invalid_date(self, simulate_m):
+        with pytest.raises(InvalidDateError):
+            run_simulation(Namespace(since="2026.01.01", until="2027-01-01", user=None))
+
+
+def test_import_time():
+    code = "import sys, lens_db.main; print(' '.join(sys.modules))"
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    )
+
+    # Each command imports what it needs when it runs
+    modules = set(result.stdout.split())
+    for module in ("lens_db.core", "lens_db._version", "asyncio", "smtplib"):
+        assert module not in modules
+
+    times = [x.split("|") for x in result.stderr.splitlines()]
+    (cumulative,) = [int(x[1]) for x in times if x[-1].strip() == "lens_db.main"]
+    assert cumulative / 10**6 < IMPORT_BUDGET
@@ -0,0 +1,152 @@
+import sqlite3
+from unittest import mock
+
+import pytest
+
+from lens_db.config import ADMIN_EMAIL, LENS_DURABILITY
+from lens_db.core import Lens
+from lens_db.exceptions import SchemaVersionError
+from lens_db.migrations import (
+    DEFAULT_TYPE_ID,
+    DEFAULT_USER_ID,
+    MIGRATIONS,
+    get_version,
+    migrate,
+)
+
+days = ["2019-12-15", "2019-12-27", "2019-12-11", "2019-12-21"]
+
+
+@pytest.fixture
+def connection(database):
+    connection = sqlite3.connect(database)
+    yield connection
+    connection.close()
+
+
+def get_schema(connection):
+    query = "SELECT name, sql FROM sqlite_master WHERE name NOT LIKE 'sqlite_%'"
+    return dict(connection.execute(query).fetchall())
+
+
+def test_get_version(connection):
+    assert get_version(connection) == 0
+    connection.execute("PRAGMA user_version = 3")
+    assert get_version(connection) == 3
+
+
+def test_migrate_empty(connection):
+    assert migrate(connection) == len(MIGRATIONS)
+    assert get_version(connection) == len(MIGRATIONS)
+
+    schema = get_schema(connection)
+    assert "PRIMARY KEY (user_id, type_id, day)) WITHOUT ROWID" in schema["lens"]
+    assert "users" in schema
+    assert "lens_types" in schema
+
+
+def test_migrate_up_to_date(connection):
+    migrate(connection)
+
+    connection = mock.MagicMock(wraps=connection)
+    assert migrate(connection) == len(MIGRATIONS)
+    connection.execute.assert_called_once_with("PRAGMA user_version")
+
+
+def test_migrate_timestamps(connection):
+    connection.execute(
+        "CREATE TABLE 'lens' (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+        "timestamp TEXT NOT NULL UNIQUE)"
+    )
+    connection.executemany("INSERT INTO lens VALUES (NULL, ?)", [(x,) for x in days])
+    connection.commit()
+
+    migrate(connection)
+
+    assert "lens_timestamps" not in get_schema(connection)
+    assert Lens.list() == sorted(days)
+
+
+def test_migrate_unversioned_ordinals(connection):
+    # Databases created before the schema version was recorded
+    connection.execute("CREATE TABLE lens (day INTEGER PRIMARY KEY) WITHOUT ROWID")
+    connection.execute("INSERT INTO lens VALUES (737420)")
+    connection.commit()
+
+    migrate(connection)
+
+    assert get_version(connection) == len(MIGRATIONS)
+    assert Lens.list() == ["2019-12-27"]
+
+
+def test_migrate_newer(connection):
+    connection.execute("PRAGMA user_version = %d" % (len(MIGRATIONS) + 1))
+
+    with pytest.raises(SchemaVersionError, match="schema version is"):
+        migrate(connection)
+
+
+def test_migrate_error(connection):
+    def broken(connection):
+        connection.execute("CREATE TABLE broken (id INTEGER)")
+        raise ValueError("broken migration")
+
+    with mock.patch("lens_db.migrations.MIGRATIONS", MIGRATIONS + [broken]):
+        with pytest.raises(ValueError, match="broken migration"):
+            migrate(connection)
+
+    assert get_version(connection) == len(MIGRATIONS)
+    assert "broken" not in get_schema(connection)
+
+
+def test_migrate_users(connection):
+    connection.execute("CREATE TABLE lens (day INTEGER PRIMARY KEY) WITHOUT ROWID")
+    connection.execute("INSERT INTO lens VALUES (737420)")
+    connection.commit()
+
+    migrate(connection)
+
+    users = connection.execute(
+        "SELECT id, email, durability, enabled FROM users"
+    ).fetchall()
+    assert users == [(DEFAULT_USER_ID, ADMIN_EMAIL, LENS_DURABILITY, 1)]
+    assert connection.execute("SELECT user_id, day FROM lens").fetchall() == [
+        (DEFAULT_USER_ID, 737420)
+    ]
+
+
+def test_migrate_schedule(connection):
+    connection.execute("CREATE TABLE lens (day INTEGER PRIMARY KEY) WITHOUT ROWID")
+    connection.executemany("INSERT INTO lens VALUES (?)", [(737400,), (737420,)])
+    connection.commit()
+
+    migrate(connection)
+
+    assert connection.execute("SELECT * FROM schedule").fetchall() == [
+        (DEFAULT_USER_ID, DEFAULT_TYPE_ID, 737420, 737420 + LENS_DURABILITY + 1)
+    ]
+
+
+def test_migrate_lens_types(connection):
+    # Version 6: a history and a notification of the default user
+    with mock.patch("lens_db.migrations.MIGRATIONS", MIGRATIONS[:6]):
+        migrate(connection)
+    connection.execute("INSERT INTO lens VALUES (1, 737420)")
+    connection.execute("INSERT INTO schedule VALUES (1, 737420, 737436)")
+    connection.execute(
+        "INSERT INTO notifications VALUES (1, 737420, 'today', '2020-01-11 10:00:00')"
+    )
+    connection.commit()
+
+    migrate(connection)
+
+    assert connection.execute("SELECT * FROM lens_types").fetchall() == [
+        (DEFAULT_TYPE_ID, "default", None, None)
+    ]
+    assert connection.execute("SELECT * FROM lens").fetchall() == [
+        (DEFAULT_USER_ID, DEFAULT_TYPE_ID, 737420)
+    ]
+    assert connection.execute("SELECT * FROM notifications").fetchall() == [
+        (DEFAULT_USER_ID, DEFAULT_TYPE_ID, 737420, "today", "2020-01-11 10:00:00")
+    ]
+    assert "schedule_untyped" not in get_schema(connection)
@@ -0,0 +1,88 @@
+from datetime import date
+from unittest import mock
+
+import pytest
+
+from lens_db.exceptions import UnknownRulesError
+from lens_db.rules import (
+    DEFAULT_RULES,
+    RULE_SETS,
+    Rule,
+    compile_rules,
+    get_rules,
+    match,
+    offsets,
+    register_rules,
+    render,
+)
+
+
+@pytest.fixture
+def rule_sets():
+    with mock.patch.dict(RULE_SETS):
+        yield RULE_SETS
+    compile_rules.cache_clear()
+
+
+@pytest.mark.parametrize(
+    "days, kind",
+    [
+        (0, None),
+        (13, None),
+        (14, "day after tomorrow"),
+        (15, "tomorrow"),
+        (16, "today"),
+        (17, "expired"),
+        (100, "expired"),
+    ],
+)
+def test_match_default(days, kind):
+    rule = match("default", 15, days)
+    assert (rule and rule.kind) == kind
+
+
+@pytest.mark.parametrize("days, kind", [(15, None), (16, "today"), (30, "expired")])
+def test_match_quiet(days, kind):
+    rule = match("quiet", 15, days)
+    assert (rule and rule.kind) == kind
+
+
+def test_compile_cached():
+    compile_rules.cache_clear()
+
+    table = compile_rules("default", 30)
+    assert compile_rules("default", 30) is table
+    assert sorted(table.exact) == [29, 30, 31, 32]
+    assert table.open_ended == (32, DEFAULT_RULES[3])
+
+
+def test_unknown_rules():
+    with pytest.raises(UnknownRulesError, match="Unknown rules 'invalid'"):
+        get_rules("invalid")
+    with pytest.raises(UnknownRulesError):
+        match("invalid", 15, 16)
+
+
+def test_register_rules(rule_sets):
+    early = Rule(-7, "week", "subject", "%(days)s days since %(last)s", "info")
+    register_rules("early", (early,) + DEFAULT_RULES)
+
+    assert match("early", 15, 9) == early
+    assert match("early", 15, 10) is None
+    assert offsets() == (-7, -2, -1, 0, 1)
+
+
+def test_register_invalid(rule_sets):
+    with pytest.raises(ValueError, match="open ended"):
+        register_rules("invalid", DEFAULT_RULES + DEFAULT_RULES[3:])
+    with pytest.raises(ValueError, match="same offset"):
+        register_rules("invalid", DEFAULT_RULES + DEFAULT_RULES[:1])
+
+    assert "invalid" not in RULE_SETS
+
+
+def test_render():
+    message = render(DEFAULT_RULES[2], date(2019, 12, 10), 16)
+    assert message == (
+        "Hay que cambiar hoy las lentillas, el último cambio fue el 2019-12-10 (16 días)"
+    )
@@ -1,3 +1,4 @@
+import logging
 from datetime import date, timedelta
 from enum import Enum
 from unittest import mock
@@ -5,8 +6,10 @@ from unittest import mock
 import pytest
 from colorama import Fore
 
+from lens_db.core import Due, User
 from lens_db.exceptions import AlreadyDisabledError, AlreadyEnabledError
 from lens_db.scanner import disable, enable, scan, show_status
+from lens_db.settings import Settings, get_settings, set_settings
 
 
 class ScanCode(Enum):
@@ -18,14 +21,27 @@ class ScanCode(Enum):
     expired = 6
 
 
+user = User(1, "user@example.com", 15, True)
+
+
+@pytest.fixture
+def settings(tmp_path):
+    settings = Settings(disabled_path=tmp_path / ".disabled")
+    set_settings(settings)
+    yield settings
+    set_settings(None)
+
+
 class TestScan:
     @pytest.fixture
-    def mocks(self):
-        get_last = mock.patch("lens_db.scanner.Lens.get_last").start()
+    def mocks(self, settings):
+        get_due = mock.patch("lens_db.scanner.Lens.get_due").start()
         today_date = mock.patch("lens_db.scanner.today_date").start()
-        send_email = mock.patch("lens_db.scanner.send_email").start()
+        enqueue = mock.patch(
+            "lens_db.scanner.Outbox.enqueue", return_value=True
+        ).start()
 
-        yield get_last, today_date, send_email
+        yield get_due, today_date, enqueue
 
         mock.patch.stopall()
 
@@ -44,81 +60,152 @@ class TestScan:
 
     @pytest.mark.parametrize("days, expect", scan_data)
     def test_scan(self, mocks, days, expect, caplog):
-        get_last, today_date, send_email = mocks
+        caplog.set_level(logging.DEBUG)
+        get_due, today_date, enqueue = mocks
         if expect != ScanCode.no_entries:
-            get_last.return_value = date(2019, 1, 1)
-            today_date.return_value = get_last.return_value + timedelta(days=days)
+            last = date(2019, 1, 1)
+            due = last + timedelta(days=user.durability + 1)
+            get_due.return_value = [Due(user, last, due)]
+            today_date.return_value = last + timedelta(days=days)
         else:
-            get_last.return_value = None
+            get_due.return_value = []
             today_date.return_value = date(2019, 1, 1)
 
         scan()
 
+        get_due.assert_called_once_with(
+            today_date.return_value, margin=1, settings=get_settings()
+        )
+        if expect != ScanCode.no_entries and expect != ScanCode.not_sent:
+            assert enqueue.call_args[0][3] == user.email
+
         if expect == ScanCode.no_entries:
-            assert "No entries\n" in caplog.text
+            assert "No users due\n" in caplog.text
         elif expect == ScanCode.not_sent:
-            send_email.assert_not_called()
+            enqueue.assert_not_called()
         elif expect == ScanCode.day_after_tomorrow:
-            send_email.assert_called_once()
-            assert "sending email (day after tomorrow)\n" in caplog.text
+            enqueue.assert_called_once()
+            assert "queueing email (day after tomorrow)\n" in caplog.text
         elif expect == ScanCode.tomorrow:
-            send_email.assert_called_once()
-            assert "sending email (tomorrow)\n" in caplog.text
+            enqueue.assert_called_once()
+            assert "queueing email (tomorrow)\n" in caplog.text
         elif expect == ScanCode.today:
-            send_email.assert_called_once()
-            assert "sending email (today)\n" in caplog.text
+            enqueue.assert_called_once()
+            assert "queueing email (today)\n" in caplog.text
         elif expect == ScanCode.expired:
-            send_email.assert_called_once()
-            assert "sending email (expired)\n" in caplog.text
+            enqueue.assert_called_once()
+            assert "queueing email (expired)\n" in caplog.text
+
+    def test_several_users(self, mocks):
+        get_due, today_date, enqueue = mocks
+        today_date.return_value = date(2019, 1, 31)
+        get_due.return_value = [
+            Due(User(2, "a@example.com", 30, True), date(2019, 1, 1), date(2019, 2, 1)),
+            Due(
+                User(3, "b@example.com", 15, True), date(2019, 1, 15), date(2019, 1, 31)
+            ),
+        ]
+
+        scan()
+
+        assert enqueue.call_count == 2
+        assert enqueue.call_args_list[0][0][3:5] == (
+            "a@example.com",
+            "Cambiar lentillas mañana",
+        )
+        assert enqueue.call_args_list[1][0][3:5] == (
+            "b@example.com",
+            "Cambiar lentillas hoy",
+        )
+
+    @pytest.mark.parametrize("days, sent", [(14, False), (15, False), (16, True)])
+    def test_user_rules(self, mocks, days, sent):
+        get_due, today_date, enqueue = mocks
+        quiet = User(2, "a@example.com", 15, True, "quiet")
+        last = date(2019, 1, 1)
+        today_date.return_value = last + timedelta(days=days)
+        get_due.return_value = [Due(quiet, last, date(2019, 1, 17))]
+
+        scan()
 
-    @mock.patch("lens_db.scanner.DISABLED", True)
-    def test_disabled(self, mocks, caplog):
-        get_last, today_date, send_email = mocks
+        assert enqueue.called == sent
+
+    def test_queued(self, mocks):
+        get_due, today_date, enqueue = mocks
+        today_date.return_value = date(2019, 1, 16)
+        get_due.return_value = [Due(user, date(2019, 1, 1), date(2019, 1, 17))]
 
         scan()
 
-        get_last.assert_not_called()
+        enqueue.assert_called_once_with(
+            1,
+            date(2019, 1, 1),
+            "tomorrow",
+            "user@example.com",
+            "Cambiar lentillas mañana",
+            "Mañana hay que cambiar las lentillas, "
+            "el último cambio fue el 2019-01-01 (15 días)",
+            1,
+            settings=get_settings(),
+        )
+
+    def test_already_sent(self, mocks, caplog):
+        caplog.set_level(logging.DEBUG)
+        get_due, today_date, enqueue = mocks
+        today_date.return_value = date(2019, 1, 16)
+        get_due.return_value = [Due(user, date(2019, 1, 1), date(2019, 1, 17))]
+        enqueue.return_value = False
+
+        scan()
+
+        enqueue.assert_called_once()
+        assert "Email (tomorrow) already sent to 'user@example.com'" in caplog.text
+        assert "queueing email" not in caplog.text
+
+    def test_disabled(self, mocks, tmp_path):
+        get_due, today_date, enqueue = mocks
+        settings = Settings(disabled_path=tmp_path / "disabled")
+        settings.set_disabled(True)
+
+        scan(settings=settings)
+
+        get_due.assert_not_called()
         today_date.assert_not_called()
-        send_email.assert_not_called()
+        enqueue.assert_not_called()
 
 
 @pytest.mark.parametrize("disabled", [True, False])
-@mock.patch("lens_db.scanner.DISABLED_PATH")
-def test_disable(dis_path_mock, disabled):
-    dis_path_mock.exists.return_value = disabled
-
+def test_disable(settings, disabled):
     if disabled:
+        settings.disabled_path.touch()
         with pytest.raises(AlreadyDisabledError):
             disable()
-        dis_path_mock.touch.assert_not_called()
     else:
         disable()
-        dis_path_mock.touch.assert_called_once()
 
-    dis_path_mock.exists.assert_called_once()
+    assert settings.disabled_path.exists()
+    assert settings.disabled
 
 
 @pytest.mark.parametrize("disabled", [True, False])
-@mock.patch("lens_db.scanner.DISABLED_PATH")
-def test_enable(dis_path_mock, disabled):
-    dis_path_mock.exists.return_value = disabled
-
+def test_enable(settings, disabled):
     if not disabled:
         with pytest.raises(AlreadyEnabledError):
             enable()
-        dis_path_mock.unlink.assert_not_called()
     else:
+        settings.disabled_path.touch()
         enable()
-        dis_path_mock.unlink.assert_called_once()
 
-    dis_path_mock.exists.assert_called_once()
+    assert not settings.disabled_path.exists()
+    assert not settings.disabled
 
 
 @pytest.mark.parametrize("disabled", [False, True])
-@mock.patch("lens_db.scanner.DISABLED_PATH")
-def test_show_status(dis_path_mock, disabled, capsys):
-    dis_path_mock.exists.return_value = disabled
-    show_status()
+def test_show_status(tmp_path, disabled, capsys):
+    settings = Settings(disabled_path=tmp_path / ".disabled")
+    if disabled:
+        settings.disabled_path.touch()
+    show_status(settings)
 
     captured = capsys.readouterr()
     if disabled:
@@ -0,0 +1,105 @@
+import json
+from pathlib import Path
+from unittest import mock
+
+import pytest
+
+from lens_db.config import DATABASE_PATH, SMTP_HOST
+from lens_db.exceptions import InvalidSettingsError
+from lens_db.settings import Settings, get_settings, set_settings
+
+
+class TestSettings:
+    def test_defaults(self):
+        settings = Settings()
+        assert settings.database_path == DATABASE_PATH
+        assert settings.smtp_host == SMTP_HOST
+        assert settings.logging_level == "INFO"
+
+    def test_values(self):
+        settings = Settings(database_path="/tmp/a.db", smtp_port="25", smtp_host=None)
+        assert settings.database_path == Path("/tmp/a.db")
+        assert settings.smtp_port == 25
+        assert settings.smtp_host == SMTP_HOST
+
+    def test_invalid(self):
+        with pytest.raises(InvalidSettingsError, match="Unknown settings: colour"):
+            Settings(colour="blue")
+        with pytest.raises(InvalidSettingsError, match="Invalid value for smtp_port"):
+            Settings(smtp_port="many")
+
+    def test_load_layers(self, tmp_path):
+        path = tmp_path / "lens-db.json"
+        data = {"database_path": "lens.db", "smtp_host": "file", "smtp_port": 25}
+        path.write_text(json.dumps(data))
+        environ = {"LENS_DB_SMTP_HOST": "env", "LENS_DB_SMTP_PORT": "2525"}
+
+        settings = Settings.load(path, environ, smtp_port=465)
+
+        # Relative paths of the file are relative to its directory
+        assert settings.database_path == tmp_path / "lens.db"
+        assert settings.smtp_host == "env"
+        assert settings.smtp_port == 465
+
+    def test_load_config_env(self, tmp_path):
+        path = tmp_path / "lens-db.json"
+        path.write_text(json.dumps({"smtp_host": "file"}))
+
+        settings = Settings.load(environ={"LENS_DB_CONFIG": str(path)})
+        assert settings.smtp_host == "file"
+
+    @mock.patch("lens_db.settings.CONFIG_PATH")
+    def test_load_no_config(self, config_path_mock):
+        config_path_mock.exists.return_value = False
+        assert Settings.load(environ={}).smtp_host == SMTP_HOST
+
+    @pytest.mark.parametrize("content", ["{", "[]"])
+    def test_load_invalid_config(self, tmp_path, content):
+        path = tmp_path / "lens-db.json"
+        path.write_text(content)
+
+        with pytest.raises(InvalidSettingsError, match="Invalid config file"):
+            Settings.load(path, {})
+
+    def test_load_missing_config(self, tmp_path):
+        with pytest.raises(InvalidSettingsError, match="Invalid config file"):
+            Settings.load(tmp_path / "lens-db.json", {})
+
+    @mock.patch("lens_db.settings.time.monotonic")
+    def test_disabled_cache(self, monotonic_mock, tmp_path):
+        monotonic_mock.return_value = 100
+        settings = Settings(disabled_path=tmp_path / ".disabled")
+        assert not settings.disabled
+
+        settings.disabled_path.touch()
+        assert not settings.disabled
+
+        monotonic_mock.return_value = 101
+        assert settings.disabled
+
+    def test_set_disabled(self, tmp_path):
+        settings = Settings(disabled_path=tmp_path / ".disabled")
+        assert not settings.disabled
+
+        settings.set_disabled(True)
+        assert settings.disabled_path.exists()
+        assert settings.disabled
+
+        settings.set_disabled(False)
+        assert not settings.disabled_path.exists()
+        assert not settings.disabled
+
+
+@mock.patch("lens_db.settings.Settings.load")
+def test_get_settings(load_mock):
+    set_settings(None)
+    try:
+        assert get_settings() is load_mock.return_value
+        assert get_settings() is load_mock.return_value
+        load_mock.assert_called_once_with()
+
+        settings = Settings()
+        set_settings(settings)
+        assert get_settings() is settings
+    finally:
+        set_settings(None)
@@ -0,0 +1,96 @@
+from datetime import date, timedelta
+from unittest import mock
+
+import pytest
+
+from lens_db.core import Lens, LensTypes, Outbox, Users
+from lens_db.scanner import scan_users
+from lens_db.simulator import simulate, summarize
+
+
+@pytest.fixture
+def history(database):
+    Users.update("sralloza@gmail.com", durability=15)
+    Lens.add_many(["2019-11-01", "2019-11-17", "2019-12-10"])
+    quiet = Users.add("quiet@example.com", durability=30, rules="quiet")
+    Lens.add_many(["2019-10-01", "2019-11-15"], user_id=quiet.id)
+    Users.add("empty@example.com")
+    disabled = Users.add("disabled@example.com", durability=1)
+    Lens.add_custom("2019-11-01", user_id=disabled.id)
+    Users.update("disabled@example.com", enabled=False)
+
+
+def test_simulate(history):
+    events = simulate(date(2019, 11, 1), date(2019, 12, 31))
+    emails = [(x.day, x.user.email, x.rule.kind) for x in events]
+
+    assert emails == [
+        (date(2019, 11, 1), "quiet@example.com", "today"),
+        (date(2019, 11, 2), "quiet@example.com", "expired"),
+        (date(2019, 11, 15), "sralloza@gmail.com", "day after tomorrow"),
+        (date(2019, 11, 16), "sralloza@gmail.com", "tomorrow"),
+        (date(2019, 12, 1), "sralloza@gmail.com", "day after tomorrow"),
+        (date(2019, 12, 2), "sralloza@gmail.com", "tomorrow"),
+        (date(2019, 12, 3), "sralloza@gmail.com", "today"),
+        (date(2019, 12, 4), "sralloza@gmail.com", "expired"),
+        (date(2019, 12, 16), "quiet@example.com", "today"),
+        (date(2019, 12, 17), "quiet@example.com", "expired"),
+        (date(2019, 12, 24), "sralloza@gmail.com", "day after tomorrow"),
+        (date(2019, 12, 25), "sralloza@gmail.com", "tomorrow"),
+        (date(2019, 12, 26), "sralloza@gmail.com", "today"),
+        (date(2019, 12, 27), "sralloza@gmail.com", "expired"),
+    ]
+    assert summarize(events) == {"2019-11": 4, "2019-12": 10}
+
+
+def test_expired_before_range(history):
+    events = simulate(date(2020, 3, 1), date(2020, 3, 31))
+    emails = [(x.day, x.user.email, x.rule.kind) for x in events]
+
+    assert emails == [
+        (date(2020, 3, 1), "sralloza@gmail.com", "expired"),
+        (date(2020, 3, 1), "quiet@example.com", "expired"),
+    ]
+
+
+def test_lens_types(history):
+    left = LensTypes.add("left", durability=30, rules="quiet")
+    Lens.add_custom("2019-12-01", type_id=left.id)
+    events = simulate(date(2020, 1, 1), date(2020, 1, 31))
+    emails = [(x.day, x.user.email, x.lens_type.name, x.rule.kind) for x in events]
+
+    assert emails == [
+        (date(2020, 1, 1), "sralloza@gmail.com", "default", "expired"),
+        (date(2020, 1, 1), "sralloza@gmail.com", "left", "today"),
+        (date(2020, 1, 1), "quiet@example.com", "default", "expired"),
+        (date(2020, 1, 2), "sralloza@gmail.com", "left", "expired"),
+    ]
+
+
+def test_sink(history):
+    sink = mock.Mock()
+    events = simulate(date(2019, 11, 1), date(2019, 11, 30), sink=sink)
+
+    assert sink.call_args_list == [mock.call(x) for x in events]
+
+
+def test_users(history):
+    quiet = Users.get("quiet@example.com")
+    events = simulate(date(2019, 11, 1), date(2019, 12, 31), users=[quiet])
+
+    assert {x.user for x in events} == {quiet}
+
+
+def test_matches_scan(history):
+    # Scans only know the last change of each user
+    since, until = date(2019, 12, 10), date(2020, 2, 29)
+    expected = [(x.day, x.user.email, x.rule.subject) for x in simulate(since, until)]
+
+    sent = []
+    day = since
+    while day <= until:
+        scan_users(day)
+        sent += [(day, x.destination, x.subject) for x in Outbox.take(now=1e12)]
+        day += timedelta(days=1)
+
+    assert sorted(sent) == sorted(expected)
@@ -0,0 +1,165 @@
+import json
+import mailbox
+from collections import namedtuple
+from smtplib import SMTPServerDisconnected
+from unittest import mock
+
+import pytest
+
+from lens_db.config import SMTP_CONNECT_TIMEOUT, SMTP_READ_TIMEOUT
+from lens_db.email import send_email
+from lens_db.settings import Settings
+from lens_db.transports import (
+    JSONLTransport,
+    MaildirTransport,
+    MemoryTransport,
+    SMTPTransport,
+    open_transport,
+)
+
+Interface = namedtuple("UnencryptedCredentials", ["username", "password"])
+
+
+@mock.patch("smtplib.SMTP")
+@mock.patch("lens_db.transports.get_credentials")
+class TestSMTPTransport:
+    def test_lazy(self, get_creds_mock, smtp_mock):
+        with SMTPTransport():
+            pass
+
+        smtp_mock.assert_not_called()
+
+    def test_reuse(self, get_creds_mock, smtp_mock):
+        get_creds_mock.return_value = Interface("--user--", "--pass--")
+
+        with SMTPTransport() as transport:
+            assert send_email("a@example.com", "s", "m", transport=transport)
+            assert send_email("b@example.com", "s", "m", transport=transport)
+
+        smtp_mock.assert_called_once_with(
+            "smtp.gmail.com", 587, timeout=SMTP_CONNECT_TIMEOUT
+        )
+        get_creds_mock.assert_called_once_with()
+        server = smtp_mock.return_value
+        server.sock.settimeout.assert_called_once_with(SMTP_READ_TIMEOUT)
+        server.starttls.assert_called_once_with()
+        server.login.assert_called_once_with("--user--", "--pass--")
+        assert server.sendmail.call_count == 2
+        server.quit.assert_called_once_with()
+
+    def test_reconnect(self, get_creds_mock, smtp_mock):
+        get_creds_mock.return_value = Interface("--user--", "--pass--")
+        dropped, server = mock.MagicMock(), mock.MagicMock()
+        dropped.sendmail.side_effect = SMTPServerDisconnected("dropped")
+        smtp_mock.side_effect = [dropped, server]
+
+        with SMTPTransport() as transport:
+            transport.sendmail("--user--", ["a@example.com"], "message")
+            assert transport.server is server
+
+        assert smtp_mock.call_count == 2
+        dropped.quit.assert_not_called()
+        server.sendmail.assert_called_once_with(
+            "--user--", ["a@example.com"], "message"
+        )
+        server.quit.assert_called_once_with()
+
+    def test_close_error(self, get_creds_mock, smtp_mock):
+        smtp_mock.return_value.quit.side_effect = SMTPServerDisconnected("closed")
+
+        transport = SMTPTransport()
+        transport.connect()
+        transport.close()
+        assert transport.server is None
+
+    @mock.patch("smtplib.SMTP_SSL")
+    def test_ssl(self, ssl_mock, get_creds_mock, smtp_mock):
+        transport = SMTPTransport("mail.example.com", 465, security="ssl")
+        transport.connect()
+
+        smtp_mock.assert_not_called()
+        ssl_mock.assert_called_once_with(
+            "mail.example.com", 465, timeout=SMTP_CONNECT_TIMEOUT
+        )
+        ssl_mock.return_value.starttls.assert_not_called()
+        ssl_mock.return_value.login.assert_called_once()
+
+    def test_no_security(self, get_creds_mock, smtp_mock):
+        transport = SMTPTransport("localhost", 25, security="none")
+        transport.connect()
+
+        smtp_mock.return_value.starttls.assert_not_called()
+
+    def test_invalid_security(self, get_creds_mock, smtp_mock):
+        with pytest.raises(ValueError, match="Invalid SMTP security: 'tls'"):
+            SMTPTransport(security="tls")
+
+
+def test_maildir(tmp_path):
+    path = tmp_path / "mail"
+    with MaildirTransport(path) as transport:
+        assert send_email("a@example.com", "subject 1", "message", transport=transport)
+        assert send_email("b@example.com", "subject 2", "message", transport=transport)
+
+    subjects = sorted(x["Subject"] for x in mailbox.Maildir(path.as_posix()))
+    assert subjects == ["subject 1", "subject 2"]
+
+
+def test_jsonl(tmp_path):
+    path = tmp_path / "mail.jsonl"
+    with JSONLTransport(path) as transport:
+        assert send_email("a@example.com", "día", "message", transport=transport)
+    with JSONLTransport(path) as transport:
+        assert send_email("b@example.com", "subject", "message", transport=transport)
+
+    emails = [json.loads(x) for x in path.read_text("utf-8").splitlines()]
+    assert [(x["to"], x["subject"]) for x in emails] == [
+        (["a@example.com"], "día"),
+        (["b@example.com"], "subject"),
+    ]
+    assert all(x["from"] == transport.sender for x in emails)
+
+
+def test_memory():
+    MemoryTransport.clear()
+    MemoryTransport().sendmail("a@example.com", ("b@example.com",), "message")
+
+    assert MemoryTransport.sent == [("a@example.com", ["b@example.com"], "message")]
+    MemoryTransport.clear()
+    assert MemoryTransport.sent == []
+
+
+@pytest.mark.parametrize(
+    "name, cls",
+    [
+        ("smtp", SMTPTransport),
+        ("maildir", MaildirTransport),
+        ("jsonl", JSONLTransport),
+        ("memory", MemoryTransport),
+    ],
+)
+def test_open_transport(name, cls):
+    assert type(open_transport(name)) is cls
+
+
+def test_open_transport_settings(tmp_path):
+    settings = Settings(email_transport="memory")
+    assert type(open_transport(settings=settings)) is MemoryTransport
+
+    settings = Settings(email_transport="jsonl", email_sink_path=tmp_path / "x")
+    transport = open_transport(settings=settings)
+    assert type(transport) is JSONLTransport
+    assert transport.path == tmp_path / "x"
+
+    settings = Settings(smtp_host="localhost", smtp_port=25, smtp_security="none")
+    transport = open_transport("smtp", settings)
+    assert (transport.host, transport.port, transport.security) == (
+        "localhost",
+        25,
+        "none",
+    )
+
+
+def test_open_transport_unknown():
+    with pytest.raises(ValueError, match="Unknown transport 'pigeon'"):
+        open_transport("pigeon")
@@ -1,14 +1,50 @@
-from datetime import datetime
+from datetime import date, datetime
 
 import pytest
 
-from lens_db.utils import today_date, exception_exit
+from lens_db.utils import (
+    backoff,
+    exception_exit,
+    from_ordinal,
+    to_ordinal,
+    today_date,
+)
 
 
 def test_today_date():
     assert today_date() == datetime.today().date()
 
 
+@pytest.mark.parametrize(
+    "attempt, expected", [(0, 1), (1, 2), (3, 8), (5, 30), (10**4, 30)]
+)
+def test_backoff(attempt, expected):
+    for _ in range(20):
+        assert expected / 2 <= backoff(attempt, 1, 30) <= expected
+
+
+ordinals = (
+    ("0001-01-01", 1),
+    ("0999-12-31", date(999, 12, 31).toordinal()),
+    ("2019-12-27", 737420),
+    ("2020-02-29", date(2020, 2, 29).toordinal()),
+)
+
+
+@pytest.mark.parametrize("time_str, ordinal", ordinals)
+def test_to_ordinal(time_str, ordinal):
+    assert to_ordinal(time_str) == ordinal
+
+
+@pytest.mark.parametrize("time_str, ordinal", ordinals)
+def test_from_ordinal(time_str, ordinal):
+    assert from_ordinal(ordinal) == time_str
+
+
+def test_from_ordinal_none():
+    assert from_ordinal(None) is None
+
+
 exceptions = (
     (ValueError, "Invalid path"),
     (TypeError, ("Invalid type", "Expected int")),
@@ -0,0 +1,154 @@
+import threading
+import time
+from datetime import date
+from unittest import mock
+
+import pytest
+
+from lens_db.core import Outbox
+from lens_db.worker import DeliverResult, Worker, deliver, run_worker
+
+
+@pytest.fixture
+def outbox(database):
+    Outbox.enqueue(1, date(2019, 12, 10), "today", "a@example.com", "s1", "m1")
+    Outbox.enqueue(1, date(2019, 12, 10), "expired", "b@example.com", "s2", "m2")
+
+
+@pytest.fixture
+def send_email():
+    with mock.patch("lens_db.worker.send_email", return_value=True) as send_email:
+        yield send_email
+
+
+def test_deliver(outbox, send_email):
+    assert deliver() == DeliverResult(2, 0)
+
+    assert [x[0][:3] for x in send_email.call_args_list] == [
+        ("a@example.com", "s1", "m1"),
+        ("b@example.com", "s2", "m2"),
+    ]
+    assert send_email.call_args_list[0][1]["transport"] is (
+        send_email.call_args_list[1][1]["transport"]
+    )
+    assert Outbox.take(now=10**12) == []
+
+
+def test_deliver_digest(outbox, send_email):
+    Outbox.enqueue(1, date(2019, 12, 1), "today", "a@example.com", "s3", "m3")
+
+    assert deliver() == DeliverResult(3, 0)
+    assert [x[0][:3] for x in send_email.call_args_list] == [
+        ("a@example.com", "s1 (y 1 más)", "s1: m1\n\ns3: m3"),
+        ("b@example.com", "s2", "m2"),
+    ]
+    assert Outbox.take(now=10**12) == []
+
+
+def test_deliver_digest_error(outbox, send_email):
+    Outbox.enqueue(1, date(2019, 12, 1), "today", "a@example.com", "s3", "m3")
+    send_email.side_effect = [False, True]
+
+    assert deliver(retry_delay=60) == DeliverResult(1, 2)
+    emails = Outbox.take(now=time.time() + 61)
+    assert sorted((x.subject, x.attempts) for x in emails) == [("s1", 1), ("s3", 1)]
+
+
+def test_deliver_empty(database, send_email):
+    assert deliver() == DeliverResult(0, 0)
+    send_email.assert_not_called()
+
+
+def test_deliver_error(outbox, send_email, caplog):
+    send_email.side_effect = [False, True]
+
+    assert deliver(retry_delay=60) == DeliverResult(1, 1)
+
+    assert Outbox.take() == []
+    emails = Outbox.take(now=time.time() + 61)
+    assert [(x.destination, x.attempts) for x in emails] == [("a@example.com", 1)]
+    assert "Could not send email 1 to 'a@example.com' (attempt 1)" in caplog.text
+
+
+def test_deliver_breaker_open(outbox, send_email):
+    with mock.patch("lens_db.worker.breaker") as breaker:
+        breaker.allow.side_effect = [True, True, False]
+        assert deliver() == DeliverResult(1, 0)
+
+        breaker.allow.side_effect = None
+        breaker.allow.return_value = False
+        assert deliver() == DeliverResult(0, 0)
+
+    send_email.assert_called_once()
+    # The second email is still leased
+    assert Outbox.take() == []
+
+
+@mock.patch("lens_db.worker.limiter")
+def test_deliver_rate_limit(limiter, outbox, send_email):
+    # Only one email can be sent before the lease expires
+    limiter.rate = 0.1
+    assert deliver(retry_delay=10) == DeliverResult(1, 0)
+
+
+def test_deliver_limit(outbox, send_email):
+    assert deliver(limit=1) == DeliverResult(1, 0)
+    assert deliver(limit=1) == DeliverResult(1, 0)
+    assert deliver(limit=1) == DeliverResult(0, 0)
+
+
+class TestWorker:
+    @mock.patch("lens_db.worker.deliver")
+    def test_wake_stop(self, deliver_mock):
+        delivered = threading.Event()
+        deliver_mock.side_effect = lambda: delivered.set() or DeliverResult(0, 0)
+
+        worker = Worker(poll_interval=60)
+        worker.start()
+        assert delivered.wait(1)
+
+        delivered.clear()
+        worker.wake()
+        assert delivered.wait(1)
+
+        worker.stop(timeout=1)
+        assert not worker.thread.is_alive()
+
+    @mock.patch("lens_db.worker.deliver")
+    def test_drains_batches(self, deliver_mock):
+        worker = Worker(poll_interval=60)
+
+        def deliver():
+            if deliver_mock.call_count == 3:
+                worker.stop()
+            return DeliverResult(100, 0)
+
+        deliver_mock.side_effect = deliver
+        worker.run()
+
+        # Full batches are followed by another one without waiting
+        assert deliver_mock.call_count == 3
+
+    @mock.patch("lens_db.worker.deliver")
+    def test_error(self, deliver_mock, caplog):
+        worker = Worker(poll_interval=0)
+
+        def deliver():
+            if deliver_mock.call_count == 1:
+                raise ValueError("error")
+            worker.stop()
+            return DeliverResult(0, 0)
+
+        deliver_mock.side_effect = deliver
+        worker.run()
+
+        assert deliver_mock.call_count == 2
+        assert "Error delivering emails" in caplog.text
+
+
+@mock.patch("lens_db.worker.deliver")
+def test_run_worker_once(deliver_mock):
+    deliver_mock.side_effect = [DeliverResult(100, 0), DeliverResult(2, 1)]
+
+    run_worker(once=True)
+    assert deliver_mock.call_count == 2